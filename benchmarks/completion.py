@@ -0,0 +1,97 @@
+"""Completing from the precompiled index vs inferring with jedi.
+
+Both work on a copy of the packaged stubs with the layers of a SAMD21 board.
+The first completion of a session includes opening the index or parsing the
+stubs (with an empty jedi cache), the rest are averaged. jedi lists more
+names, because it adds the members inherited from object and the module
+attributes like __name__.
+
+    python -m benchmarks.completion
+"""
+import os.path
+import shutil
+import tempfile
+import time
+
+import jedi
+
+from thonnycontrib.circuitpython.firmware_info import parse_banner
+from thonnycontrib.circuitpython.stub_layers import PACKAGED_STUBS_PATH, StubLayers,\
+    select_layers
+
+BANNER = parse_banner(
+    "Adafruit CircuitPython 7.3.0 on 2022-05-23; Adafruit Feather M0 Express with samd21g18")
+
+# Typical completions in CircuitPython scripts
+SOURCES = [
+    "import dig",
+    "import digitalio\ndigitalio.",
+    "import busio\nbusio.I2C.",
+    "from time import mono",
+    "import microcontroller\nmicrocontroller.",
+]
+REPEATS = 20
+
+
+def complete_with_index(layers, source):
+    entries, _ = layers.complete(source.split("\n")[-1])
+    return [name for name, _, _ in entries]
+
+
+def complete_with_jedi(paths, source):
+    lines = source.split("\n")
+    if hasattr(jedi.Script, "complete"):
+        # jedi 0.16+
+        project = jedi.Project(paths[0], sys_path=paths, smart_sys_path=False)
+        completions = jedi.Script(source, project=project).complete(len(lines), len(lines[-1]))
+    else:
+        completions = jedi.Script(source, len(lines), len(lines[-1]),
+                                  sys_path=paths).completions()
+    return [completion.name for completion in completions]
+
+
+def measure(complete):
+    start_time = time.time()
+    first_results = [complete(source) for source in SOURCES]
+    first_time = time.time() - start_time
+
+    start_time = time.time()
+    for _ in range(REPEATS):
+        for source in SOURCES:
+            complete(source)
+    warm_time = (time.time() - start_time) / REPEATS / len(SOURCES)
+    return first_time, warm_time, first_results
+
+
+def main():
+    temp_dir = tempfile.mkdtemp()
+    try:
+        root = shutil.copytree(PACKAGED_STUBS_PATH, os.path.join(temp_dir, "api_stubs"))
+        jedi.settings.cache_directory = os.path.join(temp_dir, "jedi_cache")
+        layer_specs = select_layers(BANNER, root)
+
+        layers = StubLayers(layer_specs, os.path.join(temp_dir, "overrides"))
+        try:
+            index_first, index_warm, index_results = measure(
+                lambda source: complete_with_index(layers, source))
+            paths = layers.get_paths()
+        finally:
+            layers.close()
+        jedi_first, jedi_warm, jedi_results = measure(
+            lambda source: complete_with_jedi(paths, source))
+    finally:
+        shutil.rmtree(temp_dir)
+
+    for source, index_names, jedi_names in zip(SOURCES, index_results, jedi_results):
+        print("%-42r index: %3d names, jedi: %3d names"
+              % (source, len(index_names), len(jedi_names)))
+    print()
+    print("                   index      jedi")
+    print("First %d:       %7.1f ms %7.1f ms" % (len(SOURCES), index_first * 1000, jedi_first * 1000))
+    print("One, warm:     %7.2f ms %7.2f ms" % (index_warm * 1000, jedi_warm * 1000))
+    print("Speedup (first):  %6.1fx" % (jedi_first / index_first))
+    print("Speedup (warm):   %6.1fx" % (jedi_warm / index_warm))
+
+
+if __name__ == "__main__":
+    main()
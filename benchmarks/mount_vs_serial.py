@@ -0,0 +1,68 @@
+"""Listing and reading files through the mounted volume vs through the REPL.
+
+A temporary directory poses as the CIRCUITPY volume and a simulated device
+holds the same files.
+
+    python -m benchmarks.mount_vs_serial
+"""
+import os.path
+import shutil
+import tempfile
+import time
+
+from tests.simulated_device import SimulatedSerial
+from thonnycontrib.circuitpython.device import Device, SerialLink
+from thonnycontrib.circuitpython.fs_index import walk_mount
+
+# code.py and a /lib with some bundle libraries
+FILES = dict([("/code.py", b"import board\n" * 50)]
+             + [("/lib/adafruit_lib_%02d.py" % i, os.urandom(2000)) for i in range(40)])
+READ_PATH = "/lib/adafruit_lib_00.py"
+
+EXCHANGE_TIME = 0.03
+BYTE_TIME = 1 / 11520
+REPEATS = 3
+
+
+def measure(function):
+    start_time = time.time()
+    for _ in range(REPEATS):
+        function()
+    return (time.time() - start_time) / REPEATS
+
+
+def main():
+    mount = tempfile.mkdtemp()
+    serial = SimulatedSerial(FILES, exchange_time=EXCHANGE_TIME, byte_time=BYTE_TIME)
+    device = Device(SerialLink(serial))
+    try:
+        for path, content in FILES.items():
+            host_path = os.path.join(mount, path.strip("/"))
+            os.makedirs(os.path.dirname(host_path), exist_ok=True)
+            with open(host_path, "wb") as fp:
+                fp.write(content)
+
+        def read_via_mount():
+            with open(os.path.join(mount, READ_PATH.strip("/")), "rb") as fp:
+                return fp.read()
+
+        device.connect()
+        assert len(walk_mount(mount)) == len(device.list_files())
+        assert read_via_mount() == device.read_file(READ_PATH)
+
+        results = [
+            ("List via mount", measure(lambda: walk_mount(mount))),
+            ("List via serial", measure(device.list_files)),
+            ("Read via mount", measure(read_via_mount)),
+            ("Read via serial", measure(lambda: device.read_file(READ_PATH))),
+        ]
+    finally:
+        device.close()
+        shutil.rmtree(mount)
+
+    for name, duration in results:
+        print("%-16s %8.2f ms" % (name, duration * 1000))
+
+
+if __name__ == "__main__":
+    main()
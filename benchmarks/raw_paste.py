@@ -0,0 +1,39 @@
+"""Throughput of uploading a file in raw mode vs raw-paste mode.
+
+    python -m benchmarks.raw_paste
+"""
+import os
+import tempfile
+import time
+
+from tests.simulated_device import SimulatedSerial
+from thonnycontrib.circuitpython.device import Device, SerialLink
+
+SIZE = 20 * 1024
+
+
+def measure(raw_paste, source):
+    serial = SimulatedSerial(raw_paste=raw_paste)
+    device = Device(SerialLink(serial))
+    device.connect()
+    try:
+        start_time = time.time()
+        device.upload(source, "/data.bin")
+        return time.time() - start_time
+    finally:
+        device.close()
+
+
+def main():
+    with tempfile.NamedTemporaryFile(delete=False) as fp:
+        fp.write(os.urandom(SIZE))
+    try:
+        for name, raw_paste in [("raw", False), ("raw-paste", True)]:
+            duration = measure(raw_paste, fp.name)
+            print("%-10s %6.2f s %8.1f KB/s" % (name, duration, SIZE / 1024 / duration))
+    finally:
+        os.remove(fp.name)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""Latency of resolving the boot and main script paths on a simulated device.
+
+Before: the proxy listed the root directory once for the boot script and once
+for the main script. After: one probe stats the eight candidates on the device.
+
+    python -m benchmarks.script_paths
+"""
+import time
+
+from tests.simulated_device import SimulatedSerial
+from thonnycontrib.circuitpython.device import Device, SerialLink, PROBE_SCRIPT_PATHS_SCRIPT
+
+# A board with the usual files and some libraries in the root
+FILES = dict([("/boot_out.txt", b"Adafruit CircuitPython 7.3.0\r\n"),
+              ("/code.py", b"import board\n"),
+              ("/settings.toml", b"")]
+             + [("/helper_%02d.py" % i, b"x = 1\n") for i in range(20)])
+
+LIST_ROOT_SCRIPT = "import os as __os_; print(__os_.listdir()); del __os_"
+
+# Compiling and answering a small script on a SAMD21 board over USB CDC
+EXCHANGE_TIME = 0.03
+BYTE_TIME = 1 / 11520
+REPEATS = 10
+
+
+def measure(device, scripts):
+    start_time = time.time()
+    for _ in range(REPEATS):
+        for script in scripts:
+            out, err = device.execute(script)
+            assert not err, err
+    return (time.time() - start_time) / REPEATS
+
+
+def main():
+    serial = SimulatedSerial(FILES, exchange_time=EXCHANGE_TIME, byte_time=BYTE_TIME)
+    device = Device(SerialLink(serial))
+    device.connect()
+    try:
+        before = measure(device, [LIST_ROOT_SCRIPT, LIST_ROOT_SCRIPT])
+        after = measure(device, [PROBE_SCRIPT_PATHS_SCRIPT])
+    finally:
+        device.close()
+
+    print("Two root listings: %6.1f ms" % (before * 1000))
+    print("One probe:         %6.1f ms" % (after * 1000))
+    print("Speedup:           %6.1fx" % (before / after))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""Copying a firmware image the old way (16 KB blocks, fsync after each)
+vs with copy_firmware (growing blocks, one fsync at the end).
+
+    python -m benchmarks.uf2_copy [target directory]
+
+The target defaults to a temporary directory. Giving a USB stick or a
+bootloader volume shows the difference on real hardware.
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from thonnycontrib.circuitpython.flashing import copy_firmware
+
+IMAGE_SIZE = 1536 * 1024
+OLD_BLOCK_SIZE = 16 * 1024
+
+
+def copy_old_way(source, target):
+    with open(source, "rb") as fsrc, open(target, "wb") as fdst:
+        while True:
+            buf = fsrc.read(OLD_BLOCK_SIZE)
+            if not buf:
+                break
+            fdst.write(buf)
+            fdst.flush()
+            os.fsync(fdst)
+
+
+def measure(copy, source, target_dir):
+    target = os.path.join(target_dir, "firmware.uf2")
+    start_time = time.time()
+    copy(source, target)
+    duration = time.time() - start_time
+    os.remove(target)
+    return duration
+
+
+def main():
+    temp_dir = tempfile.mkdtemp()
+    target_dir = sys.argv[1] if len(sys.argv) > 1 else temp_dir
+    try:
+        source = os.path.join(temp_dir, "source.uf2")
+        with open(source, "wb") as fp:
+            fp.write(os.urandom(IMAGE_SIZE))
+
+        for name, copy in [("16 KB blocks, fsync each", copy_old_way),
+                           ("copy_firmware", copy_firmware)]:
+            duration = measure(copy, source, target_dir)
+            print("%-26s %7.3f s %8.1f MB/s"
+                  % (name, duration, IMAGE_SIZE / 1024 / 1024 / duration))
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+if __name__ == "__main__":
+    main()
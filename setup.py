@@ -55,7 +55,7 @@ In later versions this functionality is included in the main package.
       platforms=["Windows", "macOS", "Linux"],
       python_requires=">=3.5",
       include_package_data=True,
-	  package_data={'thonnycontrib.circuitpython': ['api_stubs/*']},
+	  package_data={'thonnycontrib.circuitpython': ['api_stubs/*', 'api_stubs/layers/*/*', 'boards.json']},
       install_requires=requirements,
       packages=["thonnycontrib.circuitpython"],
 )
\ No newline at end of file
@@ -0,0 +1,371 @@
+"""Simulated CircuitPython device for tests and benchmarks.
+
+SimulatedSerial has the subset of pyserial's Serial interface which
+device.SerialLink uses, and it speaks the REPL protocols: normal mode, raw
+mode and raw-paste mode. Scripts sent to it are executed by CPython against
+an in-memory filesystem, with fake versions of the CircuitPython modules the
+backend's scripts use (os, microcontroller, storage, supervisor, gc).
+create_uf2 writes a minimal firmware image with a banner in its payload,
+create_uf2_block builds blocks for other images.
+
+    serial = SimulatedSerial(files={"/code.py": b"print(1)"})
+    device = Device(SerialLink(serial))
+    device.connect()
+
+PtyDevice serves a SimulatedSerial behind a pseudo-terminal (POSIX only), so
+a real pyserial Serial can open it and the data goes through OS buffers,
+arriving in pieces as from a USB port:
+
+    pty_device = PtyDevice(SimulatedSerial())
+    device = Device(SerialLink.open(pty_device.port_name))
+"""
+import builtins
+import io
+import os
+import select
+import struct
+import threading
+import time
+import types
+
+from thonnycontrib.circuitpython.uf2 import MAGIC_START0, MAGIC_START1, MAGIC_END,\
+    FLAG_FAMILY_ID_PRESENT, BLOCK_SIZE
+
+SAMD21_FAMILY_ID = 0x68ed2b88
+
+BANNER = "Adafruit CircuitPython 7.3.0 on 2022-05-23; Adafruit Feather M0 Express with samd21g18"
+RAW_PROMPT = b"raw REPL; CTRL-B to exit\r\n>"
+
+_DIR_MODE = 0x4000
+_FILE_MODE = 0x8000
+
+
+def create_uf2_block(address, payload, block_no=0, num_blocks=1,
+                     flags=FLAG_FAMILY_ID_PRESENT, family_id=SAMD21_FAMILY_ID,
+                     magic_start0=MAGIC_START0):
+    """Returns one 512-byte UF2 block"""
+    block = struct.pack("<8I", magic_start0, MAGIC_START1, flags, address, len(payload),
+                        block_no, num_blocks, family_id) + payload
+    return block.ljust(BLOCK_SIZE - 4, b"\x00") + struct.pack("<I", MAGIC_END)
+
+
+def create_uf2(path, banner=BANNER):
+    """Writes a one-block SAMD21 image to path (pathlib.Path), returns path as str"""
+    path.write_bytes(create_uf2_block(0x2000, banner.encode("utf-8").ljust(256, b"\x00")))
+    return str(path)
+
+
+class SimulatedFilesystem:
+    """Files (path -> bytes) and directories of the device"""
+    def __init__(self, files=None, label="CIRCUITPY"):
+        self.files = {}
+        self.dirs = {"/"}
+        self.label = label
+        for path, content in (files or {}).items():
+            self.write(path, content)
+
+    def write(self, path, content):
+        parent = path.rsplit("/", 1)[0] or "/"
+        while parent not in self.dirs:
+            self.dirs.add(parent)
+            parent = parent.rsplit("/", 1)[0] or "/"
+        self.files[path] = bytes(content)
+
+    def listdir(self, path="/"):
+        path = self._normalize(path)
+        if path not in self.dirs:
+            raise OSError(2, "No such directory", path)
+        prefix = path.rstrip("/") + "/"
+        return sorted({entry[len(prefix):].split("/")[0]
+                       for entry in list(self.files) + list(self.dirs)
+                       if entry.startswith(prefix) and entry != prefix})
+
+    def stat(self, path):
+        path = self._normalize(path)
+        if path in self.dirs:
+            return (_DIR_MODE, 0, 0, 0, 0, 0, 0, 0, 0, 0)
+        if path in self.files:
+            return (_FILE_MODE, 0, 0, 0, 0, 0, len(self.files[path]), 0, 1000, 0)
+        raise OSError(2, "No such file", path)
+
+    def remove(self, path):
+        path = self._normalize(path)
+        if path not in self.files:
+            raise OSError(2, "No such file", path)
+        del self.files[path]
+
+    def mkdir(self, path):
+        path = self._normalize(path)
+        if path in self.dirs or path in self.files:
+            raise OSError(17, "Exists", path)
+        self.dirs.add(path)
+
+    def open(self, path, mode="r"):
+        path = self._normalize(path)
+        if "w" in mode:
+            filesystem = self
+
+            class WrittenFile(io.BytesIO):
+                def write(self, data):
+                    return io.BytesIO.write(self, data.encode("utf-8")
+                                            if isinstance(data, str) else data)
+
+                def close(self):
+                    if not self.closed:
+                        filesystem.write(path, self.getvalue())
+                    io.BytesIO.close(self)
+
+            return WrittenFile()
+
+        if path not in self.files:
+            raise OSError(2, "No such file", path)
+        content = self.files[path]
+        return io.BytesIO(content) if "b" in mode else io.StringIO(content.decode("utf-8"))
+
+    def _normalize(self, path):
+        if not path.startswith("/"):
+            path = "/" + path
+        return path if path == "/" else path.rstrip("/")
+
+
+class DeviceReset(Exception):
+    """Raised inside the simulated interpreter by microcontroller.reset()"""
+
+
+class SimulatedSerial:
+    """The device as seen through its USB serial port.
+
+    raw_paste: True if the firmware supports raw-paste mode, False if it
+    answers that it doesn't, None if it predates the protocol.
+    exchange_time: seconds the device spends on each script (compiling,
+    USB latency), byte_time: seconds per transferred byte.
+    on_reset is called with the requested run mode ("BOOTLOADER", "UF2" or
+    None) when a script resets the device. The port is gone afterwards.
+    """
+    def __init__(self, files=None, label="CIRCUITPY", uid=b"\x12\x34\x56\x78",
+                 banner=BANNER, raw_paste=True, window_size=128,
+                 exchange_time=0, byte_time=0, mem_free=20000, autoreload=True,
+                 on_reset=None):
+        self.filesystem = SimulatedFilesystem(files, label)
+        self.uid = uid
+        self.banner = banner
+        self.raw_paste = raw_paste
+        self.window_size = window_size
+        self.exchange_time = exchange_time
+        self.byte_time = byte_time
+        self.mem_free = mem_free
+        self.autoreload = autoreload
+        self.on_reset = on_reset
+
+        self.scripts = []
+        self.soft_reboots = 0
+        self.disconnected = False
+        self.closed = False
+
+        self._out = bytearray()
+        self._input = bytearray()
+        self._mode = "normal"
+        self._pasted = 0
+        self._next_run_mode = None
+        self._namespace = {"__builtins__" : self._create_builtins()}
+
+    @property
+    def in_waiting(self):
+        self._check_connected()
+        return len(self._out)
+
+    def read(self, size=1):
+        self._check_connected()
+        if not self._out:
+            # like a read timeout of a real port, without spinning
+            time.sleep(0.001)
+        data = bytes(self._out[:size])
+        del self._out[:size]
+        return data
+
+    def write(self, data):
+        self._check_connected()
+        if self.byte_time:
+            time.sleep(len(data) * self.byte_time)
+        for i in range(len(data)):
+            self._receive(data[i : i + 1])
+            if self.disconnected:
+                break
+        return len(data)
+
+    def close(self):
+        self.closed = True
+
+    def _check_connected(self):
+        if self.disconnected or self.closed:
+            raise OSError("Device is not connected")
+
+    def _receive(self, byte):
+        if self._mode == "paste":
+            self._receive_pasted(byte)
+        elif byte == b"\x03":
+            self._input.clear()
+        elif byte == b"\x01" and self._input != b"\x05A":
+            self._mode = "raw"
+            self._input.clear()
+            self._out += RAW_PROMPT
+        elif byte == b"\x02":
+            self._mode = "normal"
+            self._input.clear()
+            self._out += ("\r\n" + self.banner + "\r\n>>> ").encode("utf-8")
+        elif self._mode == "normal":
+            if byte == b"\x04":
+                self.soft_reboots += 1
+                self._out += b"soft reboot\r\n"
+            # typed characters are not interesting
+        elif byte == b"\x01":
+            # \x05A\x01
+            self._input.clear()
+            if self.raw_paste:
+                self._mode = "paste"
+                self._pasted = 0
+                self._out += b"R\x01" + struct.pack("<H", self.window_size)
+            elif self.raw_paste is False:
+                self._out += b"R\x00"
+            else:
+                # unknown command, raw mode gets re-entered
+                self._out += RAW_PROMPT
+        elif byte == b"\x04":
+            script = self._input.decode("utf-8")
+            self._input.clear()
+            self._out += b"OK"
+            self._run(script)
+        else:
+            self._input += byte
+
+    def _receive_pasted(self, byte):
+        if byte == b"\x04":
+            script = self._input.decode("utf-8")
+            self._input.clear()
+            self._mode = "raw"
+            self._out += b"\x04"
+            self._run(script)
+            return
+
+        self._input += byte
+        self._pasted += 1
+        if self._pasted % self.window_size == 0:
+            self._out += b"\x01"
+
+    def _run(self, script):
+        if self.exchange_time:
+            time.sleep(self.exchange_time)
+        self.scripts.append(script)
+        self._stdout = io.StringIO()
+        err = b""
+        try:
+            exec(script, self._namespace)
+        except DeviceReset:
+            self.disconnected = True
+            self._out.clear()
+            if self.on_reset is not None:
+                self.on_reset(self._next_run_mode)
+            return
+        except Exception as e:
+            err = ("Traceback (most recent call last):\r\n%s: %s\r\n"
+                   % (type(e).__name__, e)).encode("utf-8")
+        out = self._stdout.getvalue().replace("\n", "\r\n").encode("utf-8")
+        if self.byte_time:
+            time.sleep((len(out) + len(err)) * self.byte_time)
+        self._out += out + b"\x04" + err + b"\x04>"
+
+    def _print(self, *args, sep=" ", end="\n"):
+        self._stdout.write(sep.join(str(arg) for arg in args) + end)
+
+    def _create_builtins(self):
+        result = dict(vars(builtins))
+        modules = self._create_modules()
+
+        def import_module(name, globals=None, locals=None, fromlist=(), level=0):
+            if name in modules:
+                return modules[name]
+            raise ImportError("no module named '%s'" % name)
+
+        result["__import__"] = import_module
+        result["print"] = self._print
+        result["open"] = self.filesystem.open
+        return result
+
+    def _create_modules(self):
+        device = self
+        filesystem = self.filesystem
+
+        os_module = types.ModuleType("os")
+        os_module.listdir = filesystem.listdir
+        os_module.stat = filesystem.stat
+        os_module.remove = filesystem.remove
+        os_module.mkdir = filesystem.mkdir
+
+        def on_next_reset(run_mode):
+            device._next_run_mode = run_mode
+
+        def reset():
+            raise DeviceReset()
+
+        microcontroller = types.ModuleType("microcontroller")
+        microcontroller.cpu = types.SimpleNamespace(uid=bytearray(self.uid))
+        microcontroller.RunMode = types.SimpleNamespace(
+            NORMAL="NORMAL", SAFE_MODE="SAFE_MODE", BOOTLOADER="BOOTLOADER")
+        microcontroller.on_next_reset = on_next_reset
+        microcontroller.reset = reset
+
+        storage = types.ModuleType("storage")
+        storage.getmount = lambda path: types.SimpleNamespace(label=filesystem.label)
+
+        class Runtime:
+            @property
+            def autoreload(self):
+                return device.autoreload
+
+            @autoreload.setter
+            def autoreload(self, value):
+                device.autoreload = value
+
+        supervisor = types.ModuleType("supervisor")
+        supervisor.runtime = Runtime()
+
+        gc = types.ModuleType("gc")
+        gc.collect = lambda: None
+        gc.mem_free = lambda: device.mem_free
+
+        return {"os" : os_module, "microcontroller" : microcontroller,
+                "storage" : storage, "supervisor" : supervisor, "gc" : gc}
+
+
+class PtyDevice:
+    """SimulatedSerial on the master side of a pseudo-terminal"""
+    def __init__(self, serial):
+        import pty
+        import tty
+        self.serial = serial
+        self._master_fd, self._slave_fd = pty.openpty()
+        # no echo, no line editing, no newline translation
+        tty.setraw(self._slave_fd)
+        self.port_name = os.ttyname(self._slave_fd)
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self._stopped.set()
+        self._thread.join()
+        os.close(self._master_fd)
+        os.close(self._slave_fd)
+
+    def _serve(self):
+        try:
+            while not self._stopped.is_set():
+                readable, _, _ = select.select([self._master_fd], [], [], 0.01)
+                if readable:
+                    self.serial.write(os.read(self._master_fd, 4096))
+                waiting = self.serial.in_waiting
+                if waiting:
+                    os.write(self._master_fd, self.serial.read(waiting))
+        except OSError:
+            # device got reset or closed
+            pass
@@ -0,0 +1,48 @@
+import json
+from types import SimpleNamespace
+
+from thonnycontrib.circuitpython.boards import load_board_database, USER_DATABASE_FILE_NAME,\
+    DEFAULT_MOUNT_LABEL
+from thonnycontrib.circuitpython.pins import find_unknown_pins
+
+
+def test_packaged_pins():
+    database = load_board_database()
+    board = database.lookup(0x239A, 0x8023)
+    assert board.name == "Adafruit Feather M0 Express"
+    assert board.mount_label == DEFAULT_MOUNT_LABEL
+    # boards with the same layout share the set
+    assert board.pins is database.lookup(0x239A, 0x801B).pins
+    assert [name for name, _, _ in board.pins.complete("A")] == ["A0", "A1", "A2", "A3", "A4", "A5"]
+    assert find_unknown_pins("import board\nboard.D13\nboard.GP0\n", board.pins) == [(3, "GP0")]
+    # known board without known pins
+    assert database.lookup(0x239A, 0x8028).pins is None
+
+
+def test_user_boards_refer_to_packaged_pin_sets(tmp_path):
+    (tmp_path / USER_DATABASE_FILE_NAME).write_text(json.dumps({
+        "pin_sets" : {"custom" : ["X1", "X2"]},
+        "boards" : [
+            {"vid" : "0x1209", "pid" : "0x0001", "name" : "Pico clone",
+             "pin_set" : "raspberry_pi_pico", "mount_label" : "PICOCLONE"},
+            {"vid" : "0x1209", "pid" : "0x0002", "name" : "Custom", "pin_set" : "custom"},
+        ]}))
+    database = load_board_database(str(tmp_path))
+
+    clone = database.lookup(0x1209, 0x0001)
+    assert clone.mount_label == "PICOCLONE"
+    assert "GP25" in clone.pins
+    assert len(database.lookup(0x1209, 0x0002).pins) == 2
+    assert database.lookup(0x239A, 0x80F4).pins is clone.pins
+
+
+def test_espressif_boards():
+    database = load_board_database()
+    assert database.lookup(0x303A, 0x80D7).name == "Unexpected Maker FeatherS3"
+    assert "NEOPIXEL_POWER" in database.lookup(0x239A, 0x8112).pins
+    # unknown Espressif boards are recognized by the vendor
+    port_info = SimpleNamespace(device="/dev/ttyACM0", vid=0x303A, pid=0x9999,
+                                description="ESP32-S3", interface=None)
+    assert database.describe_port(port_info) == "ESP32-S3 (/dev/ttyACM0)"
+    port_info.vid = 0x1234
+    assert database.describe_port(port_info) is None
@@ -0,0 +1,45 @@
+import json
+
+from tests.simulated_device import create_uf2
+from thonnycontrib.circuitpython import cli, firmware_info
+from thonnycontrib.circuitpython.firmware_info import CURRENT_UF2_FILE_NAME
+from thonnycontrib.circuitpython.volume_watcher import UF2_INFO_FILE_NAME
+
+
+def run_cli(argv, capsys):
+    exit_code = cli.main(argv)
+    return exit_code, json.loads(capsys.readouterr().out)
+
+
+def create_bootloader_volume(tmp_path, current_firmware=None):
+    volume = tmp_path / "FEATHERBOOT"
+    volume.mkdir()
+    (volume / UF2_INFO_FILE_NAME).write_text("Model: Feather M0\nBoard-ID: SAMD21G18A-Feather-v0\n")
+    if current_firmware is not None:
+        (volume / CURRENT_UF2_FILE_NAME).write_bytes(current_firmware)
+    return volume
+
+
+def test_flash_skips_identical_firmware(tmp_path, capsys):
+    image = create_uf2(tmp_path / "firmware.uf2")
+    with open(image, "rb") as fp:
+        volume = create_bootloader_volume(tmp_path, fp.read())
+
+    exit_code, result = run_cli(["flash", image, "--volume", str(volume)], capsys)
+    assert exit_code == 0
+    assert result["volumes"][str(volume)]["phase"] == "skipped"
+    assert not (volume / "firmware.uf2").exists()
+
+
+def test_flash_when_current_firmware_cant_be_read(tmp_path, capsys, monkeypatch):
+    def read_installed_banner(volume):
+        raise OSError("volume disappeared")
+
+    monkeypatch.setattr(firmware_info, "read_installed_banner", read_installed_banner)
+    image = create_uf2(tmp_path / "firmware.uf2")
+    volume = create_bootloader_volume(tmp_path)
+
+    exit_code, result = run_cli(["flash", image, "--volume", str(volume)], capsys)
+    assert exit_code == 0
+    assert result["volumes"][str(volume)] == {"phase" : "done", "message" : None}
+    assert (volume / "firmware.uf2").read_bytes() == (tmp_path / "firmware.uf2").read_bytes()
@@ -0,0 +1,73 @@
+from tests.simulated_device import SimulatedSerial
+from thonnycontrib.circuitpython.device import Device, SerialLink, PROBE_SCRIPT_PATHS_SCRIPT
+from thonnycontrib.circuitpython.volume_watcher import VolumeWatcher, UF2_INFO_FILE_NAME
+
+
+def connect(serial):
+    device = Device(SerialLink(serial))
+    device.connect()
+    return device
+
+
+def test_probe_finds_first_existing_scripts():
+    serial = SimulatedSerial({"/boot.py" : b"", "/settings.py" : b"",
+                              "/main.py" : b"", "/code.txt" : b""})
+    device = connect(serial)
+    scripts_before = len(serial.scripts)
+    out, err = device.execute(PROBE_SCRIPT_PATHS_SCRIPT)
+    assert err == b""
+    assert out.decode("utf-8").strip() == "settings.py,code.txt"
+    # one exchange
+    assert len(serial.scripts) == scripts_before + 1
+
+
+def test_probe_without_scripts():
+    out, err = connect(SimulatedSerial()).execute(PROBE_SCRIPT_PATHS_SCRIPT)
+    assert out.decode("utf-8").strip() == ","
+
+
+def test_list_files():
+    device = connect(SimulatedSerial({"/code.py" : b"print(1)", "/lib/a.py" : b"x = 1"}))
+    assert device.list_files() == [("/code.py", False, 8, 1000), ("/lib", True, 0, 0),
+                                   ("/lib/a.py", False, 5, 1000)]
+
+
+def test_enter_bootloader(tmp_path):
+    volumes = []
+
+    def on_reset(run_mode):
+        # bootloader mounts its volume some time after the reset
+        assert run_mode == "BOOTLOADER"
+        volume = tmp_path / "FEATHERBOOT"
+        volume.mkdir()
+        (volume / UF2_INFO_FILE_NAME).write_text("Model: Adafruit Feather M0 Express\n")
+        volumes.append(str(volume))
+
+    appeared = []
+    watcher = VolumeWatcher(appeared.append, None, list_candidates=lambda: volumes)
+    watcher.rescan()
+    serial = SimulatedSerial(on_reset=on_reset)
+    connect(serial).enter_bootloader()
+
+    assert serial.disconnected and serial.closed
+    watcher.rescan()
+    assert appeared == [str(tmp_path / "FEATHERBOOT")]
+
+
+class GarblingSerial(SimulatedSerial):
+    """Answers garbage instead of acknowledging pasted scripts once garbling is set"""
+    garbling = False
+
+    def _receive_pasted(self, byte):
+        if byte == b"\x04" and self.garbling:
+            self._out += b"?\x04"
+        else:
+            SimulatedSerial._receive_pasted(self, byte)
+
+
+def test_enter_bootloader_closes_after_unexpected_response():
+    serial = GarblingSerial()
+    device = connect(serial)
+    serial.garbling = True
+    device.enter_bootloader()
+    assert serial.closed
@@ -0,0 +1,37 @@
+from tests.simulated_device import create_uf2
+from thonnycontrib.circuitpython.firmware_library import FirmwareLibrary
+
+FEATHER_INFO = {"Model" : "Adafruit Feather M0 Express", "Board-ID" : "SAMD21G18A-Feather-v0"}
+
+
+def create_image(path, version):
+    return create_uf2(path, "Adafruit CircuitPython %s on 2023-02-06; "
+                            "Adafruit Feather M0 Express with samd21g18" % version)
+
+
+def test_prefers_board_id_over_model(tmp_path):
+    library = FirmwareLibrary(str(tmp_path / "library"))
+    # same Model, but installed to another kind of bootloader
+    other = create_image(tmp_path / "adafruit-circuitpython-other-en_US-9.0.0.uf2", "9.0.0")
+    library.import_file(other, [{"Board-ID" : "SAMD21E18A-Other-v0"}])
+    older = create_image(tmp_path / "adafruit-circuitpython-feather_m0_express-en_US-8.0.0.uf2",
+                         "8.0.0")
+    entry = library.import_file(older, [FEATHER_INFO])
+
+    assert library.find_newest(FEATHER_INFO)["hash"] == entry["hash"]
+    # without a known Board-ID the Model decides
+    assert library.find_newest({"Model" : "Adafruit Feather M0 Express"})["version"] == "9.0.0"
+    assert library.find_newest({"Model" : "Adafruit Metro M0 Express"}) is None
+
+
+def test_reimport_records_board_id(tmp_path):
+    image = create_image(tmp_path / "firmware.uf2", "8.0.0")
+    library = FirmwareLibrary(str(tmp_path / "library"))
+    first = library.import_file(image)
+    second = library.import_file(image, [FEATHER_INFO])
+
+    assert first["hash"] == second["hash"]
+    assert len(library.get_entries()) == 1
+    # the index is persistent
+    reloaded = FirmwareLibrary(str(tmp_path / "library"))
+    assert reloaded.find_newest({"Board-ID" : "SAMD21G18A-Feather-v0"})["hash"] == first["hash"]
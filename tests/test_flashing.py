@@ -0,0 +1,220 @@
+import os
+import threading
+import time
+
+import pytest
+
+from tests.simulated_device import create_uf2_block
+from thonnycontrib.circuitpython.firmware_info import CURRENT_UF2_FILE_NAME
+from thonnycontrib.circuitpython.flashing import FlashingJob, Throttle, CopyProgress,\
+    FlashingCancelled, copy_firmware, sum_progress, format_progress, verify_flashing,\
+    PHASE_CHECKING, PHASE_COPYING, PHASE_VERIFYING, PHASE_DONE, PHASE_SKIPPED, PHASE_CANCELLED,\
+    PHASE_FINISHED
+from thonnycontrib.circuitpython.uf2 import find_mismatches, Uf2Error
+from thonnycontrib.circuitpython.volume_watcher import UF2_INFO_FILE_NAME
+
+IMAGE_SIZE = 300 * 1024
+
+
+def create_image(tmp_path):
+    path = tmp_path / "firmware.uf2"
+    path.write_bytes(os.urandom(IMAGE_SIZE))
+    return str(path)
+
+
+def create_bootloader_volumes(tmp_path, count):
+    result = []
+    for i in range(count):
+        volume = tmp_path / ("BOOT%d" % i)
+        volume.mkdir()
+        (volume / UF2_INFO_FILE_NAME).write_text("Model: Feather M0\nBoard-ID: SAMD21G18A-Feather-v0\n")
+        result.append(str(volume))
+    return result
+
+
+def test_flashes_all_volumes(tmp_path):
+    image = create_image(tmp_path)
+    volumes = create_bootloader_volumes(tmp_path, 5)
+    job = FlashingJob(image, volumes, max_workers=3)
+    results = job.run()
+
+    assert sorted(results) == volumes
+    assert all(event.phase == PHASE_DONE for event in results.values())
+    with open(image, "rb") as fp:
+        content = fp.read()
+    for volume in volumes:
+        with open(os.path.join(volume, "firmware.uf2"), "rb") as fp:
+            assert fp.read() == content
+    assert job.get_events()[-1].phase == PHASE_FINISHED
+
+
+def test_event_order(tmp_path):
+    image = create_image(tmp_path)
+    volume = create_bootloader_volumes(tmp_path, 1)[0]
+    job = FlashingJob(image, [volume], explain_skip=lambda volume: None)
+    job.run()
+
+    events = job.get_events()
+    phases = [event.phase for event in events]
+    assert phases[0] == PHASE_CHECKING
+    assert set(phases[1:-2]) == {PHASE_COPYING}
+    assert phases[-2:] == [PHASE_DONE, PHASE_FINISHED]
+    assert events[-1].volume is None
+    copied = [event.progress.copied for event in events if event.phase == PHASE_COPYING]
+    assert copied == sorted(copied) and copied[-1] == IMAGE_SIZE
+
+
+def test_skip(tmp_path):
+    image = create_image(tmp_path)
+    volume = create_bootloader_volumes(tmp_path, 1)[0]
+    job = FlashingJob(image, [volume], explain_skip=lambda volume: "same firmware")
+    results = job.run()
+
+    assert results[volume].phase == PHASE_SKIPPED
+    assert results[volume].message == "same firmware"
+    assert [event.phase for event in job.get_events()] == [PHASE_CHECKING, PHASE_SKIPPED,
+                                                           PHASE_FINISHED]
+    assert not os.path.exists(os.path.join(volume, "firmware.uf2"))
+
+
+def test_cancel_removes_partial_file(tmp_path):
+    image = create_image(tmp_path)
+    volumes = create_bootloader_volumes(tmp_path, 2)
+    # about 1 s per image
+    job = FlashingJob(image, volumes, max_bytes_per_second=2 * IMAGE_SIZE)
+    job.start()
+    deadline = time.time() + 5
+    while not any(event.phase == PHASE_COPYING for event in job.get_events()):
+        assert time.time() < deadline
+        time.sleep(0.01)
+    job.cancel()
+
+    events = []
+    while not events or events[-1].phase != PHASE_FINISHED:
+        assert time.time() < deadline
+        time.sleep(0.01)
+        events += job.get_events()
+
+    assert {event.volume for event in events if event.phase == PHASE_CANCELLED} == set(volumes)
+    for volume in volumes:
+        assert not os.path.exists(os.path.join(volume, "firmware.uf2"))
+
+
+def test_copy_firmware_cancelled_before_start(tmp_path):
+    image = create_image(tmp_path)
+    target = str(tmp_path / "copy.uf2")
+    cancel_event = threading.Event()
+    cancel_event.set()
+    try:
+        copy_firmware(image, target, cancel_event=cancel_event)
+        assert False, "copying wasn't cancelled"
+    except FlashingCancelled:
+        pass
+    assert not os.path.exists(target)
+
+
+def test_throttle_is_shared_by_threads():
+    throttle = Throttle(100 * 1024)
+    start_time = time.time()
+    threads = [threading.Thread(target=lambda: [throttle.consume(10 * 1024) for _ in range(2)])
+               for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # 60 KB at 100 KB/s, the first block doesn't wait
+    elapsed = time.time() - start_time
+    assert 0.45 < elapsed < 1.0
+
+
+def test_sum_and_format_progress():
+    total = sum_progress([CopyProgress(100, 400, 1024.0, 3.0),
+                          CopyProgress(300, 400, 2048.0, 1.0),
+                          CopyProgress(0, 400, None, None)])
+    assert total == CopyProgress(400, 1200, 3072.0, 3.0)
+    assert format_progress(total) == "33 %, 3 KB/s, 3 s left"
+    assert format_progress(CopyProgress(0, 400, None, None)) == "0 %"
+    assert format_progress(sum_progress([])) == "100 %"
+
+
+FLASH_START = 0x2000
+# 4 source blocks of 256 bytes
+FLASH_CONTENT = os.urandom(1024)
+
+
+def write_blocks(path, address, content, payload_size):
+    """Writes content as a UF2 image with given payload size, returns path as str"""
+    chunks = [content[i : i + payload_size] for i in range(0, len(content), payload_size)]
+    path.write_bytes(b"".join(create_uf2_block(address + i * payload_size, chunk, i, len(chunks))
+                              for i, chunk in enumerate(chunks)))
+    return str(path)
+
+
+def check_read_back(tmp_path, content, address=FLASH_START):
+    source = write_blocks(tmp_path / "firmware.uf2", FLASH_START, FLASH_CONTENT, 256)
+    # bootloaders may use another payload size than the image
+    current = write_blocks(tmp_path / CURRENT_UF2_FILE_NAME, address, content, 128)
+    return find_mismatches(source, current)
+
+
+def test_identical_read_back(tmp_path):
+    assert check_read_back(tmp_path, FLASH_CONTENT) == []
+
+
+def test_bad_block_in_read_back(tmp_path):
+    content = bytearray(FLASH_CONTENT)
+    content[300] ^= 0xff
+    assert check_read_back(tmp_path, bytes(content)) == [(FLASH_START + 256, 256)]
+
+
+def test_larger_read_back(tmp_path):
+    # rest of the flash comes after the image
+    assert check_read_back(tmp_path, FLASH_CONTENT + os.urandom(4096)) == []
+    # and the bootloader before it
+    assert check_read_back(tmp_path, os.urandom(512) + FLASH_CONTENT, FLASH_START - 512) == []
+
+
+def test_truncated_read_back(tmp_path):
+    assert check_read_back(tmp_path, FLASH_CONTENT[:600]) == [(FLASH_START + 512, 256),
+                                                             (FLASH_START + 768, 256)]
+
+
+def test_gap_in_read_back(tmp_path):
+    source = write_blocks(tmp_path / "firmware.uf2", FLASH_START, FLASH_CONTENT, 256)
+    blocks = [create_uf2_block(FLASH_START + i * 128, FLASH_CONTENT[i * 128 : (i + 1) * 128], i, 8)
+              for i in range(8)]
+    del blocks[2]
+    current = tmp_path / CURRENT_UF2_FILE_NAME
+    current.write_bytes(b"".join(blocks))
+    assert find_mismatches(source, str(current)) == [(FLASH_START + 256, 256)]
+
+
+def test_verify_flashing(tmp_path):
+    volume = create_bootloader_volumes(tmp_path, 1)[0]
+    source = write_blocks(tmp_path / "firmware.uf2", FLASH_START, FLASH_CONTENT, 256)
+    # device restarted right after flashing
+    assert not verify_flashing(source, volume)
+
+    current = os.path.join(volume, CURRENT_UF2_FILE_NAME)
+    write_blocks(tmp_path / "BOOT0" / CURRENT_UF2_FILE_NAME, FLASH_START, FLASH_CONTENT, 256)
+    assert verify_flashing(source, volume)
+
+    write_blocks(tmp_path / "BOOT0" / CURRENT_UF2_FILE_NAME, FLASH_START, FLASH_CONTENT[:512], 256)
+    with pytest.raises(Uf2Error, match="2 block\\(s\\) differ after flashing: 0x2200"):
+        verify_flashing(source, volume)
+    assert os.path.isfile(current)
+
+
+def test_job_reports_verification(tmp_path):
+    source = write_blocks(tmp_path / "firmware.uf2", FLASH_START, FLASH_CONTENT, 256)
+    volumes = create_bootloader_volumes(tmp_path, 2)
+    # first bootloader still shows the flash
+    write_blocks(tmp_path / "BOOT0" / CURRENT_UF2_FILE_NAME, FLASH_START, FLASH_CONTENT, 256)
+    job = FlashingJob(source, volumes, verify=True)
+    results = job.run()
+
+    assert PHASE_VERIFYING in [event.phase for event in job.get_events()]
+    assert (results[volumes[0]].phase, results[volumes[0]].message) == (PHASE_DONE, None)
+    assert (results[volumes[1]].phase, results[volumes[1]].message) == (
+        PHASE_DONE, "not verified, device left bootloader mode")
@@ -0,0 +1,20 @@
+from thonnycontrib.circuitpython.mpy import should_compile, get_mpy_path
+
+
+def test_entry_points_stay_as_source():
+    for path in ["code.py", "/code.py", "boot.py", "/boot.py", "main.py", "settings.py"]:
+        assert not should_compile(path), path
+
+
+def test_libraries_get_compiled():
+    for path in ["lib/x.py", "/lib/x.py", "helper.py", "/lib/code.py"]:
+        assert should_compile(path), path
+
+
+def test_only_python_files_get_compiled():
+    assert not should_compile("/lib/x.mpy")
+    assert not should_compile("/data.txt")
+
+
+def test_mpy_path():
+    assert get_mpy_path("/lib/x.py") == "/lib/x.mpy"
@@ -0,0 +1,62 @@
+import queue
+
+import pytest
+
+pytest.importorskip("thonny.plugins.micropython")
+
+from tests.simulated_device import SimulatedSerial
+from thonnycontrib.circuitpython.device import Device, SerialLink
+from thonnycontrib.circuitpython.fs_index import DeviceFileIndex
+from thonnycontrib.circuitpython.plugin import CircuitPythonProxy
+
+
+def create_connected_proxy(serial):
+    """Proxy at the raw prompt of the device, created without the handshake
+    and the workbench options of MicroPythonProxy.__init__"""
+    link = SerialLink(serial)
+    device = Device(link)
+    device.connect()
+
+    proxy = CircuitPythonProxy.__new__(CircuitPythonProxy)
+    proxy._non_serial_msg_queue = queue.Queue()
+    proxy._serial = link
+    proxy._supports_raw_paste = device._supports_raw_paste
+    proxy._file_index = DeviceFileIndex()
+    proxy._script_paths = None
+    proxy._fs_mount = False
+    # private to MicroPythonProxy, its setter needs the previous value
+    proxy._MicroPythonProxy__idle = True
+    return proxy
+
+
+def get_shell_output(proxy, stream_name):
+    result = []
+    while not proxy._non_serial_msg_queue.empty():
+        message = proxy._non_serial_msg_queue.get_nowait()
+        if message.get("stream_name") == stream_name:
+            result.append(message["data"])
+    return result
+
+
+def test_enter_bootloader():
+    resets = []
+    serial = SimulatedSerial(on_reset=resets.append)
+    proxy = create_connected_proxy(serial)
+    proxy.enter_bootloader()
+
+    assert resets == ["BOOTLOADER"]
+    assert not proxy.is_connected()
+    assert serial.closed
+
+
+def test_enter_bootloader_reports_unconfirmed_restart():
+    serial = SimulatedSerial()
+    proxy = create_connected_proxy(serial)
+    # unplugged, but not noticed yet
+    serial.disconnected = True
+    proxy.enter_bootloader()
+
+    assert not proxy.is_connected()
+    assert serial.closed
+    errors = get_shell_output(proxy, "stderr")
+    assert errors[0].startswith("Device didn't confirm restarting in bootloader mode")
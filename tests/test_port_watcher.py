@@ -0,0 +1,67 @@
+import queue
+import time
+from types import SimpleNamespace
+
+from thonnycontrib.circuitpython import port_watcher
+from thonnycontrib.circuitpython.port_watcher import PortWatcher
+
+
+def create_port(device, pid=0x8023):
+    return SimpleNamespace(device=device, vid=0x239A, pid=pid, serial_number="1234" + device[-1],
+                           description="CircuitPython CDC control")
+
+
+def start_polling_watcher(monkeypatch, ports):
+    events = queue.Queue()
+    monkeypatch.setattr(port_watcher.platform, "system", lambda: "Windows")
+    watcher = PortWatcher(on_appeared=lambda info: events.put(("appeared", info.device)),
+                          on_disappeared=lambda info: events.put(("disappeared", info.device)),
+                          poll_interval=0.02, list_ports=lambda: list(ports))
+    watcher.start()
+    return watcher, events
+
+
+def test_polling_reports_changes(monkeypatch):
+    ports = [create_port("COM4"), create_port("COM3")]
+    watcher, events = start_polling_watcher(monkeypatch, ports)
+    try:
+        assert sorted(info.device for info in watcher.get_ports()) == ["COM3", "COM4"]
+        assert [events.get(timeout=1), events.get(timeout=1)] == [("appeared", "COM3"),
+                                                                  ("appeared", "COM4")]
+
+        ports.append(create_port("COM5"))
+        assert events.get(timeout=1) == ("appeared", "COM5")
+        del ports[0]
+        assert events.get(timeout=1) == ("disappeared", "COM4")
+        # another device behind the same port name
+        ports[0] = create_port("COM3", pid=0x80F4)
+        assert sorted([events.get(timeout=1), events.get(timeout=1)]) == [
+            ("appeared", "COM3"), ("disappeared", "COM3")]
+        assert sorted(info.device for info in watcher.get_ports()) == ["COM3", "COM5"]
+    finally:
+        watcher.stop()
+    assert events.empty()
+
+
+def test_polling_survives_listing_errors(monkeypatch):
+    calls = []
+
+    def list_ports():
+        calls.append(None)
+        if len(calls) == 1:
+            raise OSError("busy")
+        return [create_port("COM3")]
+
+    monkeypatch.setattr(port_watcher.platform, "system", lambda: "Windows")
+    events = queue.Queue()
+    watcher = PortWatcher(on_appeared=lambda info: events.put(info.device),
+                          poll_interval=0.02, list_ports=list_ports)
+    watcher.start()
+    try:
+        # first scan failed, but get_ports doesn't wait for the timeout
+        start_time = time.time()
+        watcher.get_ports(timeout=5)
+        assert time.time() - start_time < 1
+        assert events.get(timeout=1) == "COM3"
+    finally:
+        watcher.stop()
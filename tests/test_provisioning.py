@@ -0,0 +1,229 @@
+import os
+import threading
+
+from tests.simulated_device import SimulatedSerial, create_uf2
+from thonnycontrib.circuitpython.device import Device, SerialLink
+from thonnycontrib.circuitpython.provisioning import Provisioner, STATUS_DONE, STATUS_SKIPPED,\
+    STATUS_FAILED
+from thonnycontrib.circuitpython.volume_watcher import UF2_INFO_FILE_NAME
+
+NEW_BANNER = "Adafruit CircuitPython 8.0.0 on 2023-02-06; Adafruit Feather M0 Express with samd21g18"
+# Time the bootloader needs for mounting its volume after the reset
+BOOTLOADER_DELAY = 0.2
+
+
+class SimulatedBoard:
+    def __init__(self, port, uid, location=None, mount=None, has_bootloader=True,
+                 label="CIRCUITPY"):
+        self.port = port
+        self.uid = uid
+        self.location = location
+        # None for firmwares older than 3.0
+        self.label = label
+        # CIRCUITPY volume as seen by the host (None if it doesn't get mounted)
+        self.mount = mount
+        self.has_bootloader = has_bootloader
+        self.banner = SimulatedSerial().banner
+        self.files = {}
+        self.online = True
+        self.bootloader_volume = None
+        self.serials = []
+
+
+class FakeEnvironment:
+    """Boards behind serial ports, with bootloaders which "install" the image
+    as soon as it is completely written to their volume"""
+    def __init__(self, root, boards, firmware):
+        self._root = root
+        self._boards = {board.port : board for board in boards}
+        self._firmware = firmware
+        self._lock = threading.Lock()
+
+    def open_device(self, port):
+        self._install_written_images()
+        board = self._boards[port]
+        with self._lock:
+            if not board.online:
+                raise OSError("No such port: " + port)
+            serial = SimulatedSerial(board.files, label=board.label, uid=board.uid,
+                                     banner=board.banner,
+                                     on_reset=lambda run_mode: self._on_reset(board, run_mode))
+            board.serials.append(serial)
+        device = Device(SerialLink(serial))
+        device.connect()
+        return device
+
+    def list_bootloader_volumes(self):
+        self._install_written_images()
+        with self._lock:
+            return [board.bootloader_volume for board in self._boards.values()
+                    if board.bootloader_volume is not None
+                    and os.path.isfile(os.path.join(board.bootloader_volume, UF2_INFO_FILE_NAME))]
+
+    def get_usb_location(self, port):
+        return self._boards[port].location
+
+    def is_volume_at_usb_location(self, volume, location):
+        return any(board.bootloader_volume == volume and board.location == location
+                   for board in self._boards.values())
+
+    def find_port(self, device_id):
+        self._install_written_images()
+        for board in self._boards.values():
+            if board.online and board.uid.hex() == device_id:
+                return board.port
+        return None
+
+    def find_mount(self, port, label, boot_out):
+        return self._boards[port].mount
+
+    def _on_reset(self, board, run_mode):
+        serial = board.serials[-1]
+        with self._lock:
+            board.files = dict(serial.filesystem.files)
+            if run_mode != "BOOTLOADER" or not board.has_bootloader:
+                return
+            board.online = False
+            board.bootloader_volume = os.path.join(self._root, "BOOT_" + board.port)
+        threading.Timer(BOOTLOADER_DELAY, self._mount_bootloader, [board]).start()
+
+    def _mount_bootloader(self, board):
+        os.mkdir(board.bootloader_volume)
+        with open(os.path.join(board.bootloader_volume, UF2_INFO_FILE_NAME), "w") as fp:
+            fp.write("Model: Adafruit Feather M0 Express\nBoard-ID: SAMD21G18A-Feather-v0\n")
+
+    def _install_written_images(self):
+        size = os.path.getsize(self._firmware)
+        with self._lock:
+            for board in self._boards.values():
+                if board.bootloader_volume is None:
+                    continue
+                image = os.path.join(board.bootloader_volume, os.path.basename(self._firmware))
+                if os.path.isfile(image) and os.path.getsize(image) == size:
+                    os.remove(image)
+                    os.remove(os.path.join(board.bootloader_volume, UF2_INFO_FILE_NAME))
+                    os.rmdir(board.bootloader_volume)
+                    board.bootloader_volume = None
+                    board.banner = NEW_BANNER
+                    board.online = True
+
+
+def create_project(tmp_path):
+    project = tmp_path / "project"
+    (project / "lib").mkdir(parents=True)
+    (project / "code.py").write_text("import helper\n")
+    (project / "lib" / "helper.py").write_text("x = 1\n")
+    return {"/code.py" : str(project / "code.py"),
+            "/lib/helper.py" : str(project / "lib" / "helper.py")}
+
+
+def create_boards(count, **kwargs):
+    return [SimulatedBoard("COM%d" % i, bytes([0x10 + i, 0x34, 0x56, 0x78]), **kwargs)
+            for i in range(count)]
+
+
+def provision(tmp_path, boards, smoke_test="print(1)", **kwargs):
+    firmware = create_uf2(tmp_path / "firmware.uf2", NEW_BANNER)
+    environment = FakeEnvironment(str(tmp_path), boards, firmware)
+    provisioner = Provisioner(firmware, create_project(tmp_path), str(tmp_path / "manifests"),
+                              smoke_test=smoke_test, poll_interval=0.02, environment=environment,
+                              **kwargs)
+    return provisioner.run([board.port for board in boards])
+
+
+def get_statuses(timeline):
+    return [(record["stage"], record["status"]) for record in timeline.stages]
+
+
+def add_mounts(tmp_path, boards):
+    for i, board in enumerate(boards):
+        board.mount = str(tmp_path / ("CIRCUITPY%d" % i))
+        os.mkdir(board.mount)
+
+
+def test_claims_unlocated_volumes_one_at_a_time(tmp_path):
+    boards = create_boards(3, label=None)
+    timelines = provision(tmp_path, boards)
+
+    assert all(timeline.is_ok() for timeline in timelines)
+    for board, timeline in zip(boards, timelines):
+        assert timeline.device_id == board.uid.hex()
+        assert all(status == STATUS_DONE for _, status in get_statuses(timeline))
+        assert board.banner == NEW_BANNER
+        # without USB location and label the files go via serial
+        assert sorted(board.serials[-1].filesystem.files) == ["/code.py", "/lib/helper.py"]
+        assert board.serials[-1].soft_reboots == 1
+
+    # each device waited for the volume of the previous one
+    ends = sorted(timeline.stages[0]["end"] for timeline in timelines)
+    assert all(later - earlier >= BOOTLOADER_DELAY * 0.9 for earlier, later in zip(ends, ends[1:]))
+
+
+def test_located_devices_sync_to_mount(tmp_path):
+    boards = create_boards(2, location="1-1")
+    for i, board in enumerate(boards):
+        board.location = "1-%d" % i
+    add_mounts(tmp_path, boards)
+    timelines = provision(tmp_path, boards)
+
+    assert all(timeline.is_ok() for timeline in timelines)
+    for board in boards:
+        assert board.banner == NEW_BANNER
+        assert os.path.isfile(os.path.join(board.mount, "lib", "helper.py"))
+
+
+def test_unlocated_devices_sync_to_mount_found_by_label(tmp_path):
+    # as on macOS and Windows
+    boards = create_boards(2)
+    add_mounts(tmp_path, boards)
+    timelines = provision(tmp_path, boards)
+
+    assert all(timeline.is_ok() for timeline in timelines)
+    for board in boards:
+        assert os.path.isfile(os.path.join(board.mount, "lib", "helper.py"))
+        assert "/lib/helper.py" not in board.serials[-1].filesystem.files
+
+
+def test_skips_identical_firmware(tmp_path):
+    boards = create_boards(1)
+    boards[0].banner = NEW_BANNER
+    timeline = provision(tmp_path, boards)[0]
+
+    assert timeline.is_ok()
+    assert get_statuses(timeline) == [("bootloader", STATUS_SKIPPED), ("flash", STATUS_SKIPPED),
+                                      ("remount", STATUS_SKIPPED), ("sync", STATUS_DONE),
+                                      ("smoke_test", STATUS_DONE)]
+    # one session, without restarts
+    assert len(boards[0].serials) == 1
+    assert boards[0].bootloader_volume is None
+    assert "/code.py" in boards[0].serials[0].filesystem.files
+
+
+def test_bootloader_timeout(tmp_path):
+    boards = create_boards(1, has_bootloader=False)
+    timeline = provision(tmp_path, boards, bootloader_timeout=0.3)[0]
+
+    assert not timeline.is_ok()
+    assert get_statuses(timeline) == [("bootloader", STATUS_FAILED)]
+    assert timeline.stages[0]["message"].startswith("TimeoutError")
+
+
+def test_remount_falls_back_to_serial(tmp_path):
+    # location is known, but the volume doesn't show up
+    boards = create_boards(1, location="1-1")
+    timeline = provision(tmp_path, boards, remount_timeout=0.3)[0]
+
+    assert timeline.is_ok()
+    assert sorted(boards[0].serials[-1].filesystem.files) == ["/code.py", "/lib/helper.py"]
+
+
+def test_failing_smoke_test(tmp_path):
+    boards = create_boards(1, label=None)
+    timeline = provision(tmp_path, boards, smoke_test="raise ValueError('boom')")[0]
+
+    assert not timeline.is_ok()
+    assert get_statuses(timeline)[-1] == ("smoke_test", STATUS_FAILED)
+    assert "boom" in timeline.stages[-1]["message"]
+    # project doesn't get started
+    assert boards[0].serials[-1].soft_reboots == 0
+    assert timeline.to_dict()["ok"] is False
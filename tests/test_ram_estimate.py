@@ -0,0 +1,127 @@
+import os
+
+import pytest
+
+from thonnycontrib.circuitpython import ram_estimate
+from thonnycontrib.circuitpython.ram_estimate import RamEstimateCache, estimate_project,\
+    parse_mem_free_output, CACHE_FILE_NAME
+
+
+def create_project(tmp_path, sources):
+    """Writes sources (device path -> str, or bytes for .mpy), returns files for estimate_project"""
+    files = {}
+    for device_path, source in sources.items():
+        local_path = tmp_path / "project" / device_path.lstrip("/")
+        local_path.parent.mkdir(parents=True, exist_ok=True)
+        if isinstance(source, bytes):
+            local_path.write_bytes(source)
+        else:
+            local_path.write_text(source)
+        files[device_path] = str(local_path)
+    return files
+
+
+def estimate(tmp_path, files, builtins=(), compiled=(), cache=None):
+    return estimate_project(files, lambda name: name in builtins,
+                            cache or RamEstimateCache(str(tmp_path / "cache")), compiled)
+
+
+def get_module(estimate, path):
+    return next(module for module in estimate.modules if module.path == path)
+
+
+def test_finds_main_script(tmp_path):
+    files = create_project(tmp_path, {"/main.py" : "import helper\n",
+                                      "/code.py" : "import helper\nx = [1, 2, 3]\n",
+                                      "/helper.py" : "def f():\n    return 1\n"})
+    result = estimate(tmp_path, files)
+
+    # code.py wins over main.py, like on the device
+    assert result.main_path == "/code.py"
+    assert [module.path for module in result.modules] == ["/code.py", "/helper.py"]
+    assert estimate(tmp_path, {"/helper.py" : files["/helper.py"]}) is None
+
+
+def test_imports_resolve_like_on_device(tmp_path):
+    files = create_project(tmp_path, {
+        "/code.py" : ("import board\nimport util\nimport sensors.bme\n"
+                      "from drivers import motor, SPEED\nimport wifi_manager\n"),
+        # the root comes before /lib
+        "/util.py" : "",
+        "/lib/util.py" : "",
+        "/lib/sensors/__init__.py" : "",
+        "/lib/sensors/bme.py" : "from . import common\nfrom .common import read\n",
+        "/lib/sensors/common.py" : "def read():\n    pass\n",
+        "/lib/sensors/unused.py" : "",
+        "/lib/drivers/__init__.py" : "SPEED = 1\n",
+        "/lib/drivers/motor.py" : "from ..sensors import bme\nimport neopixel\n",
+    })
+    result = estimate(tmp_path, files, builtins={"board"})
+
+    assert [(module.name, module.path) for module in result.modules] == [
+        ("__main__", "/code.py"),
+        ("drivers", "/lib/drivers/__init__.py"),
+        ("drivers.motor", "/lib/drivers/motor.py"),
+        ("sensors", "/lib/sensors/__init__.py"),
+        ("sensors.bme", "/lib/sensors/bme.py"),
+        ("sensors.common", "/lib/sensors/common.py"),
+        ("util", "/util.py"),
+    ]
+    # SPEED isn't a module and board comes with the firmware
+    assert result.missing == ["neopixel", "wifi_manager"]
+
+
+def test_compiled_modules_skip_parsing(tmp_path):
+    files = create_project(tmp_path, {
+        "/code.py" : "import helper\nimport fast\n",
+        "/lib/helper.py" : "".join("def f%d(x):\n    return x * %d\n" % (i, i) for i in range(20)),
+        "/lib/fast.mpy" : b"M" * 1000,
+    })
+
+    source_result = estimate(tmp_path, files)
+    code, helper = get_module(source_result, "/code.py"), get_module(source_result, "/lib/helper.py")
+    fast = get_module(source_result, "/lib/fast.mpy")
+    assert (fast.resident, fast.transient, fast.as_mpy) == (1200, None, True)
+    assert helper.transient > code.transient
+    assert source_result.resident == code.resident + helper.resident + fast.resident
+    # parse trees are freed after each module, only the largest counts
+    assert source_result.peak == source_result.resident + helper.transient
+
+    compiled_result = estimate(tmp_path, files, compiled={"/lib/helper.py"})
+    assert get_module(compiled_result, "/lib/helper.py").as_mpy
+    assert compiled_result.resident == source_result.resident
+    assert compiled_result.peak == compiled_result.resident + code.transient
+
+
+def test_cache_analyzes_only_changed_files(tmp_path, monkeypatch):
+    analyzed = []
+    analyze_source = ram_estimate.analyze_source
+    monkeypatch.setattr(ram_estimate, "analyze_source",
+                        lambda source: analyzed.append(source) or analyze_source(source))
+    files = create_project(tmp_path, {"/code.py" : "import helper\n",
+                                      "/helper.py" : "x = 1\n"})
+    cache_path = tmp_path / "cache" / CACHE_FILE_NAME
+
+    first = estimate(tmp_path, files)
+    assert len(analyzed) == 2
+    assert cache_path.is_file()
+
+    # a new session reads the analyses from disk
+    cache = RamEstimateCache(str(tmp_path / "cache"))
+    assert estimate(tmp_path, files, cache=cache) == first
+    assert len(analyzed) == 2
+    # nothing new, nothing to write
+    os.remove(str(cache_path))
+    estimate(tmp_path, files, cache=cache)
+    assert not cache_path.exists()
+
+    (tmp_path / "project" / "helper.py").write_text("x = 'changed'\n")
+    estimate(tmp_path, files, cache=cache)
+    assert analyzed[2:] == ["x = 'changed'\n"]
+    assert cache_path.is_file()
+
+
+def test_parse_mem_free_output():
+    assert parse_mem_free_output(b"19872\r\n") == 19872
+    with pytest.raises(ValueError):
+        parse_mem_free_output(b"Traceback\r\n19872\r\n")
@@ -0,0 +1,117 @@
+import os
+import time
+
+import pytest
+
+from tests.simulated_device import SimulatedSerial, PtyDevice
+from thonnycontrib.circuitpython.device import Device, SerialLink
+from thonnycontrib.circuitpython.raw_repl import raw_paste_write, ACK_TIMEOUT, EOT
+
+
+def connect(serial):
+    device = Device(SerialLink(serial))
+    device.connect()
+    return device
+
+
+def upload(device, serial, content, tmp_path):
+    source = tmp_path / "data.bin"
+    source.write_bytes(content)
+    start_time = time.time()
+    device.upload(str(source), "/data.bin")
+    assert serial.filesystem.files["/data.bin"] == content
+    return time.time() - start_time
+
+
+def test_raw_paste_is_detected():
+    assert connect(SimulatedSerial(raw_paste=True))._supports_raw_paste
+
+
+def test_refusing_firmware_uses_raw_mode():
+    serial = SimulatedSerial(raw_paste=False)
+    device = connect(serial)
+    assert not device._supports_raw_paste
+    assert device.execute("print(1 + 1)") == (b"2\r\n", b"")
+
+
+def test_old_firmware_uses_raw_mode():
+    # doesn't know the command and just re-enters raw mode
+    serial = SimulatedSerial(raw_paste=None)
+    device = connect(serial)
+    assert not device._supports_raw_paste
+    assert device.execute("print(1 + 1)") == (b"2\r\n", b"")
+
+
+def test_falls_back_when_raw_paste_gets_refused_later():
+    serial = SimulatedSerial(raw_paste=True)
+    device = connect(serial)
+    serial.raw_paste = False
+    assert device.execute("print(3)") == (b"3\r\n", b"")
+    assert not device._supports_raw_paste
+    assert device.execute("print(4)") == (b"4\r\n", b"")
+
+
+def test_raw_paste_respects_window():
+    serial = SimulatedSerial(raw_paste=True, window_size=16)
+    device = connect(serial)
+    script = "x = %r\nprint(len(x))" % ("a" * 1000)
+    assert device.execute(script) == (b"1000\r\n", b"")
+
+
+def test_raw_paste_throughput(tmp_path):
+    content = os.urandom(1024)
+    paste_serial = SimulatedSerial(raw_paste=True)
+    paste_time = upload(connect(paste_serial), paste_serial, content, tmp_path)
+    raw_serial = SimulatedSerial(raw_paste=False)
+    raw_time = upload(connect(raw_serial), raw_serial, content, tmp_path)
+
+    # raw mode needs pauses between blocks, raw-paste has flow control
+    assert paste_time * 5 < raw_time
+
+
+def test_raw_paste_over_pty(tmp_path):
+    # real port driver, OS buffering and partial reads
+    pytest.importorskip("serial")
+    pytest.importorskip("termios")
+    content = os.urandom(1024)
+    times = {}
+    for raw_paste in [True, False]:
+        pty_device = PtyDevice(SimulatedSerial(raw_paste=raw_paste, window_size=32))
+        try:
+            device = Device(SerialLink.open(pty_device.port_name))
+            device.connect()
+            try:
+                assert device._supports_raw_paste == raw_paste
+                assert device.execute("x = %r\nprint(len(x))" % ("a" * 1000)) == (b"1000\r\n", b"")
+                times[raw_paste] = upload(device, pty_device.serial, content, tmp_path)
+            finally:
+                device.close()
+        finally:
+            pty_device.close()
+
+    assert times[True] * 5 < times[False]
+
+
+class RecordingSerial:
+    """Accepts everything, acknowledges end of data"""
+    def __init__(self):
+        self.read_timeouts = []
+        self.written = bytearray()
+
+    def write(self, data, block_size=32, delay=0.01):
+        self.written += data
+
+    def incoming_is_empty(self):
+        return True
+
+    def read_until(self, terminators, timeout=2):
+        self.read_timeouts.append(timeout)
+        return EOT
+
+
+def test_acknowledgement_waits_for_compilation():
+    serial = RecordingSerial()
+    raw_paste_write(serial, b"print(1)", 128)
+    assert serial.written == b"print(1)" + EOT
+    assert serial.read_timeouts == [ACK_TIMEOUT]
+    assert ACK_TIMEOUT > 2
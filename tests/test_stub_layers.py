@@ -0,0 +1,95 @@
+import os
+import time
+
+import pytest
+
+from thonnycontrib.circuitpython import stub_layers
+from thonnycontrib.circuitpython.completion_index import build_completion_index
+from thonnycontrib.circuitpython.firmware_info import parse_banner
+from thonnycontrib.circuitpython.stub_layers import StubLayers, select_layers,\
+    apply_member_overrides
+
+SAMD21_BANNER = parse_banner(
+    "Adafruit CircuitPython 7.3.0 on 2022-05-23; Adafruit Feather M0 Express with samd21g18")
+RP2040_BANNER = parse_banner(
+    "Adafruit CircuitPython 9.0.0 on 2024-03-19; Raspberry Pi Pico with rp2040")
+
+
+def read_module(layers, module_name):
+    path = layers.find_module_dir(module_name)
+    with open("%s/%s.py" % (path, module_name), encoding="utf-8") as fp:
+        return fp.read()
+
+
+def test_apply_member_overrides():
+    source = "argv = None\nplatform = None\ndef exit():\n    pass\n"
+    assert (apply_member_overrides(source, {"platform" : "RP2040", "version" : "3.4.0"})
+            == "argv = None\nplatform = 'RP2040'\ndef exit():\n    pass\nversion = '3.4.0'\n")
+
+
+def test_port_layers_override_sys_members(tmp_path):
+    layers = StubLayers(select_layers(SAMD21_BANNER), str(tmp_path))
+    try:
+        source = read_module(layers, "sys")
+        assert "platform = 'Atmel SAMD21'" in source
+        assert "version = '3.4.0'" in source
+        # patched module comes first for jedi
+        assert layers.get_paths()[0] == layers.find_module_dir("sys")
+        assert [name for name, _, _ in layers.complete("sys.plat")[0]] == ["platform"]
+        # modules without overrides come from the packaged layers
+        assert layers.find_module_dir("samd") in layers.get_paths()
+    finally:
+        layers.close()
+
+    layers = StubLayers(select_layers(RP2040_BANNER), str(tmp_path))
+    try:
+        source = read_module(layers, "sys")
+        assert "platform = 'RP2040'" in source
+        assert "version = '3.4.0; Adafruit CircuitPython 9.0.0 on 2024-03-19'" in source
+    finally:
+        layers.close()
+
+
+def test_device_stubs_are_not_overridden(tmp_path):
+    device_stubs = tmp_path / "device"
+    device_stubs.mkdir()
+    (device_stubs / "sys.py").write_text("platform = 'Atmel SAMD21 (device)'\n")
+    layers = StubLayers([(str(device_stubs), set(), {})] + select_layers(SAMD21_BANNER),
+                        str(tmp_path / "overrides"))
+    try:
+        assert layers.find_module_dir("sys") == str(device_stubs)
+    finally:
+        layers.close()
+
+
+def test_members_of_constants_are_left_to_jedi(tmp_path):
+    layers = StubLayers(select_layers(SAMD21_BANNER), str(tmp_path))
+    try:
+        assert layers.complete("sys.platform.") is None
+        assert layers.complete("digitalio.NoSuchClass.") is None
+        names = [name for name, _, _ in layers.complete("digitalio.DigitalInOut.")[0]]
+        assert "deinit" in names
+        # known class, nothing matches the prefix
+        assert layers.complete("digitalio.DigitalInOut.xyz") == ([], "xyz")
+    finally:
+        layers.close()
+
+
+def test_read_only_stubs_keep_older_index(tmp_path, monkeypatch):
+    stubs = tmp_path / "stubs"
+    stubs.mkdir()
+    (stubs / "mod.py").write_text("x = None\n")
+    build_completion_index(str(stubs))
+    (stubs / "mod.py").write_text("x = None\ny = None\n")
+    os.utime(str(stubs / "mod.py"), (time.time() + 10, time.time() + 10))
+
+    access = os.access
+    monkeypatch.setattr(stub_layers.os, "access",
+                        lambda path, mode: access(path, mode) and path != str(stubs))
+    monkeypatch.setattr(stub_layers, "build_completion_index",
+                        lambda path: pytest.fail("rebuilt " + path))
+    layers = StubLayers([(str(stubs), set(), {})], str(tmp_path / "overrides"))
+    try:
+        assert [name for name, _, _ in layers.complete("mod.")[0]] == ["x"]
+    finally:
+        layers.close()
@@ -0,0 +1,86 @@
+import contextlib
+import io
+import os
+
+from thonnycontrib.circuitpython.completion_index import CompletionIndex, INDEX_FILE_NAME
+from thonnycontrib.circuitpython.stubs import StubCache, select_stub_modules,\
+    create_introspection_script, parse_introspection_output, render_module_stub,\
+    COMPLETE_MARKER_FILE_NAME
+
+# As printed by the introspection script on a Feather M0 Express
+RECORDED_OUTPUT = (
+    b"('digitalio', [('DigitalInOut', 'class', None, [('deinit', 'function', None, None), "
+    b"('direction', 'other', None, None)]), ('Direction', 'class', None, "
+    b"[('INPUT', 'other', None, None)]), ('Pull', 'class', None, [])])\r\n"
+    b"('board', [('A0', 'other', None, None), ('D13', 'other', None, None), "
+    b"('board_id', 'constant', \"'feather_m0_express'\", None)])\r\n"
+    b"('time', [('monotonic', 'function', None, None), ('sleep', 'function', None, None)])\r\n")
+
+BOARD_NAME = "Adafruit Feather M0 Express"
+VERSION = "8.0.0"
+
+
+def test_select_stub_modules():
+    assert select_stub_modules(["time", "_pew", "code", "board", "time", "os.path"]) == [
+        "board", "time"]
+
+
+def test_introspection_script_runs_on_host():
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        exec(create_introspection_script(["math", "no_such_module"]), {})
+    modules = parse_introspection_output(out.getvalue().encode("utf-8"))
+
+    # modules which can't be imported are left out
+    assert list(modules) == ["math"]
+    records = {record[0] : record for record in modules["math"]}
+    assert records["sqrt"][1] == "function"
+    assert records["pi"][1:3] == ("constant", repr(3.141592653589793))
+
+
+def test_render_module_stub():
+    modules = parse_introspection_output(RECORDED_OUTPUT)
+    assert render_module_stub(modules["board"]) == (
+        "A0 = None\nD13 = None\nboard_id = 'feather_m0_express'\n")
+    source = render_module_stub(modules["digitalio"])
+    assert "class DigitalInOut:\n    ''\n    def deinit():\n        pass\n" in source
+    assert "    direction = None\n" in source
+    compile(source, "digitalio.py", "exec")
+
+
+def test_stored_stubs_are_found_and_indexed(tmp_path):
+    cache = StubCache(str(tmp_path))
+    assert cache.get_path(BOARD_NAME, VERSION) is None
+
+    path = cache.store(BOARD_NAME, VERSION, parse_introspection_output(RECORDED_OUTPUT))
+    assert cache.get_path(BOARD_NAME, VERSION) == path
+    assert cache.get_path(BOARD_NAME, "9.0.0") is None
+    assert sorted(os.listdir(path)) == sorted([COMPLETE_MARKER_FILE_NAME, INDEX_FILE_NAME,
+                                               "board.py", "digitalio.py", "time.py"])
+    # only the target directory is left in the board directory
+    assert os.listdir(os.path.dirname(path)) == [os.path.basename(path)]
+
+    index = CompletionIndex(os.path.join(path, INDEX_FILE_NAME))
+    try:
+        assert [name for name, _, _ in index.lookup("", "d")] == ["digitalio"]
+        assert [name for name, _, _ in index.lookup("digitalio.DigitalInOut")] == [
+            "deinit", "direction"]
+    finally:
+        index.close()
+
+
+def test_half_written_stubs_are_replaced(tmp_path):
+    cache = StubCache(str(tmp_path))
+    path = cache.store(BOARD_NAME, VERSION, parse_introspection_output(RECORDED_OUTPUT))
+    # as if an earlier version of the cache got interrupted while writing
+    os.remove(os.path.join(path, COMPLETE_MARKER_FILE_NAME))
+    with open(os.path.join(path, "stale.py"), "w") as fp:
+        fp.write("x = 1\n")
+    assert cache.get_path(BOARD_NAME, VERSION) is None
+
+    modules = parse_introspection_output(RECORDED_OUTPUT)
+    del modules["time"]
+    assert cache.store(BOARD_NAME, VERSION, modules) == path
+    assert cache.get_path(BOARD_NAME, VERSION) == path
+    assert sorted(os.listdir(path)) == sorted([COMPLETE_MARKER_FILE_NAME, INDEX_FILE_NAME,
+                                               "board.py", "digitalio.py"])
@@ -0,0 +1,91 @@
+import os
+
+import pytest
+
+from tests.simulated_device import SimulatedSerial
+from thonnycontrib.circuitpython.device import Device, SerialLink
+from thonnycontrib.circuitpython.sync import ManifestStore, MountSyncTarget, sync_device,\
+    list_local_files, ENABLE_AUTORELOAD_SCRIPT
+
+
+def create_project(tmp_path):
+    project = tmp_path / "project"
+    (project / "lib").mkdir(parents=True)
+    (project / "code.py").write_text("import helper\n")
+    (project / "lib" / "helper.py").write_text("x = 1\n")
+    return list_local_files(str(project))
+
+
+def connect(serial):
+    device = Device(SerialLink(serial))
+    device.connect()
+    return device
+
+
+def test_sync_uploads_and_restores_autoreload(tmp_path):
+    serial = SimulatedSerial()
+    plan = sync_device(connect(serial), create_project(tmp_path),
+                       ManifestStore(str(tmp_path / "manifests")))
+    assert sorted(plan.uploads) == ["/code.py", "/lib/helper.py"]
+    assert serial.filesystem.files["/lib/helper.py"] == b"x = 1\n"
+    assert serial.autoreload is True
+
+
+def test_sync_keeps_autoreload_disabled(tmp_path):
+    serial = SimulatedSerial(autoreload=False)
+    sync_device(connect(serial), create_project(tmp_path),
+                ManifestStore(str(tmp_path / "manifests")))
+    assert serial.autoreload is False
+    assert ENABLE_AUTORELOAD_SCRIPT not in serial.scripts
+
+
+class FailingDevice:
+    """Upload fails, so does everything afterwards"""
+    def __init__(self, device):
+        self._device = device
+        self.broken = False
+
+    def __getattr__(self, name):
+        return getattr(self._device, name)
+
+    def execute(self, script, timeout=10):
+        if self.broken:
+            raise OSError("Device is gone")
+        return self._device.execute(script, timeout)
+
+    def upload(self, source, target):
+        self.broken = True
+        raise ValueError("Upload failed")
+
+
+def test_restoring_autoreload_does_not_hide_sync_error(tmp_path):
+    device = FailingDevice(connect(SimulatedSerial()))
+    with pytest.raises(ValueError):
+        sync_device(device, create_project(tmp_path), ManifestStore(str(tmp_path / "manifests")))
+
+
+@pytest.mark.skipif(os.name != "posix", reason="directories can be synced only on POSIX")
+def test_mount_target_syncs_only_touched_paths(tmp_path, monkeypatch):
+    mount = tmp_path / "CIRCUITPY"
+    (mount / "lib").mkdir(parents=True)
+    (mount / "old.py").write_text("")
+    (mount / "untouched.py").write_text("")
+    source = tmp_path / "helper.py"
+    source.write_text("x = 1\n")
+
+    synced = []
+    fsync = os.fsync
+    monkeypatch.setattr(os, "fsync", lambda fd: synced.append(os.fstat(fd).st_ino) or fsync(fd))
+    monkeypatch.setattr(os, "sync", lambda: pytest.fail("flushes all file systems"), raising=False)
+
+    target = MountSyncTarget(str(mount))
+    target.upload_file(str(source), "/lib/drivers/helper.py")
+    target.remove_file("/old.py")
+    assert synced == []
+    target.flush()
+
+    expected = [mount / "lib" / "drivers" / "helper.py", mount / "lib" / "drivers",
+                mount / "lib", mount]
+    assert sorted(synced) == sorted(os.stat(str(path)).st_ino for path in expected)
+    target.flush()
+    assert len(synced) == len(expected)
@@ -0,0 +1,83 @@
+import pytest
+
+from tests.simulated_device import create_uf2_block, SAMD21_FAMILY_ID
+from thonnycontrib.circuitpython.uf2 import parse_uf2, check_compatibility,\
+    read_bootloader_info, Uf2Error, FLAG_NOT_MAIN_FLASH, BLOCK_SIZE
+
+RP2040_FAMILY_ID = 0xe48bff56
+
+
+def write_image(tmp_path, blocks, name="firmware.uf2"):
+    path = tmp_path / name
+    path.write_bytes(b"".join(blocks))
+    return str(path)
+
+
+def create_blocks(start_address, count, family_id=SAMD21_FAMILY_ID, **kwargs):
+    return [create_uf2_block(start_address + i * 256, bytes([i]) * 256, i, count,
+                             family_id=family_id, **kwargs)
+            for i in range(count)]
+
+
+def create_bootloader_volume(tmp_path, board_id):
+    volume = tmp_path / "BOOT"
+    volume.mkdir(parents=True)
+    (volume / "INFO_UF2.TXT").write_text(
+        "UF2 Bootloader v3.14.0\r\nModel: Some board\r\nBoard-ID: %s\r\n" % board_id)
+    return read_bootloader_info(str(volume))
+
+
+def test_parse_uf2(tmp_path):
+    # a block for another memory doesn't count
+    blocks = create_blocks(0x2000, 3) + [create_uf2_block(0, b"x" * 16, 0, 1,
+                                                          flags=FLAG_NOT_MAIN_FLASH)]
+    info = parse_uf2(write_image(tmp_path, blocks))
+    assert info.num_blocks == 3
+    assert info.family_ids == {SAMD21_FAMILY_ID}
+    assert (info.min_address, info.max_address) == (0x2000, 0x2300)
+    assert info.payload_size == 768
+
+
+def test_wrong_magic(tmp_path):
+    blocks = create_blocks(0x2000, 3)
+    blocks[1] = create_uf2_block(0x2100, b"\x01" * 256, 1, 3, magic_start0=0x12345678)
+    with pytest.raises(Uf2Error, match="Block 1 has wrong magic numbers"):
+        parse_uf2(write_image(tmp_path, blocks))
+
+
+def test_truncated_final_block(tmp_path):
+    image = b"".join(create_blocks(0x2000, 3))
+    path = tmp_path / "firmware.uf2"
+    path.write_bytes(image[:-100])
+    with pytest.raises(Uf2Error, match="not a multiple of %d" % BLOCK_SIZE):
+        parse_uf2(str(path))
+
+    # whole blocks missing
+    path.write_bytes(image[:-BLOCK_SIZE])
+    with pytest.raises(Uf2Error, match="truncated, it has 2 of 3 blocks"):
+        parse_uf2(str(path))
+
+
+def test_family_must_match_board_id(tmp_path):
+    info = parse_uf2(write_image(tmp_path, create_blocks(0x10000000, 2, RP2040_FAMILY_ID)))
+    check_compatibility(info, create_bootloader_volume(tmp_path / "pico", "RPI-RP2"))
+    with pytest.raises(Uf2Error, match="meant for RPI-RP2, but Some board has SAMD21G18A"):
+        check_compatibility(info, create_bootloader_volume(tmp_path / "feather",
+                                                           "SAMD21G18A-Feather-v0"))
+    # unknown chips get the benefit of the doubt
+    check_compatibility(info, create_bootloader_volume(tmp_path / "other", "XYZ123-Board"))
+
+
+def test_address_range_outside_flash(tmp_path):
+    bootloader_info = {"Board-ID" : "SAMD21G18A-Feather-v0"}
+    # older images without family
+    check_compatibility(parse_uf2(write_image(tmp_path, create_blocks(0x2000, 2, flags=0))),
+                        bootloader_info)
+    # would overwrite the bootloader
+    info = parse_uf2(write_image(tmp_path, create_blocks(0x0, 2, flags=0), "low.uf2"))
+    with pytest.raises(Uf2Error, match="0x0..0x200, but .* accepts only 0x2000..0x40000"):
+        check_compatibility(info, bootloader_info)
+    # beyond the end of the flash
+    info = parse_uf2(write_image(tmp_path, create_blocks(0x3ff00, 2, flags=0), "high.uf2"))
+    with pytest.raises(Uf2Error, match="0x3ff00..0x40100"):
+        check_compatibility(info, bootloader_info)
@@ -0,0 +1,196 @@
+import os
+import threading
+import time
+
+import pytest
+
+from thonnycontrib.circuitpython import volumes, volume_watcher
+from thonnycontrib.circuitpython.volume_watcher import VolumeWatcher, NewVolumeWait,\
+    UF2_INFO_FILE_NAME
+from thonnycontrib.circuitpython.volumes import find_device_mount, find_mounts_of_port,\
+    find_volumes_by_label, is_mount_at_usb_location, MountPairings
+
+BOOT_OUT_A = "Adafruit CircuitPython 8.0.0 on 2023-02-06; Feather M0 Express with samd21g18\r\nUID:AAAA\r\n"
+BOOT_OUT_B = "Adafruit CircuitPython 8.0.0 on 2023-02-06; Feather M0 Express with samd21g18\r\nUID:BBBB\r\n"
+
+
+def create_volume(parent, name, files):
+    path = parent / name
+    path.mkdir()
+    for file_name, content in files.items():
+        (path / file_name).write_text(content)
+    return str(path)
+
+
+def create_sysfs(tmp_path):
+    """Two USB devices, each with a serial port and a mass storage partition"""
+    sysfs = tmp_path / "sys"
+    for usb_name, tty_name, block_name in [("1-1", "ttyACM0", "sdb"), ("1-2", "ttyACM1", "sdc")]:
+        usb_device = sysfs / "devices" / "usb1" / usb_name
+        interface = usb_device / (usb_name + ":1.0")
+        interface.mkdir(parents=True)
+        partition = usb_device / (usb_name + ":1.2") / "host0" / "block" / block_name / (block_name + "1")
+        partition.mkdir(parents=True)
+
+        tty = sysfs / "class" / "tty" / tty_name
+        tty.mkdir(parents=True)
+        os.symlink(str(interface), str(tty / "device"))
+        (sysfs / "class" / "block").mkdir(parents=True, exist_ok=True)
+        os.symlink(str(partition), str(sysfs / "class" / "block" / (block_name + "1")))
+    return str(sysfs)
+
+
+class Recorder:
+    def __init__(self):
+        self.events = []
+        self.appeared = threading.Event()
+
+    def on_appeared(self, volume):
+        self.events.append(("appeared", volume))
+        self.appeared.set()
+
+    def on_disappeared(self, volume):
+        self.events.append(("disappeared", volume))
+
+
+def test_watcher_reports_bootloader_volumes(tmp_path):
+    bootloader = create_volume(tmp_path, "FTHR840BOOT", {UF2_INFO_FILE_NAME : "Model: X\n"})
+    circuitpy = create_volume(tmp_path, "CIRCUITPY", {"code.py" : ""})
+    candidates = []
+    recorder = Recorder()
+    watcher = VolumeWatcher(recorder.on_appeared, recorder.on_disappeared,
+                            list_candidates=lambda: candidates)
+
+    candidates[:] = [circuitpy]
+    watcher.rescan()
+    assert recorder.events == []
+
+    candidates[:] = [circuitpy, bootloader]
+    watcher.rescan()
+    watcher.rescan()
+    assert recorder.events == [("appeared", bootloader)]
+    assert watcher.get_volumes() == {bootloader}
+
+    candidates[:] = []
+    watcher.rescan()
+    assert recorder.events == [("appeared", bootloader), ("disappeared", bootloader)]
+    assert watcher.get_volumes() == set()
+
+
+def test_watcher_thread_scans_at_start(tmp_path):
+    bootloader = create_volume(tmp_path, "RPI-RP2", {UF2_INFO_FILE_NAME : "Model: X\n"})
+    recorder = Recorder()
+    watcher = VolumeWatcher(recorder.on_appeared, recorder.on_disappeared,
+                            poll_interval=0.05, list_candidates=lambda: [bootloader])
+    watcher.start()
+    try:
+        assert recorder.appeared.wait(5)
+    finally:
+        watcher.stop()
+    assert recorder.events == [("appeared", bootloader)]
+
+
+def test_waiting_for_bootloader_volume(tmp_path, monkeypatch):
+    # polls instead of watching the real mount table
+    monkeypatch.setattr(volume_watcher.platform, "system", lambda: "Windows")
+    waiting = create_volume(tmp_path, "FTHR840BOOT", {UF2_INFO_FILE_NAME : "Model: X\n"})
+    restarted = create_volume(tmp_path, "FEATHERBOOT", {UF2_INFO_FILE_NAME : "Model: Y\n"})
+    candidates = [waiting]
+    recorder = Recorder()
+    watcher = VolumeWatcher(recorder.on_appeared, recorder.on_disappeared,
+                            poll_interval=0.02, list_candidates=lambda: list(candidates))
+    watcher.start()
+    try:
+        assert recorder.appeared.wait(5)
+        wait = NewVolumeWait(watcher.get_volumes, 5)
+        assert wait.known_volumes == {waiting}
+        assert wait.check() == set()
+
+        # device restarted in bootloader mode
+        candidates.append(restarted)
+        deadline = time.time() + 5
+        while not wait.check():
+            assert time.time() < deadline
+            time.sleep(0.01)
+        assert wait.check() == {restarted}
+    finally:
+        watcher.stop()
+
+
+def test_waiting_for_bootloader_volume_times_out(tmp_path):
+    waiting = create_volume(tmp_path, "FTHR840BOOT", {UF2_INFO_FILE_NAME : "Model: X\n"})
+    watcher = VolumeWatcher(lambda vol: None, lambda vol: None, list_candidates=lambda: [waiting])
+    watcher.rescan()
+    wait = NewVolumeWait(watcher.get_volumes, 0.1)
+    assert wait.check() == set()
+
+    time.sleep(0.2)
+    # the volume which was already there doesn't count
+    watcher.rescan()
+    with pytest.raises(TimeoutError):
+        wait.check()
+
+
+def test_pairing_by_label_and_boot_out(tmp_path):
+    first = create_volume(tmp_path, "CIRCUITPY", {"boot_out.txt" : BOOT_OUT_A})
+    second = create_volume(tmp_path, "CIRCUITPY1", {"boot_out.txt" : BOOT_OUT_B})
+    other = create_volume(tmp_path, "USBSTICK", {})
+    candidates = [first, second, other]
+
+    assert find_device_mount("/dev/ttyNONE", "CIRCUITPY", BOOT_OUT_B, candidates) == second
+    assert find_device_mount("/dev/ttyNONE", "CIRCUITPY", BOOT_OUT_A.replace("\r\n", "\n"),
+                             candidates) == first
+    # several candidates and nothing to tell them apart
+    assert find_device_mount("/dev/ttyNONE", "CIRCUITPY", None, candidates) is None
+    assert find_device_mount("/dev/ttyNONE", "CIRCUITPY", None, [first, other]) == first
+
+
+def test_numbered_mount_points(tmp_path, monkeypatch):
+    monkeypatch.setattr(volumes.platform, "system", lambda: "Darwin")
+    candidates = [str(tmp_path / name) for name in
+                  ["CIRCUITPY", "CIRCUITPY1", "CIRCUITPY 2", "CIRCUITPY  3", "CIRCUITPYX",
+                   "MY CIRCUITPY"]]
+
+    assert find_volumes_by_label("CIRCUITPY", candidates) == candidates[:3]
+
+
+def test_board_mount_label_when_firmware_cant_tell(tmp_path):
+    mount = create_volume(tmp_path, "FTHRBOOT", {"boot_out.txt" : BOOT_OUT_A})
+    circuitpy = create_volume(tmp_path, "CIRCUITPY", {"boot_out.txt" : BOOT_OUT_A})
+
+    assert find_device_mount("/dev/ttyNONE", None, BOOT_OUT_A, [mount, circuitpy]) == circuitpy
+    assert find_device_mount("/dev/ttyNONE", None, BOOT_OUT_A, [mount, circuitpy],
+                             mount_label="FTHRBOOT") == mount
+    # label reported by the device wins
+    assert find_device_mount("/dev/ttyNONE", "CIRCUITPY", BOOT_OUT_A, [mount, circuitpy],
+                             mount_label="FTHRBOOT") == circuitpy
+
+
+def test_pairing_by_usb_location(tmp_path, monkeypatch):
+    monkeypatch.setattr(volumes.platform, "system", lambda: "Linux")
+    monkeypatch.setattr(volumes, "_SYSFS_DIR", create_sysfs(tmp_path))
+    # identical boards with firmware which doesn't write the UID
+    first = create_volume(tmp_path, "CIRCUITPY", {"boot_out.txt" : "same"})
+    second = create_volume(tmp_path, "CIRCUITPY1", {"boot_out.txt" : "same"})
+    mounts = [("/dev/sdb1", first), ("/dev/sdc1", second), ("/dev/sda1", "/")]
+    monkeypatch.setattr(volumes, "read_linux_mounts", lambda: mounts)
+
+    assert find_mounts_of_port("/dev/ttyACM0", mounts) == [first]
+    assert find_mounts_of_port("/dev/ttyACM1", mounts) == [second]
+    location = volumes.get_usb_location("/dev/ttyACM1")
+    assert is_mount_at_usb_location(second, location, mounts)
+    assert not is_mount_at_usb_location(first, location, mounts)
+
+    assert find_device_mount("/dev/ttyACM1", "CIRCUITPY", "same", [first, second]) == second
+
+
+def test_remembered_pairing_is_checked(tmp_path):
+    mount = create_volume(tmp_path, "CIRCUITPY", {"boot_out.txt" : BOOT_OUT_A})
+    pairings = MountPairings()
+    pairings.put("aaaa", mount, BOOT_OUT_A)
+    assert pairings.get("aaaa") == mount
+    assert pairings.get("bbbb") is None
+
+    # another board got mounted there
+    (tmp_path / "CIRCUITPY" / "boot_out.txt").write_text(BOOT_OUT_B)
+    assert pairings.get("aaaa") is None
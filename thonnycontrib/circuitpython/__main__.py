@@ -0,0 +1,5 @@
+import sys
+
+from thonnycontrib.circuitpython.cli import main
+
+sys.exit(main())
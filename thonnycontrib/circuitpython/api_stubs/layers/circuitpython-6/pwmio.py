@@ -0,0 +1,8 @@
+
+class PWMOut:
+    ''
+    def deinit():
+        pass
+
+    duty_cycle = None
+    frequency = None
@@ -0,0 +1,59 @@
+
+class Event:
+    ''
+    key_number = None
+    pressed = None
+    released = None
+    timestamp = None
+
+class EventQueue:
+    ''
+    def clear():
+        pass
+
+    def get():
+        pass
+
+    def get_into():
+        pass
+
+    overflowed = None
+
+class KeyMatrix:
+    ''
+    def deinit():
+        pass
+
+    events = None
+    key_count = None
+    def key_number_to_row_column():
+        pass
+
+    def reset():
+        pass
+
+    def row_column_to_key_number():
+        pass
+
+
+class Keys:
+    ''
+    def deinit():
+        pass
+
+    events = None
+    key_count = None
+    def reset():
+        pass
+
+
+class ShiftRegisterKeys:
+    ''
+    def deinit():
+        pass
+
+    events = None
+    key_count = None
+    def reset():
+        pass
+
@@ -7,7 +7,7 @@ implementation = None
 maxsize = 2147483647
 modules = None
 path = None
-platform = 'Atmel SAMD21'
+platform = None
 def print_exception():
     pass
 
@@ -0,0 +1,101 @@
+"""USB identities of CircuitPython boards.
+
+The packaged boards.json can be extended or corrected without a new release
+by a file with the same structure in the user directory (see
+load_board_database). Entries are looked up by (vid, pid) from a dict.
+
+Names in the board module (pins and default buses) are given as named pin
+sets, which boards with the same layout share:
+
+    {"pin_sets": {"feather_m0_express": ["A0", "A1", ...]},
+     "boards": [{"vid": "0x239A", "pid": "0x8023", ..., "pin_set": "feather_m0_express"}]}
+
+Boards missing from the data are still recognized by the name of the
+serial interface ("CircuitPython CDC control" in all CircuitPython builds
+with native USB) or, as a weaker hint, by a vendor known to ship
+CircuitPython boards.
+"""
+import json
+import logging
+import os.path
+from collections import namedtuple
+
+from thonnycontrib.circuitpython.pins import PinSet
+
+PACKAGED_DATABASE_PATH = os.path.join(os.path.dirname(__file__), "boards.json")
+USER_DATABASE_FILE_NAME = "circuitpython_boards.json"
+DEFAULT_MOUNT_LABEL = "CIRCUITPY"
+
+_INTERFACE_MARKER = "CircuitPython"
+
+# pins is a pins.PinSet or None if the board module of the board is not known
+Board = namedtuple("Board", ["vid", "pid", "name", "mount_label", "pins"])
+
+
+def _parse_id(value):
+    return value if isinstance(value, int) else int(value, 16)
+
+
+class BoardDatabase:
+    def __init__(self):
+        self._boards = {}
+        self._vendors = {}
+        # user's boards may refer to packaged pin sets
+        self._pin_sets = {}
+
+    def load(self, path):
+        """Adds (or replaces) boards, vendors and pin sets from a JSON file"""
+        with open(path, encoding="utf-8") as fp:
+            data = json.load(fp)
+
+        for name, names in data.get("pin_sets", {}).items():
+            self._pin_sets[name] = PinSet(names)
+
+        for record in data.get("vendors", []):
+            self._vendors[_parse_id(record["vid"])] = record["name"]
+
+        for record in data.get("boards", []):
+            board = Board(vid=_parse_id(record["vid"]),
+                          pid=_parse_id(record["pid"]),
+                          name=record["name"],
+                          mount_label=record.get("mount_label", DEFAULT_MOUNT_LABEL),
+                          pins=self._pin_sets[record["pin_set"]] if "pin_set" in record else None)
+            self._boards[(board.vid, board.pid)] = board
+
+    def lookup(self, vid, pid):
+        """Returns the Board with given USB ids or None"""
+        return self._boards.get((vid, pid))
+
+    def get_usb_ids(self):
+        return set(self._boards)
+
+    def describe_port(self, port_info):
+        """Returns description of the port (pyserial ListPortInfo or compatible)
+        if it looks like a CircuitPython device, otherwise None"""
+        board = self.lookup(port_info.vid, port_info.pid)
+        if board is not None:
+            return "%s (%s)" % (board.name, port_info.device)
+
+        interface = getattr(port_info, "interface", None) or port_info.description or ""
+        if (_INTERFACE_MARKER in interface
+                or port_info.vid is not None and port_info.vid in self._vendors):
+            return "%s (%s)" % (port_info.description or "CircuitPython device",
+                                port_info.device)
+
+        return None
+
+
+def load_board_database(user_dir=None):
+    """Returns database of the packaged boards, updated from the user directory"""
+    database = BoardDatabase()
+    database.load(PACKAGED_DATABASE_PATH)
+
+    if user_dir is not None:
+        user_path = os.path.join(user_dir, USER_DATABASE_FILE_NAME)
+        if os.path.isfile(user_path):
+            try:
+                database.load(user_path)
+            except (OSError, ValueError, KeyError):
+                logging.exception("Could not load %s", user_path)
+
+    return database
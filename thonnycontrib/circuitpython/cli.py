@@ -0,0 +1,380 @@
+"""Command line interface for flashing and managing CircuitPython devices without Thonny's GUI.
+
+    python -m thonnycontrib.circuitpython flash adafruit-circuitpython-...-8.0.0.uf2
+    python -m thonnycontrib.circuitpython sync my_project --port /dev/ttyACM0
+    python -m thonnycontrib.circuitpython run test.py --port /dev/ttyACM0
+    python -m thonnycontrib.circuitpython ls --port /dev/ttyACM0
+    python -m thonnycontrib.circuitpython provision firmware.uf2 my_project --port /dev/ttyACM0 --port /dev/ttyACM1
+    python -m thonnycontrib.circuitpython index-stubs
+    python -m thonnycontrib.circuitpython estimate-ram my_project --mcu samd21
+
+Each command prints its result as a JSON object (with at least "command"
+and "ok") to stdout. Exit code is 0 if "ok" is true.
+
+Modules are imported by the commands which need them to keep the startup fast.
+"""
+import argparse
+import json
+import os.path
+import sys
+import time
+
+
+def _get_user_dir():
+    # thonny/__init__.py doesn't import the GUI
+    from thonny import THONNY_USER_DIR
+    return THONNY_USER_DIR
+
+
+def _open_device(port):
+    from thonnycontrib.circuitpython.device import Device, SerialLink
+    device = Device(SerialLink.open(port))
+    device.connect()
+    return device
+
+
+def _find_bootloader_volumes(wait):
+    from thonnycontrib.circuitpython.volume_watcher import UF2_INFO_FILE_NAME
+    from thonnycontrib.circuitpython.volumes import list_removable_volume_candidates
+
+    deadline = time.time() + wait
+    while True:
+        volumes = sorted(vol for vol in list_removable_volume_candidates()
+                         if os.path.isfile(os.path.join(vol, UF2_INFO_FILE_NAME)))
+        if volumes or time.time() >= deadline:
+            return volumes
+        time.sleep(0.2)
+
+
+def cmd_flash(args):
+    from thonnycontrib.circuitpython.firmware_info import read_firmware_banner,\
+        read_installed_banner, explain_identical
+    from thonnycontrib.circuitpython.flashing import FlashingJob, PHASE_DONE, PHASE_SKIPPED,\
+        PHASE_FAILED
+    from thonnycontrib.circuitpython.uf2 import parse_uf2, read_bootloader_info,\
+        check_compatibility, Uf2Error
+
+    uf2_info = parse_uf2(args.file)
+    target_banner = read_firmware_banner(args.file)
+    volumes = args.volume or _find_bootloader_volumes(args.wait)
+
+    results = {}
+    compatible_volumes = []
+    for vol in volumes:
+        try:
+            check_compatibility(uf2_info, read_bootloader_info(vol))
+            compatible_volumes.append(vol)
+        except (OSError, Uf2Error) as e:
+            results[vol] = {"phase" : PHASE_FAILED, "message" : str(e)}
+
+    def explain_skip(volume):
+        try:
+            return explain_identical(read_installed_banner(volume), target_banner)
+        except OSError:
+            # current firmware unknown, install anyway
+            return None
+
+    job = FlashingJob(args.file, compatible_volumes,
+                      max_workers=args.max_workers,
+                      max_bytes_per_second=args.max_kb_per_second * 1024,
+                      verify=args.verify,
+                      explain_skip=None if args.force else explain_skip)
+    for vol, event in job.run().items():
+        results[vol] = {"phase" : event.phase, "message" : event.message}
+
+    return {
+        "ok" : bool(results) and all(result["phase"] in (PHASE_DONE, PHASE_SKIPPED)
+                                     for result in results.values()),
+        "firmware" : target_banner,
+        "volumes" : results,
+    }
+
+
+def _find_mount(args, device):
+    from thonnycontrib.circuitpython.volumes import find_device_mount, is_writable_dir
+
+    if args.mount or args.no_mount:
+        return args.mount
+
+    mount = find_device_mount(args.port, *device.get_mount_info())
+    # serial is always correct
+    return mount if mount is not None and is_writable_dir(mount) else None
+
+
+def cmd_sync(args):
+    from thonnycontrib.circuitpython.sync import ManifestStore, list_local_files, sync_device
+
+    if not os.path.isdir(args.source):
+        raise IOError("No such directory: %s" % args.source)
+
+    device = _open_device(args.port)
+    restart = False
+    try:
+        mount = _find_mount(args, device)
+        store = ManifestStore(os.path.join(_get_user_dir(), "circuitpython_manifests"))
+        local_files = list_local_files(args.source)
+        if args.mpy_cross:
+            local_files = _compile_to_mpy(device, local_files, args.mpy_cross)
+        plan = sync_device(device, local_files, store, mount)
+        restart = bool(plan.uploads or plan.deletions) and not args.no_restart
+        device_id = device.get_device_id()
+    finally:
+        if restart:
+            device.soft_reboot()
+        else:
+            device.close()
+
+    return {
+        "ok" : True,
+        "device_id" : device_id,
+        "via" : "mount" if mount else "serial",
+        "uploaded" : plan.uploads,
+        "deleted" : plan.deletions,
+        "unchanged" : plan.unchanged,
+    }
+
+
+def _compile_to_mpy(device, local_files, mpy_cross_path):
+    import ast
+    from thonnycontrib.circuitpython.mpy import MpyCache, create_mpy_cross_compiler,\
+        abi_from_info, ABI_INFO_SCRIPT
+
+    out, err = device.execute(ABI_INFO_SCRIPT)
+    if err:
+        raise RuntimeError(err.decode("utf-8", "replace"))
+    abi = abi_from_info(*ast.literal_eval(out.decode("utf-8").strip()))
+    cache = MpyCache(os.path.join(_get_user_dir(), "circuitpython_mpy_cache"),
+                     create_mpy_cross_compiler(mpy_cross_path))
+    return cache.compile_files(local_files, abi)
+
+
+def cmd_run(args):
+    with open(args.file, encoding="utf-8") as fp:
+        source = fp.read()
+
+    device = _open_device(args.port)
+    try:
+        start_time = time.time()
+        out, err = device.execute(source, timeout=args.timeout)
+        duration = time.time() - start_time
+    finally:
+        device.close()
+
+    return {
+        "ok" : not err,
+        "stdout" : out.decode("utf-8", "replace").replace("\r\n", "\n"),
+        "stderr" : err.decode("utf-8", "replace").replace("\r\n", "\n"),
+        "duration" : round(duration, 3),
+    }
+
+
+def cmd_ls(args):
+    from thonnycontrib.circuitpython.fs_index import normalize_device_path
+
+    path = normalize_device_path(args.path)
+    prefix = path.rstrip("/") + "/"
+    device = _open_device(args.port)
+    try:
+        records = device.list_files()
+    finally:
+        device.close()
+
+    return {
+        "ok" : True,
+        "path" : path,
+        "files" : [{"path" : record_path, "is_dir" : is_dir, "size" : size, "mtime" : mtime}
+                   for record_path, is_dir, size, mtime in records
+                   if record_path.startswith(prefix)],
+    }
+
+
+def cmd_provision(args):
+    from thonnycontrib.circuitpython.provisioning import Provisioner
+    from thonnycontrib.circuitpython.sync import list_local_files
+
+    if not os.path.isdir(args.source):
+        raise IOError("No such directory: %s" % args.source)
+
+    smoke_test = None
+    if args.smoke_test:
+        with open(args.smoke_test, encoding="utf-8") as fp:
+            smoke_test = fp.read()
+
+    provisioner = Provisioner(args.firmware, list_local_files(args.source),
+                              os.path.join(_get_user_dir(), "circuitpython_manifests"),
+                              smoke_test=smoke_test, force=args.force,
+                              max_bytes_per_second=args.max_kb_per_second * 1024)
+    timelines = [timeline.to_dict() for timeline in provisioner.run(args.port)]
+    return {
+        "ok" : all(timeline["ok"] for timeline in timelines),
+        "devices" : timelines,
+    }
+
+
+def cmd_index_stubs(args):
+    from thonnycontrib.circuitpython.completion_index import build_completion_index
+    from thonnycontrib.circuitpython.stub_layers import LAYERS_DIR_NAME
+
+    directories = [args.directory]
+    layers_dir = os.path.join(args.directory, LAYERS_DIR_NAME)
+    if os.path.isdir(layers_dir):
+        directories += [os.path.join(layers_dir, name) for name in sorted(os.listdir(layers_dir))
+                        if os.path.isdir(os.path.join(layers_dir, name))]
+
+    start_time = time.time()
+    indexes = {}
+    for directory in directories:
+        index_path = build_completion_index(directory)
+        indexes[index_path] = os.path.getsize(index_path)
+    return {
+        "ok" : True,
+        "indexes" : indexes,
+        "duration" : round(time.time() - start_time, 3),
+    }
+
+
+def cmd_estimate_ram(args):
+    from thonnycontrib.circuitpython.firmware_info import parse_banner
+    from thonnycontrib.circuitpython.mpy import should_compile
+    from thonnycontrib.circuitpython.ram_estimate import RamEstimateCache, estimate_project,\
+        get_heap_budget, parse_mem_free_output, MEM_FREE_SCRIPT
+    from thonnycontrib.circuitpython.stub_layers import StubLayers, select_layers
+    from thonnycontrib.circuitpython.sync import list_local_files
+
+    if not os.path.isdir(args.source):
+        raise IOError("No such directory: %s" % args.source)
+
+    banner = None
+    budget = None
+    if args.port:
+        device = _open_device(args.port)
+        try:
+            banner = parse_banner(device.banner)
+            out, err = device.execute(MEM_FREE_SCRIPT)
+            if not err:
+                try:
+                    budget = parse_mem_free_output(out)
+                except ValueError:
+                    # falls back to the table below
+                    pass
+        finally:
+            device.close()
+    if args.budget_kb:
+        budget = args.budget_kb * 1024
+    elif budget is None:
+        budget = get_heap_budget(args.mcu or (banner["mcu"] if banner else None))
+
+    local_files = list_local_files(args.source)
+    compiled = {path for path in local_files if should_compile(path)} if args.mpy else set()
+    layers = StubLayers(select_layers(banner))
+    try:
+        estimate = estimate_project(
+            local_files, lambda name: layers.find_module_dir(name) is not None,
+            RamEstimateCache(os.path.join(_get_user_dir(), "circuitpython_ram_estimates")),
+            compiled)
+    finally:
+        layers.close()
+    if estimate is None:
+        raise IOError("No code.py or main.py in %s" % args.source)
+
+    return {
+        "ok" : budget is None or estimate.peak <= budget,
+        "main" : estimate.main_path,
+        "modules" : {module.path : {"resident" : module.resident,
+                                    "parse" : module.transient,
+                                    "mpy" : module.as_mpy}
+                     for module in estimate.modules},
+        "missing" : estimate.missing,
+        "resident" : estimate.resident,
+        "peak" : estimate.peak,
+        "budget" : budget,
+    }
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(prog="python -m thonnycontrib.circuitpython",
+                                     description="Manage CircuitPython devices")
+    subparsers = parser.add_subparsers(dest="command")
+
+    flash = subparsers.add_parser("flash", help="install firmware to devices in bootloader mode")
+    flash.add_argument("file", help="UF2 firmware image")
+    flash.add_argument("--volume", action="append",
+                       help="bootloader volume (default: all found)")
+    flash.add_argument("--wait", type=float, default=0,
+                       help="seconds to wait for bootloader volumes to appear")
+    flash.add_argument("--force", action="store_true",
+                       help="install even if device already has this firmware")
+    flash.add_argument("--verify", action="store_true",
+                       help="read back the firmware if bootloader allows it")
+    flash.add_argument("--max-workers", type=int, default=4)
+    flash.add_argument("--max-kb-per-second", type=int, default=4096)
+    flash.set_defaults(handler=cmd_flash)
+
+    sync = subparsers.add_parser("sync", help="upload changed files of a directory")
+    sync.add_argument("source", help="local directory")
+    sync.add_argument("--port", required=True)
+    sync.add_argument("--mount", help="CIRCUITPY volume of the device (default: detect)")
+    sync.add_argument("--no-mount", action="store_true", help="transfer via serial only")
+    sync.add_argument("--no-restart", action="store_true",
+                      help="don't restart the device after changes")
+    sync.add_argument("--mpy-cross", help="compile libraries with given mpy-cross")
+    sync.set_defaults(handler=cmd_sync)
+
+    run = subparsers.add_parser("run", help="execute a local script on the device")
+    run.add_argument("file")
+    run.add_argument("--port", required=True)
+    run.add_argument("--timeout", type=float, default=None)
+    run.set_defaults(handler=cmd_run)
+
+    ls = subparsers.add_parser("ls", help="list files on the device")
+    ls.add_argument("path", nargs="?", default="/")
+    ls.add_argument("--port", required=True)
+    ls.set_defaults(handler=cmd_ls)
+
+    provision = subparsers.add_parser("provision",
+                                      help="install firmware and project to devices, then test them")
+    provision.add_argument("firmware", help="UF2 firmware image")
+    provision.add_argument("source", help="local project directory")
+    provision.add_argument("--port", action="append", required=True,
+                           help="serial port of a device (repeat for several devices)")
+    provision.add_argument("--smoke-test", help="script which must run without errors")
+    provision.add_argument("--force", action="store_true",
+                           help="install firmware even if device already has it")
+    provision.add_argument("--max-kb-per-second", type=int, default=4096)
+    provision.set_defaults(handler=cmd_provision)
+
+    index_stubs = subparsers.add_parser("index-stubs",
+                                        help="build the completion indexes of a stubs directory and its layers")
+    index_stubs.add_argument("directory", nargs="?",
+                             default=os.path.join(os.path.dirname(__file__), "api_stubs"))
+    index_stubs.set_defaults(handler=cmd_index_stubs)
+
+    estimate_ram = subparsers.add_parser("estimate-ram",
+                                         help="estimate the heap a project needs on the device")
+    estimate_ram.add_argument("source", help="local project directory")
+    estimate_ram.add_argument("--port", help="ask the connected device for its free heap")
+    estimate_ram.add_argument("--mcu", help="assume typical free heap of this MCU, eg. samd21")
+    estimate_ram.add_argument("--budget-kb", type=int, help="free heap in kilobytes")
+    estimate_ram.add_argument("--mpy", action="store_true",
+                              help="libraries are going to be uploaded as .mpy")
+    estimate_ram.set_defaults(handler=cmd_estimate_ram)
+
+    return parser
+
+
+def main(argv=None):
+    parser = create_parser()
+    args = parser.parse_args(argv)
+    if not getattr(args, "handler", None):
+        parser.print_help()
+        return 2
+
+    try:
+        result = args.handler(args)
+    except Exception as e:
+        result = {"ok" : False, "error" : "%s: %s" % (type(e).__name__, e)}
+
+    result["command"] = args.command
+    json.dump(result, sys.stdout, indent=2, sort_keys=True)
+    sys.stdout.write("\n")
+    return 0 if result["ok"] else 1
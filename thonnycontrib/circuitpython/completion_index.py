@@ -0,0 +1,186 @@
+"""Precompiled index of the names in a stubs directory, for completing without jedi.
+
+Parsing and inferring over the stub modules makes the first completion of a
+session slow, although CircuitPython completions are mostly simple: module
+names after "import", and members of modules and classes after a dot.
+build_completion_index turns the stubs into a sorted table of entries
+
+    <parent> <name>\\t<kind>\\t<signature>
+
+(parent is "" for modules, "digitalio" for its members, "digitalio.DigitalInOut"
+for methods), preceded by a table of line offsets. CompletionIndex memory-maps
+the file and finds the children of a parent with given prefix by binary search,
+so a lookup reads only the lines it returns.
+
+Stubs may be split into layers (see stub_layers), each with its own index.
+"""
+import ast
+import mmap
+import os.path
+import re
+import struct
+
+INDEX_FILE_NAME = "completions.idx"
+
+KIND_MODULE = "module"
+KIND_CLASS = "class"
+KIND_FUNCTION = "function"
+KIND_CONSTANT = "constant"
+
+_MAGIC = b"CPCIDX1\n"
+_COUNT_FORMAT = "<I"
+_OFFSET_FORMAT = "<I"
+_OFFSET_SIZE = struct.calcsize(_OFFSET_FORMAT)
+_HEADER_SIZE = len(_MAGIC) + struct.calcsize(_COUNT_FORMAT)
+
+_IMPORT_REGEX = re.compile(r"^\s*(?:import|from)\s+(?P<prefix>\w*)$")
+_FROM_IMPORT_REGEX = re.compile(
+    r"^\s*from\s+(?P<parent>\w+)\s+import\s+(?:.*,\s*)?(?P<prefix>\w*)$")
+_ATTRIBUTE_REGEX = re.compile(r"(?:^|[^\w.])(?P<parent>[A-Za-z_]\w*(?:\.\w+)*)\.(?P<prefix>\w*)$")
+
+
+def parse_completion_context(text):
+    """Returns (parent, prefix) for the end of given line (text before the cursor)
+    or None if it's not an import or an attribute of a dotted name.
+
+    Parent is "" when completing module names.
+    """
+    match = _IMPORT_REGEX.match(text)
+    if match:
+        return "", match.group("prefix")
+
+    match = _FROM_IMPORT_REGEX.match(text) or _ATTRIBUTE_REGEX.search(text)
+    if match:
+        return match.group("parent"), match.group("prefix")
+
+    return None
+
+
+def _format_signature(args):
+    names = [arg.arg for arg in args.args]
+    defaults_start = len(names) - len(args.defaults)
+    parts = [name + "=..." if i >= defaults_start else name for i, name in enumerate(names)]
+    if args.vararg is not None:
+        parts.append("*" + args.vararg.arg)
+    if args.kwarg is not None:
+        parts.append("**" + args.kwarg.arg)
+    return "(" + ", ".join(parts) + ")"
+
+
+def _collect_entries(parent, body, entries, expand_classes):
+    for node in body:
+        if isinstance(node, ast.FunctionDef):
+            entries.append((parent, node.name, KIND_FUNCTION, _format_signature(node.args)))
+        elif isinstance(node, ast.ClassDef):
+            entries.append((parent, node.name, KIND_CLASS, ""))
+            if expand_classes:
+                _collect_entries(parent + "." + node.name, node.body, entries, False)
+        elif isinstance(node, ast.Assign):
+            for target in node.targets:
+                if isinstance(target, ast.Name):
+                    entries.append((parent, target.id, KIND_CONSTANT, ""))
+
+
+def collect_stub_entries(stubs_dir):
+    """Returns (parent, name, kind, signature) for modules and their members"""
+    entries = []
+    for file_name in os.listdir(stubs_dir):
+        module_name, ext = os.path.splitext(file_name)
+        if ext != ".py" or not module_name.isidentifier():
+            continue
+        with open(os.path.join(stubs_dir, file_name), encoding="utf-8") as fp:
+            tree = ast.parse(fp.read(), file_name)
+        entries.append(("", module_name, KIND_MODULE, ""))
+        _collect_entries(module_name, tree.body, entries, True)
+    return entries
+
+
+def build_completion_index(stubs_dir, index_path=None):
+    """Writes the index of given stubs directory, returns its path"""
+    if index_path is None:
+        index_path = os.path.join(stubs_dir, INDEX_FILE_NAME)
+
+    lines = sorted(set(
+        ("%s %s\t%s\t%s\n" % entry).encode("utf-8")
+        for entry in collect_stub_entries(stubs_dir)
+        if not entry[1].startswith("__")))
+
+    offsets = []
+    position = 0
+    for line in lines:
+        offsets.append(position)
+        position += len(line)
+
+    with open(index_path + ".tmp", "wb") as fp:
+        fp.write(_MAGIC)
+        fp.write(struct.pack(_COUNT_FORMAT, len(lines)))
+        fp.write(struct.pack("<%dI" % len(offsets), *offsets))
+        fp.writelines(lines)
+    os.replace(index_path + ".tmp", index_path)
+    return index_path
+
+
+def is_index_outdated(stubs_dir, index_path=None):
+    if index_path is None:
+        index_path = os.path.join(stubs_dir, INDEX_FILE_NAME)
+    if not os.path.isfile(index_path):
+        return True
+    index_mtime = os.path.getmtime(index_path)
+    return any(os.path.getmtime(os.path.join(stubs_dir, name)) > index_mtime
+               for name in os.listdir(stubs_dir) if name.endswith(".py"))
+
+
+class CompletionIndex:
+    """Read-only view of an index file. The file is mapped on first lookup."""
+    def __init__(self, path):
+        self._path = path
+        self._map = None
+        self._count = None
+        self._data_start = None
+
+    def lookup(self, parent, prefix=""):
+        """Returns (name, kind, signature) of the children of parent
+        (module or class name, "" for modules) starting with prefix"""
+        self._ensure_mapped()
+        key_prefix = ("%s %s" % (parent, prefix)).encode("utf-8")
+
+        # first line not less than key_prefix
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            if self._get_line(middle) < key_prefix:
+                low = middle + 1
+            else:
+                high = middle
+
+        result = []
+        for i in range(low, self._count):
+            line = self._get_line(i)
+            if not line.startswith(key_prefix):
+                break
+            key, kind, signature = line.decode("utf-8").rstrip("\n").split("\t")
+            result.append((key.split(" ", 1)[1], kind, signature))
+        return result
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    def _ensure_mapped(self):
+        if self._map is not None:
+            return
+
+        with open(self._path, "rb") as fp:
+            self._map = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:len(_MAGIC)] != _MAGIC:
+            self.close()
+            raise ValueError("Not a completion index: " + self._path)
+        self._count, = struct.unpack_from(_COUNT_FORMAT, self._map, len(_MAGIC))
+        self._data_start = _HEADER_SIZE + self._count * _OFFSET_SIZE
+
+    def _get_line(self, i):
+        start = self._data_start + struct.unpack_from(
+            _OFFSET_FORMAT, self._map, _HEADER_SIZE + i * _OFFSET_SIZE)[0]
+        end = self._map.find(b"\n", start) + 1
+        return self._map[start:end]
@@ -0,0 +1,290 @@
+"""Talking to a CircuitPython device over the raw REPL without Thonny.
+
+Used by the command line interface. Thonny's back-end (CircuitPythonProxy)
+has its own connection handling, but shares the scripts defined here.
+"""
+import ast
+import logging
+import time
+from textwrap import dedent
+
+from thonnycontrib.circuitpython.raw_repl import probe_raw_paste, enter_raw_paste,\
+    raw_paste_write, EOT
+from thonnycontrib.circuitpython.sync import DEVICE_ID_SCRIPT
+
+FIRST_RAW_PROMPT = b"raw REPL; CTRL-B to exit\r\n>"
+NORMAL_PROMPT = b">>> "
+EOT_WITH_RAW_PROMPT = b"\x04>"
+
+# Prints (path, is_dir, size, mtime) for every file and directory on the device,
+# one record per line to keep device's memory usage low.
+WALK_FILES_SCRIPT = dedent("""
+    import os as __os_
+    def __walk_(path):
+        for name in __os_.listdir(path):
+            full = path.rstrip("/") + "/" + name
+            st = __os_.stat(full)
+            is_dir = st[0] & 0x4000 != 0
+            print(repr((full, is_dir, st[6], st[8])))
+            if is_dir:
+                __walk_(full)
+    __walk_("/")
+    del __os_, __walk_
+""").strip()
+
+# Seconds for WALK_FILES_SCRIPT. It stats every file, which takes long on
+# slow boards with hundreds of libraries in /lib.
+WALK_FILES_TIMEOUT = 60
+
+# https://learn.adafruit.com/welcome-to-circuitpython/creating-and-editing-code#naming-your-program-file
+# In the order of precedence, last one is the default
+BOOT_SCRIPT_CANDIDATES = ["settings.txt", "settings.py", "boot.txt", "boot.py"]
+MAIN_SCRIPT_CANDIDATES = ["code.txt", "code.py", "main.txt", "main.py"]
+
+# Prints names of the first existing boot and main script (or empty strings) separated by comma
+PROBE_SCRIPT_PATHS_SCRIPT = dedent("""
+    import os as __os_
+    def __first_(names):
+        for name in names:
+            try:
+                __os_.stat("/" + name)
+                return name
+            except OSError:
+                pass
+        return ""
+    print(__first_(%r) + "," + __first_(%r))
+    del __os_, __first_
+""" % (BOOT_SCRIPT_CANDIDATES, MAIN_SCRIPT_CANDIDATES)).strip()
+
+# Prints the content of given file as repr-s of bytes, one block per line
+READ_FILE_SCRIPT = dedent("""
+    with open(%r, "rb") as __fp_:
+        while True:
+            __block_ = __fp_.read(256)
+            if not __block_:
+                break
+            print(repr(__block_))
+    del __fp_, __block_
+""").strip()
+
+# Boards with separate UF2 bootloader (RP2040, ESP32-S2) call it UF2,
+# on others BOOTLOADER is the UF2 bootloader
+ENTER_BOOTLOADER_SCRIPT = dedent("""
+    import microcontroller as __mc_
+    __mc_.on_next_reset(getattr(__mc_.RunMode, "UF2", None) or __mc_.RunMode.BOOTLOADER)
+    __mc_.reset()
+""").strip()
+
+# Prints repr of the volume label (None if firmware can't tell) and content of
+# boot_out.txt (or None)
+MOUNT_INFO_SCRIPT = dedent("""
+    def __mount_info_():
+        import storage
+        try:
+            with open("/boot_out.txt") as fp:
+                boot_out = fp.read()
+        except OSError:
+            boot_out = None
+        # label is available since CircuitPython 3.0
+        return (getattr(storage.getmount("/"), "label", None), boot_out)
+    print(repr(__mount_info_()))
+    del __mount_info_
+""").strip()
+
+
+def parse_walk_output(out):
+    return [ast.literal_eval(line)
+            for line in out.decode("utf-8").splitlines() if line.strip()]
+
+
+def parse_mount_info_output(out):
+    """Returns label (or None) and boot_out.txt content"""
+    return ast.literal_eval(out.decode("utf-8").strip())
+
+
+def parse_read_output(out):
+    return b"".join(ast.literal_eval(line.decode("utf-8"))
+                    for line in out.splitlines() if line.strip())
+
+
+class DeviceError(RuntimeError):
+    pass
+
+
+class SerialLink:
+    """Synchronous counterpart of Thonny's SerialHelper (the subset used by raw_repl)"""
+    def __init__(self, serial):
+        self._serial = serial
+        self._buffer = bytearray()
+
+    @classmethod
+    def open(cls, port, baudrate=115200):
+        # pyserial comes with Thonny
+        import serial
+        return cls(serial.Serial(port, baudrate=baudrate, timeout=0.05))
+
+    def read(self, size, timeout=1):
+        deadline = self._get_deadline(timeout)
+        while len(self._buffer) < size:
+            self._fill(deadline)
+        return self._take(size)
+
+    def read_until(self, terminators, timeout=2):
+        if not isinstance(terminators, (set, list, tuple)):
+            terminators = [terminators]
+
+        deadline = self._get_deadline(timeout)
+        while True:
+            found = [(self._buffer.find(terminator), terminator)
+                     for terminator in terminators if terminator in self._buffer]
+            if found:
+                position, terminator = min(found)
+                return self._take(position + len(terminator))
+            self._fill(deadline)
+
+    def read_all(self):
+        waiting = self._serial.in_waiting
+        if waiting:
+            self._buffer.extend(self._serial.read(waiting))
+        return self._take(len(self._buffer))
+
+    def incoming_is_empty(self):
+        return not self._buffer and not self._serial.in_waiting
+
+    def buffers_are_empty(self):
+        return self.incoming_is_empty()
+
+    def write(self, data, block_size=32, delay=0.01):
+        for i in range(0, len(data), block_size):
+            self._serial.write(data[i : i + block_size])
+            if delay:
+                time.sleep(delay)
+        return len(data)
+
+    def close(self):
+        self._serial.close()
+
+    def _get_deadline(self, timeout):
+        return None if timeout is None else time.time() + timeout
+
+    def _fill(self, deadline):
+        if deadline is not None and time.time() > deadline:
+            raise TimeoutError("Reaction timeout. Bytes read: %r" % bytes(self._buffer))
+        self._buffer.extend(self._serial.read(max(1, self._serial.in_waiting)))
+
+    def _take(self, size):
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+
+class Device:
+    """Raw REPL session with a CircuitPython device"""
+    def __init__(self, link):
+        self._link = link
+        self._supports_raw_paste = False
+        self.banner = None
+
+    def connect(self):
+        for delay in [0.05, 0.5, 2.0, 3.0]:
+            # Interrupt several times, because with some drivers first interrupts seem to vanish
+            self._link.write(b"\x03")
+            self._link.write(b"\x01")
+            time.sleep(delay)
+            discarded = self._link.read_all()
+            if discarded.endswith(FIRST_RAW_PROMPT) or discarded.endswith(b"\r\n>"):
+                break
+        else:
+            raise DeviceError("Can't get to raw prompt")
+
+        # Leaving the raw mode prints the banner
+        self._link.write(b"\x02")
+        self.banner = (self._link.read_until(NORMAL_PROMPT)
+                       .strip(b"\r\n >").decode("utf-8", "replace"))
+        self._link.write(b"\x01")
+        self._link.read_until(FIRST_RAW_PROMPT)
+
+        self._supports_raw_paste = probe_raw_paste(self._link)
+
+    def execute(self, script, timeout=10):
+        """Returns stdout and stderr (bytes) of the script"""
+        self._send_script(script)
+        output = self._link.read_until(EOT_WITH_RAW_PROMPT, timeout)[:-len(EOT_WITH_RAW_PROMPT)]
+        out, err = output.split(EOT, 1)
+        return out, err
+
+    def execute_and_expect_empty_response(self, script):
+        out, err = self.execute(script)
+        if out or err:
+            raise DeviceError("Unexpected response to %r: %r, %r" % (script, out, err))
+
+    def get_device_id(self):
+        return self._check_output(DEVICE_ID_SCRIPT).decode("utf-8").strip()
+
+    def list_files(self):
+        """Returns (path, is_dir, size, mtime) records of all files and directories"""
+        return parse_walk_output(self._check_output(WALK_FILES_SCRIPT, WALK_FILES_TIMEOUT))
+
+    def read_file(self, path):
+        return parse_read_output(self._check_output(READ_FILE_SCRIPT % path))
+
+    def get_mount_info(self):
+        """Returns volume label and content of boot_out.txt (or None)"""
+        return parse_mount_info_output(self._check_output(MOUNT_INFO_SCRIPT))
+
+    def upload(self, source, target):
+        with open(source, "rb") as local:
+            content = local.read()
+
+        # Raw-paste mode can take larger blocks without overflowing device's buffers
+        block_size = 512 if self._supports_raw_paste else 64
+
+        self.execute_and_expect_empty_response("__upf = open(%r, 'wb')" % target)
+        for i in range(0, len(content), block_size):
+            self.execute_and_expect_empty_response("__upf.write(%r)" % content[i : i + block_size])
+        self.execute_and_expect_empty_response("__upf.close()")
+        self.execute_and_expect_empty_response("del __upf")
+
+    def soft_reboot(self):
+        """Restarts the interpreter, which runs the main script. Closes the session."""
+        # In normal mode Ctrl+D runs code.py
+        self._link.write(b"\x02")
+        self._link.read_until(NORMAL_PROMPT)
+        self._link.write(b"\x04")
+        self._link.close()
+
+    def enter_bootloader(self):
+        """Restarts the device in UF2 bootloader mode. Closes the session."""
+        try:
+            self._send_script(ENTER_BOOTLOADER_SCRIPT)
+        except Exception:
+            # Device may vanish before confirming the command
+            logging.info("Problem when entering bootloader", exc_info=True)
+        finally:
+            self._link.close()
+
+    def close(self):
+        # Back to normal mode
+        self._link.write(b"\x02")
+        self._link.close()
+
+    def _send_script(self, script):
+        data = script.encode("utf-8")
+        if self._supports_raw_paste:
+            window_size = enter_raw_paste(self._link)
+            if window_size is not None:
+                raw_paste_write(self._link, data, window_size)
+                return
+            # Don't try again during this session
+            self._supports_raw_paste = False
+
+        self._link.write(data + EOT)
+        ok = self._link.read(2)
+        if ok != b"OK":
+            raise DeviceError("Expected OK, got %r, followed by %r" % (ok, self._link.read_all()))
+
+    def _check_output(self, script, timeout=10):
+        out, err = self.execute(script, timeout)
+        if err:
+            raise DeviceError(err.decode("utf-8", "replace").strip())
+        return out
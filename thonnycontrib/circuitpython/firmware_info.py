@@ -0,0 +1,99 @@
+"""Finding out which CircuitPython build a device runs or an image contains.
+
+CircuitPython compiles its REPL banner into the firmware and writes the same
+text into boot_out.txt, eg.
+"Adafruit CircuitPython 8.0.0 on 2023-02-06; Adafruit Feather M0 Express with samd21g18"
+"""
+import os.path
+import re
+import struct
+
+from thonnycontrib.circuitpython.uf2 import BLOCK_SIZE, FLAG_NOT_MAIN_FLASH,\
+    FLAG_FILE_CONTAINER, MAX_PAYLOAD_SIZE
+
+BOOT_OUT_FILE_NAME = "boot_out.txt"
+# Bootloader presents current content of the flash as this image
+CURRENT_UF2_FILE_NAME = "CURRENT.UF2"
+
+BANNER_REGEX = re.compile(
+    rb"CircuitPython (?P<version>[0-9][^ \x00\r\n]*) on (?P<date>[^;\x00\r\n]+); "
+    rb"(?P<board_name>[^\x00\r\n]+?) with (?P<mcu>[A-Za-z0-9_\-]+)")
+_MAX_BANNER_LENGTH = 200
+_READ_SIZE = BLOCK_SIZE * 128
+
+# Fields which must be equal for builds to be considered identical
+_IDENTITY_FIELDS = ["version", "date", "board_name", "mcu"]
+
+
+def _match_to_dict(match):
+    return {key : value.decode("utf-8", errors="replace")
+            for key, value in match.groupdict().items()}
+
+
+def parse_banner(text):
+    """Returns dict with keys "version", "date", "board_name" and "mcu" or None"""
+    match = BANNER_REGEX.search(text.encode("utf-8"))
+    return _match_to_dict(match) if match else None
+
+
+def read_boot_out(volume):
+    """Returns the banner of the firmware which created boot_out.txt on given CIRCUITPY
+    volume or None"""
+    path = os.path.join(volume, BOOT_OUT_FILE_NAME)
+    if not os.path.isfile(path):
+        return None
+    with open(path, encoding="utf-8", errors="replace") as fp:
+        # banner is on the first line, rest of the file can be written by boot.py
+        return parse_banner(fp.readline())
+
+
+def read_firmware_banner(path):
+    """Finds the banner from the payload of given UF2 image.
+
+    Reading stops when the banner is found, so checking the (large and slow)
+    CURRENT.UF2 on a bootloader volume usually doesn't read all of it.
+    """
+    buf = bytearray(_READ_SIZE)
+    view = memoryview(buf)
+    # keeps the tail of previous payload for matching across block boundaries
+    window = b""
+    with open(path, "rb") as fp:
+        while True:
+            count = fp.readinto(buf)
+            if count < BLOCK_SIZE:
+                return None
+
+            for offset in range(0, count - count % BLOCK_SIZE, BLOCK_SIZE):
+                flags, _, payload_size = struct.unpack_from("<3I", view, offset + 8)
+                if flags & (FLAG_NOT_MAIN_FLASH | FLAG_FILE_CONTAINER):
+                    continue
+                payload_size = min(payload_size, MAX_PAYLOAD_SIZE)
+                window = window[-_MAX_BANNER_LENGTH:] + view[offset + 32 : offset + 32 + payload_size]
+                if b"CircuitPython " not in window:
+                    continue
+                match = BANNER_REGEX.search(window)
+                if match is not None and match.end() < len(window):
+                    return _match_to_dict(match)
+
+
+def read_installed_banner(bootloader_volume):
+    """Returns the banner of the firmware currently in the flash or None"""
+    path = os.path.join(bootloader_volume, CURRENT_UF2_FILE_NAME)
+    if not os.path.isfile(path):
+        return None
+    return read_firmware_banner(path)
+
+
+def format_banner(banner):
+    return "CircuitPython %s (%s) for %s" % (banner["version"], banner["date"],
+                                            banner["board_name"])
+
+
+def explain_identical(installed, target):
+    """Returns the reason for skipping the installation or None if the builds
+    are different or either is unknown."""
+    if not installed or not target:
+        return None
+    if all(installed[key] == target[key] for key in _IDENTITY_FIELDS):
+        return "already runs " + format_banner(installed)
+    return None
@@ -0,0 +1,166 @@
+"""Local store of firmware images.
+
+Images are stored under the hash of their content, so importing the same
+download twice doesn't duplicate it. Information for choosing an image
+(board, version, UF2 family) is parsed once at import time and kept in a JSON
+index, so finding an image for a device doesn't touch the images themselves.
+
+The bootloader's Board-ID (INFO_UF2.TXT) differs from the board id in
+CircuitPython's file names, so Board-IDs of the devices an image was installed
+to are recorded in its entry as well.
+"""
+import json
+import os.path
+import re
+import shutil
+import tempfile
+import threading
+
+from thonnycontrib.circuitpython.sync import hash_file
+from thonnycontrib.circuitpython.firmware_info import read_firmware_banner
+from thonnycontrib.circuitpython.uf2 import parse_uf2
+
+INDEX_FILE_NAME = "index.json"
+
+# eg. adafruit-circuitpython-feather_m0_express-en_US-8.0.0.uf2
+_FILE_NAME_REGEX = re.compile(
+    r"^adafruit-circuitpython-(?P<board_id>.+?)-(?P<language>[a-z]{2}(?:_[A-Za-z]+)?)"
+    r"-(?P<version>[0-9].*?)\.uf2$", re.IGNORECASE)
+
+
+def parse_firmware_file_name(file_name):
+    """Returns dict with "board_id", "language" and "version" or None"""
+    match = _FILE_NAME_REGEX.match(file_name)
+    return match.groupdict() if match else None
+
+
+def version_key(version):
+    """Sort key which puts pre-releases (8.0.0-beta.1) before the release (8.0.0)"""
+    match = re.match(r"^(\d+)(?:\.(\d+))?(?:\.(\d+))?(.*)$", version or "")
+    if match is None:
+        return (-1, -1, -1, 0, version or "")
+    numbers = tuple(int(part or 0) for part in match.groups()[:3])
+    suffix = match.group(4)
+    return numbers + (0 if suffix else 1, suffix)
+
+
+def normalize_board_name(name):
+    return " ".join(name.split()).casefold() if name else ""
+
+
+def _get_board_ids(entry):
+    board_ids = entry.get("bootloader_board_ids", []) + [entry.get("board_id")]
+    return {board_id.casefold() for board_id in board_ids if board_id}
+
+
+class FirmwareLibrary:
+    def __init__(self, directory):
+        self._directory = directory
+        self._index = None
+        # Imports may run in a worker thread while the dialog looks up images
+        self._lock = threading.RLock()
+
+    def import_file(self, path, bootloader_infos=()):
+        """Copies the image into the library (unless already there).
+
+        bootloader_infos (INFO_UF2.TXT fields) of the devices the image is meant
+        for let find_newest match the image by the devices' Board-IDs.
+        Returns the index entry of the image. Raises Uf2Error for invalid images.
+        """
+        content_hash = hash_file(path)
+        with self._lock:
+            entry = self._get_index().get(content_hash)
+            if entry is not None and os.path.exists(self.get_path(content_hash)):
+                if self._add_bootloader_board_ids(entry, bootloader_infos):
+                    self._save_index()
+                return dict(entry)
+
+        uf2_info = parse_uf2(path)
+        banner = read_firmware_banner(path) or {}
+        name_info = parse_firmware_file_name(os.path.basename(path)) or {}
+
+        os.makedirs(self._directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(suffix=".uf2", dir=self._directory)
+        os.close(fd)
+        try:
+            shutil.copyfile(path, temp_path)
+            os.replace(temp_path, self.get_path(content_hash))
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+        entry = {
+            "hash" : content_hash,
+            "file_name" : os.path.basename(path),
+            "board_id" : name_info.get("board_id"),
+            "board_name" : banner.get("board_name"),
+            "mcu" : banner.get("mcu"),
+            "version" : banner.get("version") or name_info.get("version"),
+            "family_ids" : sorted(uf2_info.family_ids),
+            "size" : os.path.getsize(path),
+            "bootloader_board_ids" : [],
+        }
+        self._add_bootloader_board_ids(entry, bootloader_infos)
+        with self._lock:
+            self._get_index()[content_hash] = entry
+            self._save_index()
+        return dict(entry)
+
+    def get_path(self, content_hash):
+        return os.path.join(self._directory, content_hash + ".uf2")
+
+    def get_entries(self):
+        with self._lock:
+            return [dict(entry) for entry in self._get_index().values()]
+
+    def find_newest(self, bootloader_info):
+        """Returns the entry of newest image built for the board with given INFO_UF2.TXT
+        fields or None.
+
+        Images are matched by the Board-ID, the Model is used only if no image
+        is known for the Board-ID.
+        """
+        entries = [entry for entry in self.get_entries()
+                   if os.path.exists(self.get_path(entry["hash"]))]
+
+        board_id = (bootloader_info.get("Board-ID") or "").casefold()
+        candidates = [entry for entry in entries
+                      if board_id and board_id in _get_board_ids(entry)]
+
+        model = normalize_board_name(bootloader_info.get("Model"))
+        if not candidates and model:
+            candidates = [entry for entry in entries
+                          if normalize_board_name(entry["board_name"]) == model]
+
+        if not candidates:
+            return None
+        return max(candidates, key=lambda entry: version_key(entry["version"]))
+
+    def _add_bootloader_board_ids(self, entry, bootloader_infos):
+        """Returns True if the entry changed"""
+        board_ids = entry.setdefault("bootloader_board_ids", [])
+        changed = False
+        for info in bootloader_infos:
+            board_id = info.get("Board-ID")
+            if board_id and board_id not in board_ids:
+                board_ids.append(board_id)
+                changed = True
+        return changed
+
+    def _get_index(self):
+        if self._index is None:
+            path = os.path.join(self._directory, INDEX_FILE_NAME)
+            try:
+                with open(path, encoding="utf-8") as fp:
+                    self._index = json.load(fp)
+            except (OSError, ValueError):
+                # missing or corrupted index means empty library
+                self._index = {}
+        return self._index
+
+    def _save_index(self):
+        os.makedirs(self._directory, exist_ok=True)
+        path = os.path.join(self._directory, INDEX_FILE_NAME)
+        with open(path + ".tmp", "w", encoding="utf-8") as fp:
+            json.dump(self._index, fp, indent=1, sort_keys=True)
+        os.replace(path + ".tmp", path)
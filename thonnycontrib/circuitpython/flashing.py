@@ -0,0 +1,264 @@
+"""Copying firmware images to UF2 bootloader volumes"""
+import logging
+import os.path
+import queue
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from thonnycontrib.circuitpython.firmware_info import CURRENT_UF2_FILE_NAME
+from thonnycontrib.circuitpython.uf2 import find_mismatches, format_mismatches, Uf2Error
+
+CopyProgress = namedtuple("CopyProgress", ["copied", "total", "bytes_per_second", "eta"])
+
+# volume is None for the events concerning the whole job
+FlashingEvent = namedtuple("FlashingEvent", ["volume", "phase", "progress", "message"])
+
+PHASE_CHECKING = "checking"
+PHASE_COPYING = "copying"
+PHASE_VERIFYING = "verifying"
+# Final phases of a volume
+PHASE_DONE = "done"
+PHASE_SKIPPED = "skipped"
+PHASE_FAILED = "failed"
+PHASE_CANCELLED = "cancelled"
+# Last event of the job
+PHASE_FINISHED = "finished"
+
+FINAL_PHASES = {PHASE_DONE, PHASE_SKIPPED, PHASE_FAILED, PHASE_CANCELLED}
+
+INITIAL_BLOCK_SIZE = 64*1024
+MAX_BLOCK_SIZE = 1024*1024
+# Blocks grow until writing one takes about this long
+TARGET_BLOCK_TIME = 0.1
+
+
+class FlashingCancelled(Exception):
+    pass
+
+
+class Throttle:
+    """Limits the total rate of writes shared by several threads"""
+    def __init__(self, bytes_per_second):
+        self._bytes_per_second = bytes_per_second
+        self._lock = threading.Lock()
+        self._next_free_time = time.time()
+
+    def consume(self, size):
+        """Blocks until given amount of bytes fits into the budget"""
+        with self._lock:
+            now = time.time()
+            start_time = max(now, self._next_free_time)
+            self._next_free_time = start_time + size / self._bytes_per_second
+        if start_time > now:
+            time.sleep(start_time - now)
+
+
+def copy_firmware(source, target, on_progress=None, sync_interval=None, throttle=None,
+                  cancel_event=None):
+    """Copies firmware image to the bootloader volume.
+
+    Bootloader needs the data to reach the device only by the end, so by
+    default the file gets synced once. Giving sync_interval (in seconds) adds
+    intermediate syncs, which keep the progress honest (otherwise OS cache
+    absorbs whole image immediately and the real work happens in the final
+    sync).
+
+    on_progress gets called with CopyProgress after each block.
+
+    Setting cancel_event stops the copying after current block, removes the
+    partial file and raises FlashingCancelled.
+    """
+    total = os.path.getsize(source)
+    try:
+        _copy_blocks(source, target, total, on_progress, sync_interval, throttle, cancel_event)
+    except FlashingCancelled:
+        if os.path.exists(target):
+            os.remove(target)
+        raise
+
+    return total
+
+
+def _copy_blocks(source, target, total, on_progress, sync_interval, throttle, cancel_event):
+    block_size = INITIAL_BLOCK_SIZE
+    copied = 0
+    start_time = time.time()
+    last_sync_time = start_time
+
+    with open(source, "rb") as fsrc, open(target, "wb") as fdst:
+        while True:
+            if cancel_event is not None and cancel_event.is_set():
+                raise FlashingCancelled()
+
+            block_start_time = time.time()
+            buf = fsrc.read(block_size)
+            if not buf:
+                break
+
+            if throttle is not None:
+                throttle.consume(len(buf))
+            fdst.write(buf)
+            copied += len(buf)
+
+            now = time.time()
+            if sync_interval is not None and now - last_sync_time >= sync_interval:
+                fdst.flush()
+                os.fsync(fdst)
+                now = last_sync_time = time.time()
+
+            if now - block_start_time < TARGET_BLOCK_TIME and block_size < MAX_BLOCK_SIZE:
+                block_size *= 2
+
+            if on_progress is not None:
+                on_progress(_create_progress(copied, total, now - start_time))
+
+        fdst.flush()
+        os.fsync(fdst)
+
+    if on_progress is not None:
+        on_progress(_create_progress(copied, total, time.time() - start_time))
+
+
+def verify_flashing(source, volume):
+    """Compares the image with the flash content if the bootloader still exposes it.
+
+    Raises Uf2Error on mismatch. Returns False if verification wasn't possible
+    (most bootloaders restart the device right after flashing).
+    """
+    current_path = os.path.join(volume, CURRENT_UF2_FILE_NAME)
+    try:
+        if not os.path.isfile(current_path):
+            return False
+        mismatches = find_mismatches(source, current_path)
+    except OSError:
+        logging.info("Could not read back %s", current_path, exc_info=True)
+        return False
+
+    if mismatches:
+        raise Uf2Error(format_mismatches(mismatches))
+    return True
+
+
+class FlashingJob:
+    """Installs the image to several volumes in parallel.
+
+    All information (progress, phases, errors) is passed to the owner as
+    FlashingEvent-s via a queue, which the owner drains with get_events
+    (eg. in Tk's after-callback), so no state is shared between threads.
+    Job ends with an event having volume None and phase PHASE_FINISHED.
+
+    explain_skip, if given, gets called with a volume before copying and
+    may return the reason for not installing to it.
+    """
+    def __init__(self, source, volumes, max_workers=4, max_bytes_per_second=None,
+                 sync_interval=None, verify=False, explain_skip=None):
+        self._source = source
+        self._volumes = list(volumes)
+        self._max_workers = max_workers
+        self._throttle = Throttle(max_bytes_per_second) if max_bytes_per_second else None
+        self._sync_interval = sync_interval
+        self._verify = verify
+        self._explain_skip = explain_skip
+
+        self._events = queue.Queue()
+        self._cancel_event = threading.Event()
+        self._results = {}
+
+    def start(self):
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def run(self):
+        """Flashes in the calling thread, returns dict from volume to its final event"""
+        try:
+            with ThreadPoolExecutor(max_workers=self._max_workers) as executor:
+                for volume in self._volumes:
+                    executor.submit(self._flash_volume, volume)
+        except Exception as e:
+            logging.exception("Flashing failed")
+            self._emit(None, PHASE_FAILED, message=str(e))
+        finally:
+            self._emit(None, PHASE_FINISHED)
+
+        return dict(self._results)
+
+    def cancel(self):
+        self._cancel_event.set()
+
+    def is_cancelled(self):
+        return self._cancel_event.is_set()
+
+    def get_events(self):
+        """Returns the events reported since last call (without blocking)"""
+        result = []
+        while True:
+            try:
+                result.append(self._events.get_nowait())
+            except queue.Empty:
+                return result
+
+    def _emit(self, volume, phase, progress=None, message=None):
+        event = FlashingEvent(volume, phase, progress, message)
+        if phase in FINAL_PHASES and volume is not None:
+            self._results[volume] = event
+        self._events.put(event)
+
+    def _flash_volume(self, volume):
+        try:
+            if self._cancel_event.is_set():
+                raise FlashingCancelled()
+
+            if self._explain_skip is not None:
+                self._emit(volume, PHASE_CHECKING)
+                reason = self._explain_skip(volume)
+                if reason:
+                    self._emit(volume, PHASE_SKIPPED, message=reason)
+                    return
+
+            target = os.path.join(volume, os.path.basename(self._source))
+            copy_firmware(self._source, target,
+                          lambda progress: self._emit(volume, PHASE_COPYING, progress),
+                          self._sync_interval, self._throttle, self._cancel_event)
+
+            message = None
+            if self._verify:
+                self._emit(volume, PHASE_VERIFYING)
+                if not verify_flashing(self._source, volume):
+                    message = "not verified, device left bootloader mode"
+            self._emit(volume, PHASE_DONE, message=message)
+        except FlashingCancelled:
+            self._emit(volume, PHASE_CANCELLED)
+        except Exception as e:
+            logging.exception("Could not flash %s", volume)
+            self._emit(volume, PHASE_FAILED, message=str(e))
+
+
+def _create_progress(copied, total, elapsed):
+    if elapsed > 0 and copied > 0:
+        rate = copied / elapsed
+        eta = (total - copied) / rate
+    else:
+        rate = None
+        eta = None
+    return CopyProgress(copied, total, rate, eta)
+
+
+def sum_progress(progresses):
+    """Combines progress of parallel copies"""
+    progresses = list(progresses)
+    rates = [p.bytes_per_second for p in progresses if p.bytes_per_second is not None]
+    etas = [p.eta for p in progresses if p.eta is not None]
+    return CopyProgress(sum(p.copied for p in progresses),
+                        sum(p.total for p in progresses),
+                        sum(rates) if rates else None,
+                        max(etas) if etas else None)
+
+
+def format_progress(progress):
+    percent = int(progress.copied / progress.total * 100) if progress.total else 100
+    if progress.bytes_per_second is None:
+        return "%d %%" % percent
+    else:
+        return "%d %%, %d KB/s, %d s left" % (percent, progress.bytes_per_second / 1024,
+                                             round(progress.eta))
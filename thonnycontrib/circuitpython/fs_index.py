@@ -0,0 +1,103 @@
+import os
+import posixpath
+from collections import namedtuple
+
+FileInfo = namedtuple("FileInfo", ["is_dir", "size", "mtime"])
+
+
+def normalize_device_path(path):
+    path = path.replace("\\", "/")
+    if not path.startswith("/"):
+        path = "/" + path
+    path = posixpath.normpath(path)
+    if path.startswith("//"):
+        path = path[1:]
+    return path
+
+
+def walk_mount(mount):
+    """Returns (path, is_dir, size, mtime) records for the device's files mounted at given directory"""
+    records = []
+    for dirpath, dirnames, filenames in os.walk(mount):
+        rel_dir = os.path.relpath(dirpath, mount)
+        prefix = "/" if rel_dir == "." else "/" + rel_dir.replace("\\", "/") + "/"
+        for name in dirnames + filenames:
+            st = os.stat(os.path.join(dirpath, name))
+            records.append((prefix + name, name in dirnames, st.st_size, st.st_mtime))
+    return records
+
+
+class DeviceFileIndex:
+    """In-memory index of the files on the device.
+
+    The index is filled in one go and answers lookups from memory afterwards.
+    Proxy must report its own writes and deletions and invalidate
+    the whole index when the device may have changed the files by itself
+    (eg. after soft reboot).
+    """
+    def __init__(self):
+        self._entries = None
+        self._children = None
+
+    def is_filled(self):
+        return self._entries is not None
+
+    def fill(self, records):
+        """records is an iterable of (path, is_dir, size, mtime) tuples"""
+        self._entries = {"/" : FileInfo(True, 0, None)}
+        self._children = {"/" : set()}
+        for path, is_dir, size, mtime in records:
+            self._put(normalize_device_path(path), FileInfo(is_dir, size, mtime))
+
+    def invalidate(self):
+        self._entries = None
+        self._children = None
+
+    def get(self, path):
+        assert self.is_filled()
+        return self._entries.get(normalize_device_path(path))
+
+    def exists(self, path):
+        return self.get(path) is not None
+
+    def listdir(self, path="/"):
+        assert self.is_filled()
+        return sorted(self._children.get(normalize_device_path(path), ()))
+
+    def record_write(self, path, size, mtime=None):
+        if not self.is_filled():
+            # will be fetched from the device when needed
+            return
+        self._put(normalize_device_path(path), FileInfo(False, size, mtime))
+
+    def record_delete(self, path):
+        if not self.is_filled():
+            return
+        path = normalize_device_path(path)
+        if path == "/":
+            self.fill([])
+            return
+
+        for entry_path in self._find_subtree(path):
+            del self._entries[entry_path]
+            self._children.pop(entry_path, None)
+
+        parent, name = posixpath.split(path)
+        self._children.get(parent, set()).discard(name)
+
+    def _find_subtree(self, path):
+        prefix = path + "/"
+        return [entry_path for entry_path in self._entries
+                if entry_path == path or entry_path.startswith(prefix)]
+
+    def _put(self, path, info):
+        parent, name = posixpath.split(path)
+        if parent not in self._entries:
+            self._put(parent, FileInfo(True, 0, None))
+
+        self._entries[path] = info
+        self._children[parent].add(name)
+        if info.is_dir:
+            self._children.setdefault(path, set())
+        else:
+            self._children.pop(path, None)
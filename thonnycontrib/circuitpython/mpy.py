@@ -0,0 +1,97 @@
+"""Precompiling modules to .mpy with a local mpy-cross.
+
+Compiled files are cached by the hash of the source and the bytecode ABI
+of the target firmware.
+"""
+import hashlib
+import os.path
+import posixpath
+import subprocess
+import tempfile
+from textwrap import dedent
+
+from thonnycontrib.circuitpython.fs_index import normalize_device_path
+from thonnycontrib.circuitpython.sync import hash_file
+
+# Scripts run by the firmware itself must stay as source
+ENTRY_POINT_NAMES = {"settings.py", "boot.py", "code.py", "main.py"}
+
+# Prints (sys.implementation._mpy or None, firmware version)
+ABI_INFO_SCRIPT = dedent("""
+    import sys as __sys_
+    print(repr((getattr(__sys_.implementation, "_mpy", None), tuple(__sys_.implementation.version))))
+    del __sys_
+""").strip()
+
+
+def abi_from_info(mpy_info, version):
+    """Returns a string identifying the .mpy format the firmware accepts"""
+    if mpy_info:
+        # lowest byte is the .mpy version, next byte has the sub-version
+        return "mpy%d.%d" % (mpy_info & 0xff, (mpy_info >> 8) & 3)
+    else:
+        # older firmware, .mpy format has changed only with major versions
+        return "cp%d" % version[0]
+
+
+def should_compile(device_path):
+    # Thonny may give paths without the leading slash
+    device_path = normalize_device_path(device_path)
+    return (device_path.endswith(".py")
+            and not (posixpath.dirname(device_path) == "/"
+                     and posixpath.basename(device_path) in ENTRY_POINT_NAMES))
+
+
+def get_mpy_path(device_path):
+    assert device_path.endswith(".py")
+    return device_path[:-len(".py")] + ".mpy"
+
+
+def create_mpy_cross_compiler(mpy_cross_path):
+    """Returns function for compiling a source file to given .mpy file"""
+    def compile_file(source, target, source_name):
+        proc = subprocess.Popen([mpy_cross_path, "-o", target, "-s", source_name, source],
+                                stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                universal_newlines=True)
+        out, _ = proc.communicate()
+        if proc.returncode != 0:
+            raise RuntimeError("mpy-cross failed on %s:\n%s" % (source, out))
+
+    return compile_file
+
+
+class MpyCache:
+    def __init__(self, cache_dir, compile_file):
+        self._cache_dir = cache_dir
+        self._compile_file = compile_file
+
+    def get_compiled(self, source, device_path, abi):
+        """Returns path to the .mpy file compiled from given source"""
+        # source name gets embedded into the .mpy
+        name_hash = hashlib.sha1(device_path.encode("utf-8")).hexdigest()[:8]
+        target = os.path.join(self._cache_dir, abi, hash_file(source) + "_" + name_hash + ".mpy")
+        if not os.path.exists(target):
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(suffix=".mpy", dir=os.path.dirname(target))
+            os.close(fd)
+            try:
+                self._compile_file(source, temp_path, device_path.lstrip("/"))
+                os.replace(temp_path, target)
+            finally:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+
+        return target
+
+    def compile_files(self, local_files, abi):
+        """Takes and returns dict from device path to local path.
+
+        Sources which should be compiled get replaced by .mpy files.
+        """
+        result = {}
+        for device_path, local_path in local_files.items():
+            if should_compile(device_path):
+                result[get_mpy_path(device_path)] = self.get_compiled(local_path, device_path, abi)
+            else:
+                result[device_path] = local_path
+        return result
@@ -0,0 +1,68 @@
+"""Names in the board module of specific boards.
+
+The generic api_stubs/board.py describes Circuit Playground Express. For
+boards identified by their USB ids boards.json gives the real pin names
+(see boards.Board.pins), so completion after "board." and checking scripts
+for nonexistent pins don't need to parse anything.
+"""
+import ast
+import bisect
+
+# board members which are functions (returning default buses), not pins
+_BOARD_FUNCTIONS = {"I2C", "SPI", "UART", "STEMMA_I2C"}
+
+
+class PinSet:
+    def __init__(self, names):
+        self._sorted = tuple(sorted(set(names)))
+        self._names = frozenset(self._sorted)
+
+    def __contains__(self, name):
+        return name in self._names
+
+    def __len__(self):
+        return len(self._sorted)
+
+    def complete(self, prefix):
+        """Returns (name, kind, signature) of the names starting with prefix"""
+        result = []
+        for i in range(bisect.bisect_left(self._sorted, prefix), len(self._sorted)):
+            name = self._sorted[i]
+            if not name.startswith(prefix):
+                break
+            if name in _BOARD_FUNCTIONS:
+                result.append((name, "function", "()"))
+            else:
+                result.append((name, "constant", ""))
+        return result
+
+
+def find_unknown_pins(source, pins):
+    """Returns (line number, name) for each board member used in the source
+    which is not in given pins (PinSet or set of names)"""
+    try:
+        tree = ast.parse(source)
+    except SyntaxError:
+        return []
+
+    board_aliases = set()
+    result = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                if alias.name == "board":
+                    board_aliases.add(alias.asname or alias.name)
+        elif isinstance(node, ast.ImportFrom) and node.module == "board":
+            for alias in node.names:
+                if alias.name != "*" and alias.name not in pins:
+                    result.append((node.lineno, alias.name))
+
+    for node in ast.walk(tree):
+        if (isinstance(node, ast.Attribute)
+                and isinstance(node.value, ast.Name)
+                and node.value.id in board_aliases
+                and not node.attr.startswith("__")
+                and node.attr not in pins):
+            result.append((node.lineno, node.attr))
+
+    return sorted(set(result))
@@ -0,0 +1,1247 @@
+import os.path
+import tkinter as tk
+from tkinter import ttk
+import jedi
+
+from thonny.plugins.micropython import MicroPythonProxy, MicroPythonConfigPage,\
+    add_micropython_backend, parse_api_information, FIRST_RAW_PROMPT
+from thonny import get_workbench, get_runner, get_shell, THONNY_USER_DIR
+from thonny.common import ToplevelResponse, InlineResponse
+from thonny.ui_utils import create_url_label, show_dialog, askopenfilename
+import traceback
+from tkinter.messagebox import showinfo, showerror
+from thonnycontrib.circuitpython.fs_index import DeviceFileIndex, walk_mount, normalize_device_path
+from thonnycontrib.circuitpython.device import WALK_FILES_SCRIPT, WALK_FILES_TIMEOUT,\
+    READ_FILE_SCRIPT, ENTER_BOOTLOADER_SCRIPT, MOUNT_INFO_SCRIPT, PROBE_SCRIPT_PATHS_SCRIPT,\
+    BOOT_SCRIPT_CANDIDATES, MAIN_SCRIPT_CANDIDATES, parse_walk_output, parse_read_output,\
+    parse_mount_info_output
+from thonnycontrib.circuitpython.sync import ManifestStore, list_local_files, build_manifest,\
+    plan_sync, apply_sync_plan, MountSyncTarget, SerialSyncTarget, DEVICE_ID_SCRIPT,\
+    disable_autoreload, restore_autoreload
+from thonnycontrib.circuitpython.mpy import MpyCache, create_mpy_cross_compiler,\
+    should_compile, get_mpy_path, abi_from_info, ABI_INFO_SCRIPT
+from thonnycontrib.circuitpython.volumes import find_device_mount, is_writable_dir, MountPairings
+from thonnycontrib.circuitpython.raw_repl import probe_raw_paste, enter_raw_paste,\
+    raw_paste_write
+import logging
+import queue
+import time
+import threading
+from thonnycontrib.circuitpython.volume_watcher import VolumeWatcher, NewVolumeWait
+from thonnycontrib.circuitpython.flashing import FlashingJob, FlashingEvent, CopyProgress,\
+    format_progress, sum_progress, PHASE_COPYING, PHASE_DONE, PHASE_SKIPPED, PHASE_FAILED,\
+    PHASE_CANCELLED, PHASE_FINISHED
+from thonnycontrib.circuitpython.firmware_library import FirmwareLibrary
+from thonnycontrib.circuitpython.firmware_info import read_firmware_banner, read_boot_out,\
+    read_installed_banner, explain_identical, format_banner, parse_banner, BOOT_OUT_FILE_NAME
+from thonnycontrib.circuitpython.uf2 import parse_uf2, read_bootloader_info, check_compatibility,\
+    Uf2Error
+from thonnycontrib.circuitpython.boards import load_board_database, DEFAULT_MOUNT_LABEL
+from thonnycontrib.circuitpython.port_watcher import PortWatcher
+from thonnycontrib.circuitpython.stubs import StubCache, select_stub_modules,\
+    create_introspection_script, parse_introspection_output, INTROSPECTION_TIMEOUT
+from thonnycontrib.circuitpython.stub_layers import StubLayers, select_layers
+from thonnycontrib.circuitpython.completion_index import CompletionIndex, INDEX_FILE_NAME,\
+    parse_completion_context
+from thonnycontrib.circuitpython.pins import PinSet, find_unknown_pins
+from thonnycontrib.circuitpython.ram_estimate import RamEstimateCache, estimate_project,\
+    format_estimate, get_heap_budget, parse_mem_free_output, MEM_FREE_SCRIPT
+
+# Seconds to wait for the bootloader volume after reset
+_BOOTLOADER_TIMEOUT = 20
+
+_board_database = None
+_port_watcher = None
+# Survives reconnects, so known devices don't need pairing again
+_mount_pairings = MountPairings()
+
+
+def get_board_database():
+    global _board_database
+    if _board_database is None:
+        _board_database = load_board_database(THONNY_USER_DIR)
+    return _board_database
+
+
+def get_port_watcher():
+    global _port_watcher
+    if _port_watcher is None:
+        _port_watcher = PortWatcher(
+            on_appeared=lambda info: logging.info("Serial port appeared: %s", info.device),
+            on_disappeared=lambda info: logging.info("Serial port disappeared: %s", info.device))
+        _port_watcher.start()
+    return _port_watcher
+
+def _find_first(names, exists):
+    for name in names:
+        if exists("/" + name):
+            return name
+    return ""
+
+class CircuitPythonProxy(MicroPythonProxy):
+    def __init__(self, clean):
+        # Filled on first need, valid for current connection
+        self._file_index = DeviceFileIndex()
+        self._script_paths = None
+        self._device_id = None
+        # False means not looked up yet
+        self._fs_mount = False
+        self._supports_raw_paste = False
+        self._mpy_abi = None
+        self._firmware_banner = None
+        self._mount_info = None
+        self._device_stubs_path = None
+        self._stub_layers = None
+        self._board_pins = None
+        # Created on first completion request, if the cache doesn't have them
+        self._needs_device_stubs = False
+        # Output of the running introspection script or None
+        self._introspection_output = None
+        self._introspection_deadline = None
+        # Paths of stored stubs, filled by a worker thread
+        self._stored_device_stubs = queue.Queue()
+        MicroPythonProxy.__init__(self, clean)
+        
+        # Stubs of the connected firmware replace the ones chosen without knowing it
+        self._stub_layers = None
+        if (self._serial is not None and self._firmware_banner is not None
+            and get_workbench().get_option("CircuitPython.generate_api_stubs")):
+            self._device_stubs_path = self._get_stub_cache().get_path(
+                self._firmware_banner["board_name"], self._firmware_banner["version"])
+            self._needs_device_stubs = self._device_stubs_path is None
+        self._builtins_info = self._get_builtins_info()
+        if self._serial is not None:
+            self._board_pins = self._find_board_pins()
+    
+    def _get_stub_cache(self):
+        return StubCache(os.path.join(THONNY_USER_DIR, "circuitpython_stubs"))
+    
+    def _start_introspection(self):
+        """Starts creating the stubs of connected firmware. The output is collected
+        in fetch_next_message, so Thonny stays responsive and completion uses
+        the packaged stubs until the new ones are stored."""
+        self._needs_device_stubs = False
+        try:
+            self._execute_async(create_introspection_script(
+                select_stub_modules(self._builtin_modules)))
+        except Exception:
+            logging.exception("Could not create API stubs for the device")
+            # Rest of the output must not be taken as response to next command
+            self._resync_raw_prompt()
+            return
+        self._introspection_output = bytearray()
+        self._introspection_deadline = time.time() + INTROSPECTION_TIMEOUT
+    
+    def _collect_introspection_output(self):
+        try:
+            self._introspection_output += self._serial.read_all()
+        except Exception:
+            # MicroPythonProxy.fetch_next_message reports the problem
+            logging.exception("Could not read API stubs from the device")
+            self._introspection_output = None
+            return
+        
+        terminator = b"\x04>"
+        if self._introspection_output.endswith(terminator):
+            out, err = bytes(self._introspection_output[:-len(terminator)]).split(b"\x04", 1)
+            self._introspection_output = None
+            self.idle = True
+            # Rendering and indexing take a while on the host too
+            threading.Thread(target=self._store_device_stubs,
+                             args=(self._firmware_banner, out, err), daemon=True).start()
+        elif time.time() > self._introspection_deadline:
+            logging.error("Timeout when creating API stubs for the device")
+            self._introspection_output = None
+            self._resync_raw_prompt()
+    
+    def _store_device_stubs(self, banner, out, err):
+        "NB! works in background thread"
+        try:
+            if err:
+                raise RuntimeError(err.decode("utf-8", errors="replace"))
+            self._stored_device_stubs.put(self._get_stub_cache().store(
+                banner["board_name"], banner["version"], parse_introspection_output(out)))
+        except Exception:
+            logging.exception("Could not create API stubs for the device")
+    
+    def _use_device_stubs(self, path):
+        self._device_stubs_path = path
+        self._stub_layers = None
+        self._builtins_info = self._get_builtins_info()
+        if self._serial is not None:
+            self._board_pins = self._find_board_pins()
+    
+    def fetch_next_message(self):
+        while not self._stored_device_stubs.empty():
+            self._use_device_stubs(self._stored_device_stubs.get_nowait())
+        
+        if self._introspection_output is not None and self._non_serial_msg_queue.empty():
+            # Output of the introspection is not meant for the shell
+            self._collect_introspection_output()
+            return None
+        
+        return MicroPythonProxy.fetch_next_message(self)
+    
+    def _resync_raw_prompt(self):
+        """Interrupts the device and discards its output up to a fresh raw prompt.
+        Disconnects if the device doesn't respond."""
+        try:
+            self._serial.write(b"\x03")  # interrupt
+            self._serial.write(b"\x01")  # raw mode prints its prompt again
+            self._discarded_bytes += self._serial.read_until(FIRST_RAW_PROMPT)
+            self.idle = True
+        except Exception:
+            logging.exception("Could not get back to raw prompt")
+            self.disconnect()
+    
+    def _find_board_pins(self):
+        """Returns PinSet of the connected board or None if it's not known"""
+        if self._device_stubs_path and os.path.isfile(
+                os.path.join(self._device_stubs_path, "board.py")):
+            # Introspected board module is exact
+            index = CompletionIndex(os.path.join(self._device_stubs_path, INDEX_FILE_NAME))
+            try:
+                return PinSet(name for name, _, _ in index.lookup("board"))
+            except (OSError, ValueError):
+                logging.exception("Could not read board module from device stubs")
+            finally:
+                index.close()
+        
+        board = self._get_board()
+        return board.pins if board else None
+    
+    def _warn_about_unknown_pins(self, source, file_name):
+        if self._board_pins is None:
+            return
+        board_name = self._firmware_banner["board_name"] if self._firmware_banner else "this board"
+        for line_number, name in find_unknown_pins(source, self._board_pins):
+            self._send_text_to_shell("Warning: board.%s doesn't exist on %s (%s, line %d)"
+                                     % (name, board_name, file_name, line_number), "stderr")
+    
+    def _warn_about_ram_usage(self, local_files, compile_to_mpy):
+        """Warns if the project probably doesn't fit into the free heap of the device"""
+        compiled = {path for path in local_files if should_compile(path)} if compile_to_mpy else set()
+        try:
+            estimate = estimate_project(
+                local_files, lambda name: self._get_stub_layers().find_module_dir(name) is not None,
+                RamEstimateCache(os.path.join(THONNY_USER_DIR, "circuitpython_ram_estimates")),
+                compiled)
+        except OSError:
+            logging.exception("Could not estimate RAM usage")
+            return
+        if estimate is None:
+            return
+        
+        out, err = self._execute_and_get_response(MEM_FREE_SCRIPT)
+        budget = None
+        if not err:
+            try:
+                budget = parse_mem_free_output(out)
+            except ValueError:
+                # eg. output of a background task got mixed in
+                logging.exception("Could not parse free memory from %r", out)
+        if budget is None:
+            budget = get_heap_budget(self._firmware_banner["mcu"] if self._firmware_banner else None)
+        
+        if budget is not None and estimate.peak > budget:
+            self._send_text_to_shell("Warning: %s probably needs more memory than the device has.\n%s\n"
+                                     "(Free memory was measured at the REPL. Soft reboot "
+                                     "releases what the session holds.)"
+                                     % (estimate.main_path, format_estimate(estimate, budget)),
+                                     "stderr")
+    
+    def _get_stub_layers(self):
+        if self._stub_layers is None:
+            layers = select_layers(self._firmware_banner)
+            if self._device_stubs_path:
+                # Packaged layers cover the modules which weren't introspected
+                layers.insert(0, (self._device_stubs_path, set(), {}))
+            self._stub_layers = StubLayers(
+                layers, os.path.join(THONNY_USER_DIR, "circuitpython_stub_overrides"))
+        return self._stub_layers
+    
+    def _get_api_stubs_path(self):
+        if self._device_stubs_path:
+            return self._device_stubs_path
+        return MicroPythonProxy._get_api_stubs_path(self)
+    
+    def _get_builtins_info(self):
+        # NB! Called already by MicroPythonProxy.__init__
+        path = self._get_stub_layers().find_module_dir("builtins")
+        if path is None:
+            return {}
+        return parse_api_information(os.path.join(path, "builtins.py"))
+    
+    def _complete(self, source, row, column):
+        """Returns completions in the form of filter_completions or None
+        in case of an error"""
+        lines = source.split("\n")
+        text = lines[row - 1][:column] if 0 < row <= len(lines) else ""
+        context = parse_completion_context(text)
+        if self._board_pins is not None and context is not None and context[0] == "board":
+            prefix = context[1]
+            return [{"name" : name, "complete" : name[len(prefix):]}
+                    for name, _, _ in self._board_pins.complete(prefix)]
+        
+        try:
+            result = self._get_stub_layers().complete(text)
+        except (OSError, ValueError):
+            logging.exception("Problem with completion index")
+            result = None
+        
+        if result is not None:
+            entries, prefix = result
+            return [{"name" : name, "complete" : name[len(prefix):]}
+                    for name, _, _ in entries]
+        
+        # Needs inference
+        try:
+            script = jedi.Script(source, row, column,
+                                 sys_path=self._get_stub_layers().get_paths())
+            return self.filter_completions(script.completions())
+        except Exception:
+            logging.exception("Autocomplete error")
+            return None
+    
+    def _cmd_Run(self, cmd):
+        if hasattr(cmd, "source"):
+            self._warn_about_unknown_pins(cmd.source, "<editor>")
+        elif len(cmd.args) == 1:
+            path = os.path.join(get_workbench().get_cwd(), cmd.args[0])
+            if os.path.isfile(path):
+                with open(path, encoding="utf-8", errors="replace") as fp:
+                    self._warn_about_unknown_pins(fp.read(), cmd.args[0])
+        MicroPythonProxy._cmd_Run(self, cmd)
+    
+    def _cmd_editor_autocomplete(self, cmd):
+        completions = self._complete(cmd.source, cmd.row, cmd.column)
+        self._non_serial_msg_queue.put(InlineResponse(
+            command_name="editor_autocomplete", source=cmd.source, row=cmd.row,
+            column=cmd.column, completions=completions,
+            error="Autocomplete error" if completions is None else None))
+        if self._needs_device_stubs and self._serial is not None and self.idle:
+            self._start_introspection()
+    
+    def _cmd_shell_autocomplete(self, cmd):
+        if not cmd.source.strip().startswith(("import ", "from ")):
+            # names from the live session
+            MicroPythonProxy._cmd_shell_autocomplete(self, cmd)
+            return
+        
+        lines = cmd.source.split("\n")
+        completions = self._complete(cmd.source, len(lines), len(lines[-1]))
+        self._non_serial_msg_queue.put(InlineResponse(
+            command_name="shell_autocomplete", source=cmd.source, completions=completions,
+            error="Autocomplete error" if completions is None else None))
+        if self._needs_device_stubs and self.idle:
+            self._start_introspection()
+    
+    def _clean_environment_during_startup(self, timeout):
+        # In CP Ctrl+C already cleaned the environment
+        pass
+    
+    def _get_welcome_text_in_raw_mode(self, timeout):
+        welcome_text = MicroPythonProxy._get_welcome_text_in_raw_mode(self, timeout)
+        self._firmware_banner = parse_banner(welcome_text)
+        return welcome_text
+    
+    def get_firmware_banner(self):
+        """Returns version and board of the connected firmware as parsed from the REPL banner"""
+        return self._firmware_banner
+    
+    def enter_bootloader(self):
+        """Restarts the device in UF2 bootloader mode. Closes the connection."""
+        assert self.idle
+        try:
+            self._execute_async(ENTER_BOOTLOADER_SCRIPT)
+        except Exception as e:
+            # Device may vanish before confirming the command (serial errors,
+            # timeouts, garbage instead of OK), so it may restart anyway
+            logging.info("Problem when entering bootloader", exc_info=True)
+            self._send_error_to_shell("Device didn't confirm restarting in bootloader mode: %s" % e)
+        finally:
+            self.disconnect()
+    
+    def _finalize_repl(self):
+        try:
+            self._supports_raw_paste = probe_raw_paste(self._serial)
+        except (TimeoutError, RuntimeError):
+            logging.exception("Could not probe raw-paste mode")
+            self._supports_raw_paste = False
+            self._discarded_bytes += self._serial.read_all()
+    
+    def _execute_async(self, script):
+        if not self._supports_raw_paste:
+            MicroPythonProxy._execute_async(self, script)
+            return
+        
+        assert self._serial.buffers_are_empty()
+        window_size = enter_raw_paste(self._serial)
+        if window_size is None:
+            # Don't try again during this connection
+            self._supports_raw_paste = False
+            MicroPythonProxy._execute_async(self, script)
+            return
+        
+        raw_paste_write(self._serial, script.encode("utf-8"), window_size)
+        self.idle = False
+    
+    def _execute_and_get_response(self, script, timeout=2):
+        # Same as in MicroPythonProxy, but longer scripts may need more time
+        self._execute_async(script)
+        terminator = b"\x04>"
+        output = self._serial.read_until(terminator, timeout)[: -len(terminator)]
+        self.idle = True
+        return output.split(b"\x04")
+    
+    def _upload_via_serial(self, source, target):
+        assert self.idle
+        
+        with open(source, "rb") as local:
+            content = local.read()
+        
+        # Raw-paste mode can take larger blocks without overflowing device's buffers
+        block_size = 512 if self._supports_raw_paste else 64
+        
+        self._execute_and_expect_empty_response("__upf = open(%r, 'wb')" % target)
+        for i in range(0, len(content), block_size):
+            self._execute_and_expect_empty_response(
+                "__upf.write(%r)" % content[i : i + block_size])
+        
+        self._execute_and_expect_empty_response("__upf.close()")
+        self._execute_and_expect_empty_response("del __upf")
+    
+    def _get_boot_script_path(self):
+        return self._resolve_script_paths()[0]
+    
+    def _get_main_script_path(self):
+        return self._resolve_script_paths()[1]
+    
+    def _resolve_script_paths(self):
+        """Returns paths of boot and main script (existing or default ones)"""
+        if self._script_paths is None:
+            if self._file_index.is_filled():
+                boot_name = _find_first(BOOT_SCRIPT_CANDIDATES, self._file_index.exists)
+                main_name = _find_first(MAIN_SCRIPT_CANDIDATES, self._file_index.exists)
+            else:
+                # One short exchange instead of listing the files
+                out, err = self._execute_and_get_response(PROBE_SCRIPT_PATHS_SCRIPT)
+                assert len(err) == 0, "Error was " + repr(err)
+                boot_name, main_name = out.decode("utf-8").strip().split(",")
+            
+            self._script_paths = ("/" + (boot_name or BOOT_SCRIPT_CANDIDATES[-1]),
+                                  "/" + (main_name or MAIN_SCRIPT_CANDIDATES[-1]))
+        
+        return self._script_paths
+    
+    def _list_files(self):
+        return self._get_file_index().listdir("/")
+    
+    def _get_file_index(self):
+        if not self._file_index.is_filled():
+            self._file_index.fill(self._fetch_file_records())
+        return self._file_index
+    
+    def _fetch_file_records(self):
+        mount = self._get_fs_mount()
+        if mount is None:
+            out, err = self._execute_and_get_response(WALK_FILES_SCRIPT, WALK_FILES_TIMEOUT)
+            assert len(err) == 0, "Error was " + repr(err)
+            return parse_walk_output(out)
+        else:
+            return walk_mount(mount)
+    
+    def _upload(self, source, target):
+        # Thonny doesn't prepend the slash when uploading the current script
+        target = normalize_device_path(target)
+        mpy_cache = self._get_mpy_cache()
+        if mpy_cache is not None and should_compile(target):
+            source = mpy_cache.get_compiled(source, target, self._get_mpy_abi())
+            py_target, target = target, get_mpy_path(target)
+        else:
+            py_target = None
+        
+        mount = self._get_writable_fs_mount()
+        try:
+            if mount is None:
+                self._upload_via_serial(source, target)
+            else:
+                # Unlike _upload_via_mount, raises on failure
+                mount_target = MountSyncTarget(mount)
+                mount_target.upload_file(source, target)
+                mount_target.flush()
+        except Exception as e:
+            # file may be partially written
+            self._invalidate_file_info()
+            if mount is not None and isinstance(e, OSError):
+                # .py is kept, it may be the only working copy
+                self._report_upload_via_mount_error(source, e.filename, e)
+                return
+            raise
+
+        # no-op if upload failed and index got invalidated
+        self._file_index.record_write(target, os.path.getsize(source))
+        # new file may take precedence over current boot or main script
+        self._script_paths = None
+        
+        if py_target is not None and self._get_file_index().exists(py_target):
+            # source would be imported instead of the .mpy
+            self._remove_file(py_target)
+    
+    def _remove_file(self, path):
+        target = self._get_sync_target()
+        target.remove_file(path)
+        target.flush()
+        self._file_index.record_delete(path)
+        self._script_paths = None
+    
+    def _get_sync_target(self):
+        mount = self._get_writable_fs_mount()
+        if mount is None:
+            return SerialSyncTarget(self._execute_and_get_response, self._upload_via_serial)
+        else:
+            return MountSyncTarget(mount)
+    
+    def _get_mpy_cache(self):
+        """Returns None if libraries should be uploaded as source"""
+        if not get_workbench().get_option(self.backend_name + ".compile_to_mpy"):
+            return None
+        
+        return MpyCache(os.path.join(THONNY_USER_DIR, "circuitpython_mpy_cache"),
+                        self._create_mpy_compiler())
+    
+    def _create_mpy_compiler(self):
+        mpy_cross_path = get_workbench().get_option(self.backend_name + ".mpy_cross_path")
+        if not mpy_cross_path:
+            raise RuntimeError("Compiling to .mpy is enabled, but mpy-cross executable is not configured.\n"
+                               + 'Choose "Tools → Options → Interpreter" to change.')
+        return create_mpy_cross_compiler(mpy_cross_path)
+    
+    def _get_mpy_abi(self):
+        if self._mpy_abi is None:
+            self._mpy_abi = abi_from_info(*self._execute_and_parse_value(ABI_INFO_SCRIPT))
+        return self._mpy_abi
+    
+    def _invalidate_file_info(self):
+        self._file_index.invalidate()
+        self._script_paths = None
+        if self._fs_mount is None:
+            # maybe it's there now
+            self._fs_mount = False
+    
+    def _soft_reboot_and_run_main(self):
+        # boot.py or code.py may change the files
+        self._invalidate_file_info()
+        MicroPythonProxy._soft_reboot_and_run_main(self)
+    
+    def disconnect(self):
+        self._invalidate_file_info()
+        self._device_id = None
+        self._fs_mount = False
+        self._mpy_abi = None
+        self._firmware_banner = None
+        self._mount_info = None
+        self._needs_device_stubs = False
+        self._introspection_output = None
+        MicroPythonProxy.disconnect(self)
+    
+    def _get_device_id(self):
+        if self._device_id is None:
+            out, err = self._execute_and_get_response(DEVICE_ID_SCRIPT)
+            assert len(err) == 0, "Error was " + repr(err)
+            self._device_id = out.decode("utf-8").strip()
+        return self._device_id
+    
+    def _cmd_sync(self, cmd):
+        """Uploads new and changed files from local folder and deletes 
+        the files which were uploaded earlier but are gone locally"""
+        changed = False
+        try:
+            if len(cmd.args) != 1:
+                self._send_error_to_shell("Command requires one argument")
+                return
+            
+            source = cmd.args[0]
+            if not os.path.isabs(source):
+                source = os.path.join(get_workbench().get_cwd(), source)
+            
+            if not os.path.isdir(source):
+                raise IOError("No such directory: %s" % source)
+            
+            changed = self._sync(source)
+        except Exception:
+            self._send_error_to_shell(traceback.format_exc())
+        finally:
+            if changed:
+                # Single restart for all the changes. Its final prompt completes the command.
+                self._soft_reboot_and_run_main()
+            else:
+                self._non_serial_msg_queue.put(ToplevelResponse())
+    
+    def _sync(self, source):
+        """Returns True if any files on the device were changed"""
+        store = ManifestStore(os.path.join(THONNY_USER_DIR, "circuitpython_manifests"))
+        device_id = self._get_device_id()
+        source_files = local_files = list_local_files(source)
+        mpy_cache = self._get_mpy_cache()
+        if mpy_cache is not None:
+            local_files = mpy_cache.compile_files(local_files, self._get_mpy_abi())
+        local_manifest = build_manifest(local_files)
+        device_manifest = store.load(device_id)
+        plan = plan_sync(local_manifest, device_manifest, self._get_file_index())
+        for path in plan.uploads:
+            if path.endswith(".py"):
+                with open(local_files[path], encoding="utf-8", errors="replace") as fp:
+                    self._warn_about_unknown_pins(fp.read(), path)
+        if plan.uploads:
+            self._warn_about_ram_usage(source_files, mpy_cache is not None)
+        
+        if not plan.uploads and not plan.deletions:
+            self._send_text_to_shell("Device is up to date (%d file(s))" % len(plan.unchanged), 
+                                     "stdout")
+            return False
+        
+        original_manifest = dict(device_manifest)
+        target = self._get_sync_target()
+        # Otherwise code.py would get restarted after almost every file
+        was_enabled = disable_autoreload(self._execute_and_get_response)
+        try:
+            apply_sync_plan(plan, local_files, local_manifest, device_manifest, target,
+                            lambda action, path: self._send_text_to_shell(
+                                "%s %s" % (action, path), "stdout"))
+            target.flush()
+            self._send_text_to_shell("Uploaded %d, deleted %d, kept %d file(s)" 
+                                     % (len(plan.uploads), len(plan.deletions), 
+                                        len(plan.unchanged)), 
+                                     "stdout")
+        except OSError as e:
+            self._invalidate_file_info()
+            if isinstance(target, MountSyncTarget):
+                self._report_upload_via_mount_error(source, e.filename, e)
+            else:
+                self._send_error_to_shell(traceback.format_exc())
+        except Exception:
+            self._invalidate_file_info()
+            self._send_error_to_shell(traceback.format_exc())
+        finally:
+            store.save(device_id, device_manifest)
+            try:
+                restore_autoreload(self._execute_and_get_response, was_enabled)
+            except Exception:
+                # Shouldn't hide what happened during the sync
+                self._send_error_to_shell(traceback.format_exc())
+        
+        return device_manifest != original_manifest
+    
+    def _cmd_download(self, cmd):
+        # Source is interpreted relative to the root
+        try:
+            if len(cmd.args) == 1:
+                source = cmd.args[0]
+                target = os.path.basename(source)
+            elif len(cmd.args) == 2:
+                source, target = cmd.args
+            else:
+                self._send_error_to_shell("Command requires 1 or 2 arguments")
+                return
+            
+            if not os.path.isabs(target):
+                target = os.path.join(get_workbench().get_cwd(), target)
+            
+            content = self._read_file(source)
+            with open(target, "wb") as fp:
+                fp.write(content)
+            
+            self._send_text_to_shell("Downloaded %s to %s" % (source, target), "stdout")
+        except Exception:
+            self._send_error_to_shell(traceback.format_exc())
+        finally:
+            self._non_serial_msg_queue.put(ToplevelResponse())
+    
+    def _read_file(self, source):
+        mount = self._get_fs_mount()
+        if mount is None:
+            out, err = self._execute_and_get_response(READ_FILE_SCRIPT % source)
+            if err:
+                raise IOError(err.decode("utf-8", errors="replace"))
+            return parse_read_output(out)
+        else:
+            with open(os.path.join(mount, source.strip("/")), "rb") as fp:
+                return fp.read()
+    
+    def _get_fs_mount(self):
+        """Returns mount point of the connected device or None if it's not mounted"""
+        if self._fs_mount is False or (self._fs_mount is not None 
+                                       and not os.path.isdir(self._fs_mount)):
+            self._fs_mount = self._find_fs_mount()
+        return self._fs_mount
+    
+    def _find_fs_mount(self):
+        if self._serial is None:
+            return None
+        
+        serial_number = self._get_usb_serial_number()
+        mount = _mount_pairings.get(serial_number)
+        if mount is not None:
+            return mount
+        
+        label, boot_out = self._get_mount_info()
+        board = self._get_board()
+        mount = find_device_mount(self.port, label, boot_out,
+                                  mount_label=board.mount_label if board else DEFAULT_MOUNT_LABEL)
+        if mount is not None:
+            _mount_pairings.put(serial_number, mount, boot_out)
+        # None means not mounted or ambiguous, serial is always correct
+        return mount
+    
+    def _get_writable_fs_mount(self):
+        mount = self._get_fs_mount()
+        if mount is not None and is_writable_dir(mount):
+            return mount
+        else:
+            return None
+    
+    def _get_mount_info(self):
+        if self._mount_info is None:
+            out, err = self._execute_and_get_response(MOUNT_INFO_SCRIPT)
+            if err:
+                # Unknown label and boot_out.txt, files go via serial
+                logging.warning("Could not read mount info: %r", err)
+                return (None, None)
+            self._mount_info = parse_mount_info_output(out)
+        return self._mount_info
+    
+    def _get_port_info(self):
+        """Returns pyserial's info about the connected port or None"""
+        for info in get_port_watcher().get_ports():
+            if info.device == self.port:
+                return info
+        return None
+    
+    def _get_board(self):
+        """Returns the boards.Board of the connected port or None if it's not known"""
+        info = self._get_port_info()
+        if info is None:
+            return None
+        return get_board_database().lookup(info.vid, info.pid)
+    
+    def _get_usb_serial_number(self):
+        # CircuitPython uses the unique id of the MCU as USB serial number
+        info = self._get_port_info()
+        if info is not None and info.serial_number:
+            return info.serial_number.lower()
+        return self._get_device_id().lower()
+    
+    @property
+    def known_usb_vids_pids(self):
+        return get_board_database().get_usb_ids()
+    
+    def _detect_potential_ports(self):
+        # Port list is kept up to date by the watcher, no need to scan here
+        database = get_board_database()
+        result = []
+        for info in get_port_watcher().get_ports():
+            description = database.describe_port(info)
+            if description is not None:
+                result.append((info.device, description))
+        return result
+
+    def _report_upload_via_mount_error(self, source, target, error):
+        # don't know anymore what's on the device
+        self._invalidate_file_info()
+        self._send_error_to_shell(("Couldn't write to %s\n"
+                                   + "Original error: %s\n"
+                                   + "\n"
+                                   + "If the target directory does exist then device's filesystem may be corrupted.\n"
+                                   + "You can repair it with following code (NB! Deletes all files on the device!):\n"
+                                   + "\n"
+                                   + "import storage\n"
+                                   + "storage.erase_filesystem()\n")
+                                   % (target, error))
+    
+class CircuitPythonConfigPage(MicroPythonConfigPage):
+    def __init__(self, master):
+        MicroPythonConfigPage.__init__(self, master)
+        
+        self.add_checkbox(self.backend_name + ".compile_to_mpy", 
+                          "Upload libraries as precompiled .mpy files (code.py and boot.py stay as source)",
+                          row=2, pady=(15,0))
+        ttk.Label(self, text="mpy-cross executable (should match the firmware version):").grid(
+            row=3, column=0, sticky="nw", pady=(10,0))
+        self.add_entry(self.backend_name + ".mpy_cross_path", row=4, width=60)
+    
+    def _get_usb_driver_url(self):
+        return "https://learn.adafruit.com/welcome-to-circuitpython/installing-circuitpython"
+    
+class FlashingDialog(tk.Toplevel):
+    def __init__(self):
+        master = get_workbench()
+        tk.Toplevel.__init__(self, master)
+        
+        # Running FlashingJob and what it has reported (owned by Tk thread)
+        self._job = None
+        self._volume_events_by_job = {}
+        self._volume_progress = {}
+        self._job_error = None
+        self._device_infos = []
+        # (path, banner) of the last inspected image
+        self._target_banner_cache = (None, None)
+        self._shown_path = None
+        self._library = FirmwareLibrary(os.path.join(THONNY_USER_DIR, "circuitpython_firmware"))
+        # Library may preselect a file until user chooses one
+        self._path_chosen_by_user = False
+
+        self.columnconfigure(0, weight=1)
+        self.rowconfigure(0, weight=1)
+        
+        main_frame = ttk.Frame(self)
+        main_frame.grid(row=0, column=0, sticky=tk.NSEW, ipadx=15, ipady=15)
+        
+        self.title("Install CircuitPython firmware to your device")
+        #self.resizable(height=tk.FALSE, width=tk.FALSE)
+        self.protocol("WM_DELETE_WINDOW", self._cancel_or_close)
+        
+        ttk.Label(main_frame, text="Download .uf2 file:").grid(row=1, column=0, sticky="nw", pady=(15,0), padx=15)
+        url_label = create_url_label(main_frame, url="https://circuitpython.org/downloads")
+        url_label.grid(row=1, column=1, columnspan=2, sticky="nw", pady=(15,0), padx=15)
+        
+        ttk.Label(main_frame, text="Select the file:").grid(row=2, column=0, sticky="nw", pady=(10,0), padx=15)
+        self._path_var = tk.StringVar(value="")
+        self._path_entry = ttk.Entry(main_frame, textvariable=self._path_var, width=60)
+        self._path_entry.bind("<Key>", self._on_path_edited, True)
+        self._path_entry.grid(row=2, column=1, columnspan=1, sticky="nsew", pady=(10,0), padx=(15, 10))
+        file_button = ttk.Button(main_frame, text=" ... ", command=self._select_file)
+        file_button.grid(row=2, column=2, sticky="nsew", pady=(10,0), padx=(0,15))
+        
+        ttk.Label(main_frame, text="Prepare device:").grid(row=3, column=0, sticky="nw", pady=(10,0), padx=15)
+        self.device_label = ttk.Label(main_frame, text="<not found>")
+        self.device_label.grid(row=3, column=1, columnspan=2, sticky="nw", pady=(10,0), padx=15)
+        self._bootloader_button = ttk.Button(main_frame, text="Enter bootloader\nvia REPL",
+                                             command=self._enter_bootloader)
+        self._bootloader_button.grid(row=3, column=0, sticky="nw", pady=(40,0), padx=15)
+        # None or NewVolumeWait for the bootloader volume after the reset
+        self._awaited_bootloader = None
+        
+        main_frame.rowconfigure(3, weight=1)
+        main_frame.columnconfigure(1, weight=1)
+        
+        command_bar = ttk.Frame(main_frame)
+        command_bar.grid(row=4, column=0, columnspan=3, sticky="nsew")
+        command_bar.columnconfigure(0, weight=1)
+        
+        self._force_var = tk.BooleanVar(value=False)
+        force_checkbox = ttk.Checkbutton(command_bar, variable=self._force_var,
+                                         text="Reinstall even if device already has this firmware")
+        force_checkbox.grid(row=0, column=0, pady=(15,0), padx=15, sticky="nw")
+        
+        self._verify_var = tk.BooleanVar(
+            value=get_workbench().get_option("CircuitPython.verify_flashing"))
+        verify_checkbox = ttk.Checkbutton(command_bar, variable=self._verify_var,
+                                          text="Verify (if bootloader allows reading back the firmware)")
+        verify_checkbox.grid(row=1, column=0, pady=(5,15), padx=15, sticky="nw")
+        
+        self._install_button = ttk.Button(command_bar, text="Install", command=self._start_install, width=20)
+        self._install_button.grid(row=0, column=1, pady=15, padx=15, sticky="ne")
+        self._install_button.focus_set()
+        
+        close_button = ttk.Button(command_bar, text="Cancel", command=self._cancel_or_close)
+        close_button.grid(row=0, column=2, pady=15, padx=(0,15), sticky="ne")
+        
+        self.bind('<Escape>', self._cancel_or_close, True)
+        
+        # Watcher reports from background thread
+        self._volume_events = queue.Queue()
+        self._bootloader_volumes = set()
+        # Devices in normal mode, for telling whether they need installation at all
+        self._circuitpy_volumes = set()
+        self._volume_watchers = [self._create_volume_watcher(self._bootloader_volumes),
+                                 self._create_volume_watcher(self._circuitpy_volumes,
+                                                             BOOT_OUT_FILE_NAME)]
+        for watcher in self._volume_watchers:
+            watcher.start()
+        
+        self._update_device_info()
+        self._update_state()
+        
+    def _select_file(self):
+        result = askopenfilename (
+            filetypes = [('UF2 files', '.uf2')], 
+            initialdir = get_workbench().get_option("run.working_directory")
+        )
+        
+        if result:
+            self._path_var.set(os.path.normpath(result))
+            self._path_chosen_by_user = True
+    
+    def _create_volume_watcher(self, volumes, *args):
+        return VolumeWatcher(lambda vol: self._volume_events.put((volumes, vol, True)),
+                             lambda vol: self._volume_events.put((volumes, vol, False)),
+                             *args)
+    
+    def _on_path_edited(self, event=None):
+        self._path_chosen_by_user = True
+    
+    def _preselect_from_library(self):
+        entries = []
+        for info in self._device_infos:
+            entry = self._library.find_newest(info["bootloader_info"])
+            if entry is None:
+                return
+            entries.append(entry)
+        
+        # one file must suit all connected devices
+        if entries and all(entry["hash"] == entries[0]["hash"] for entry in entries):
+            self._path_var.set(self._library.get_path(entries[0]["hash"]))
+    
+
+    def _update_state(self):
+        volumes_changed = self._process_volume_events()
+        if ((volumes_changed or self._get_file_path() != self._shown_path)
+            and self._job is None):
+            # Volumes disappear during installation, keep showing the progress
+            self._update_device_info()
+        
+        if self._awaited_bootloader is not None:
+            self._check_awaited_bootloader()
+        
+        if self._get_connected_proxy() is not None and self._job is None:
+            self._bootloader_button.state(["!disabled"])
+        else:
+            self._bootloader_button.state(["disabled"])
+        
+        if self._job is not None:
+            finished = self._process_job_events()
+            if finished:
+                self._install_button.configure(text="Installing (100%)")
+                self.update_idletasks()
+                self._report_results()
+                self._job = None
+                self._close()
+                return
+            
+            state_text = "Cancelling" if self._job.is_cancelled() else "Installing"
+            self._install_button.configure(text="%s (%s)" 
+                                           % (state_text, format_progress(sum_progress(
+                                                  self._volume_progress.values()))))
+            if len(self._volume_progress) > 1:
+                self.device_label.configure(text="\n".join(
+                    "%s at %s: %s" % (info["model"], info["volume"], 
+                                      self._format_device_state(info["volume"])) 
+                    for info in self._device_infos))
+        else:
+            self._install_button.configure(text="Install")
+            
+        if os.path.isfile(self._get_file_path()) and self._job is None and self._device_infos:
+            self._install_button.state(["!disabled"])
+        else:
+            self._install_button.state(["disabled"])
+        
+        self.after(200, self._update_state)
+    
+    def _get_connected_proxy(self):
+        """Returns the proxy if it can restart the device now"""
+        proxy = get_runner().get_backend_proxy()
+        if (isinstance(proxy, CircuitPythonProxy) and proxy.is_connected()
+            and get_runner().is_waiting_toplevel_command()):
+            return proxy
+        return None
+    
+    def _enter_bootloader(self):
+        proxy = self._get_connected_proxy()
+        if proxy is None:
+            return
+        
+        reason = explain_identical(proxy.get_firmware_banner(), self._get_target_banner())
+        if reason and not self._force_var.get():
+            showinfo("Nothing to do", "Connected device %s." % reason, parent=self)
+            return
+        
+        self._awaited_bootloader = NewVolumeWait(lambda: self._bootloader_volumes,
+                                                 _BOOTLOADER_TIMEOUT)
+        proxy.enter_bootloader()
+        self._update_device_info()
+    
+    def _check_awaited_bootloader(self):
+        known_volumes = self._awaited_bootloader.known_volumes
+        try:
+            new_volumes = self._awaited_bootloader.check()
+        except TimeoutError:
+            self._awaited_bootloader = None
+            self._update_device_info()
+            showerror("Bootloader not found",
+                      "Device didn't appear in bootloader mode in %d seconds.\n\n"
+                      "Its firmware may not support restarting into the bootloader,\n"
+                      "try double-pressing the reset button instead." % _BOOTLOADER_TIMEOUT,
+                      parent=self)
+            return
+        
+        if new_volumes:
+            self._awaited_bootloader = None
+            self._update_device_info()
+            # Devices which were waiting already would get flashed as well
+            if (not known_volumes and len(self._device_infos) == 1 
+                and os.path.isfile(self._get_file_path()) and self._job is None):
+                self._start_install()
+    
+    def _import_to_library(self, source_path, bootloader_infos):
+        # runs in a worker thread, the dialog doesn't need the result
+        try:
+            self._library.import_file(source_path, bootloader_infos)
+        except (OSError, Uf2Error):
+            logging.exception("Could not add %s to the firmware library", source_path)
+    
+    def _process_job_events(self):
+        """Returns True if the job has finished"""
+        for event in self._job.get_events():
+            if event.volume is None:
+                if event.phase == PHASE_FINISHED:
+                    return True
+                elif event.phase == PHASE_FAILED:
+                    self._job_error = event.message
+                continue
+            
+            self._volume_events_by_job[event.volume] = event
+            if event.progress is not None:
+                self._volume_progress[event.volume] = event.progress
+            elif event.phase in (PHASE_SKIPPED, PHASE_FAILED, PHASE_CANCELLED):
+                # Doesn't contribute to the total anymore
+                self._volume_progress[event.volume] = CopyProgress(0, 0, None, None)
+        
+        return False
+    
+    def _format_device_state(self, volume):
+        event = self._volume_events_by_job.get(volume)
+        if event is None:
+            return "waiting"
+        elif event.phase == PHASE_COPYING:
+            return format_progress(event.progress)
+        elif event.message:
+            return "%s (%s)" % (event.phase, event.message)
+        else:
+            return event.phase
+    
+    def _report_results(self):
+        by_phase = {}
+        for vol, event in sorted(self._volume_events_by_job.items()):
+            by_phase.setdefault(event.phase, []).append(
+                "%s: %s" % (vol, event.message) if event.message else vol)
+        
+        def format_section(title, phase):
+            if phase in by_phase:
+                return "\n\n%s:\n%s" % (title, "\n".join(by_phase[phase]))
+            return ""
+        
+        details = (format_section("Failed", PHASE_FAILED)
+                   + format_section("Cancelled", PHASE_CANCELLED)
+                   + format_section("Skipped", PHASE_SKIPPED))
+        installed_count = len(by_phase.get(PHASE_DONE, []))
+        
+        if self._job_error:
+            showerror("Problems", "Installation failed: %s" % self._job_error + details)
+        elif PHASE_FAILED in by_phase:
+            showerror("Problems", "Installed to %d of %d devices." 
+                      % (installed_count, len(self._volume_events_by_job)) + details)
+        elif PHASE_CANCELLED in by_phase:
+            showinfo("Cancelled", "Installed to %d of %d devices." 
+                     % (installed_count, len(self._volume_events_by_job)) + details)
+        elif installed_count == 0:
+            showinfo("Nothing to do", "All devices already have this firmware." + details)
+        elif installed_count == 1:
+            showinfo("Done", "Firmware installation is complete.\nDevice will be back in normal mode."
+                     + details)
+        else:
+            showinfo("Done", "Firmware was installed to %d devices.\nDevices will be back in normal mode."
+                     % installed_count + details)
+    
+    def _process_volume_events(self):
+        """Returns True if any set of watched volumes changed"""
+        changed = False
+        while True:
+            try:
+                volumes, vol, appeared = self._volume_events.get_nowait()
+            except queue.Empty:
+                return changed
+            
+            if appeared:
+                volumes.add(vol)
+            else:
+                volumes.discard(vol)
+            changed = True
+    
+    def _get_file_path(self):
+        return self._path_var.get()
+    
+    def _get_target_banner(self):
+        path = self._get_file_path()
+        if self._target_banner_cache[0] != path:
+            try:
+                banner = read_firmware_banner(path) if os.path.isfile(path) else None
+            except OSError:
+                banner = None
+            self._target_banner_cache = (path, banner)
+        return self._target_banner_cache[1]
+    
+    def _describe_circuitpy_volumes(self):
+        lines = []
+        for vol in sorted(self._circuitpy_volumes):
+            try:
+                banner = read_boot_out(vol)
+            except OSError:
+                banner = None
+            if banner is None:
+                continue
+            line = "%s at %s runs %s" % (banner["board_name"], vol, format_banner(banner))
+            if explain_identical(banner, self._get_target_banner()):
+                line += "\n  (same as selected file, no need to install)"
+            lines.append(line)
+        return "\n".join(lines)
+    
+    def _update_device_info(self):
+        self._device_infos = []
+        for vol in sorted(self._bootloader_volumes):
+            bootloader_info = read_bootloader_info(vol)
+            self._device_infos.append({"volume" : vol, 
+                                       "model" : bootloader_info.get("Model", "Unknown device"), 
+                                       "bootloader_info" : bootloader_info})
+        
+        if self._awaited_bootloader is not None and not self._device_infos:
+            device_text = "Waiting for the device to restart in bootloader mode ..."
+        elif len(self._device_infos) == 0:
+            device_text = (
+                  "Device not connected or not in bootloader mode.\n"
+                + "\n"
+                + "After connecting the device to a USB port, double-press its reset button\n"
+                + "and wait for couple of seconds until OS mounts it in bootloader mode.\n"
+                + "\n"
+                + "If nothing happens, then try again with longer or shorter pauses between the\n"
+                + "presses (or just a single press) or wait longer until this message disappears.\n"
+                + "\n"
+                + "Device connected to Thonny's CircuitPython back-end can also be restarted\n"
+                + "in bootloader mode with the button on the left.\n"
+            )
+        elif len(self._device_infos) > 1:
+            device_text = (
+                  "Found %d devices:\n  " % len(self._device_infos)
+                  + "\n  ".join("%s at %s" % (info["model"], info["volume"]) 
+                                for info in self._device_infos)
+                  + "\n\n"
+                  + "Firmware will be installed to all of them."
+            )
+        else:
+            info = self._device_infos[0]
+            device_text = "%s at %s is ready" % (info["model"], info["volume"])
+        
+        if not self._path_chosen_by_user:
+            self._preselect_from_library()
+        
+        circuitpy_text = self._describe_circuitpy_volumes()
+        if circuitpy_text:
+            device_text += "\n\nIn normal mode:\n" + circuitpy_text
+        
+        self.device_label.configure(text=device_text)
+        self._shown_path = self._get_file_path()
+    
+    
+    def _start_install(self):
+        assert os.path.isfile(self._get_file_path())
+        assert self._device_infos
+        
+        source_path = self._get_file_path()
+        
+        # Reject wrong files before touching the devices
+        try:
+            uf2_info = parse_uf2(source_path)
+        except Uf2Error as e:
+            showerror("Can't install", "%s\n\n%s" % (source_path, e), parent=self)
+            return
+        
+        # next time the dialog can offer it without browsing. Hashing and copying
+        # the image takes a while, so it happens beside the flashing
+        threading.Thread(target=self._import_to_library,
+                         args=(source_path, [info["bootloader_info"] for info in self._device_infos]),
+                         daemon=True).start()
+        
+        self._volume_events_by_job = {}
+        self._job_error = None
+        volumes = []
+        for info in self._device_infos:
+            try:
+                check_compatibility(uf2_info, info["bootloader_info"])
+                volumes.append(info["volume"])
+            except Uf2Error as e:
+                self._volume_events_by_job[info["volume"]] = FlashingEvent(
+                    info["volume"], PHASE_FAILED, None, str(e))
+        
+        if not volumes:
+            showerror("Can't install", "%s\n\n%s" 
+                      % (source_path, "\n".join(event.message 
+                                                for event in self._volume_events_by_job.values())), 
+                      parent=self)
+            return
+        
+        size = os.path.getsize(source_path)
+        self._volume_progress = {vol : CopyProgress(0, size, None, None) for vol in volumes}
+        
+        force = self._force_var.get()
+        verify = self._verify_var.get()
+        get_workbench().set_option("CircuitPython.verify_flashing", verify)
+        target_banner = self._get_target_banner()
+        
+        def explain_skip(volume):
+            try:
+                return explain_identical(read_installed_banner(volume), target_banner)
+            except OSError:
+                logging.exception("Could not read current firmware from %s", volume)
+                return None
+        
+        # Intermediate syncs keep the progress meaningful
+        self._job = FlashingJob(source_path, volumes,
+                                max_workers=get_workbench().get_option("CircuitPython.flashing_max_workers"),
+                                max_bytes_per_second=get_workbench().get_option(
+                                    "CircuitPython.flashing_max_kb_per_second") * 1024,
+                                sync_interval=1.0,
+                                verify=verify,
+                                explain_skip=None if force else explain_skip)
+        self._job.start()
+    
+    def _cancel_or_close(self, event=None):
+        if self._job is not None:
+            # Dialog closes when the job reports finishing
+            self._job.cancel()
+        else:
+            self._close()
+    
+    def _close(self, event=None):
+        for watcher in self._volume_watchers:
+            watcher.stop()
+        self.destroy()
+    
+
+def load_plugin():
+    get_workbench().set_default("CircuitPython.compile_to_mpy", False)
+    get_workbench().set_default("CircuitPython.mpy_cross_path", "")
+    # Parallel flashing shouldn't saturate the USB hub
+    get_workbench().set_default("CircuitPython.flashing_max_workers", 4)
+    get_workbench().set_default("CircuitPython.flashing_max_kb_per_second", 4096)
+    get_workbench().set_default("CircuitPython.verify_flashing", False)
+    get_workbench().set_default("CircuitPython.generate_api_stubs", True)
+    add_micropython_backend("CircuitPython", CircuitPythonProxy, 
+                            "CircuitPython (generic)", CircuitPythonConfigPage)
+    # Watching from the start makes the port known by the time it's needed
+    get_port_watcher()
+    
+    get_workbench().add_command("installcp", "device", "Install CircuitPython firmware ...",
+                                lambda: show_dialog(FlashingDialog()),
+                                group=40)
+    
+    def sync_enabled():
+        proxy = get_runner().get_backend_proxy()
+        return (isinstance(proxy, CircuitPythonProxy)
+                and get_runner().is_waiting_toplevel_command())
+    
+    get_workbench().add_command("synccp", "device", "Sync current directory to device",
+                                lambda: get_shell().submit_magic_command(
+                                    ["%sync", get_workbench().get_cwd()]),
+                                tester=sync_enabled,
+                                group=20)
+
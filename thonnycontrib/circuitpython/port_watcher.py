@@ -0,0 +1,149 @@
+"""Background detection of appearing and disappearing serial ports"""
+import errno
+import logging
+import os
+import platform
+import select
+import socket
+import threading
+
+# from linux/netlink.h
+_NETLINK_KOBJECT_UEVENT = 15
+_KERNEL_EVENTS_GROUP = 1
+
+
+def list_serial_ports():
+    # pyserial comes with Thonny
+    from serial.tools.list_ports import comports
+    return list(comports())
+
+
+def _get_port_key(info):
+    return (info.device, info.vid, info.pid, info.serial_number)
+
+
+def _is_tty_event(message):
+    # eg. b"add@/devices/...\0ACTION=add\0DEVPATH=...\0SUBSYSTEM=tty\0DEVNAME=ttyACM0\0..."
+    return b"\0SUBSYSTEM=tty\0" in message
+
+
+class PortWatcher:
+    """Keeps the list of serial ports and reports changes via callbacks.
+
+    On Linux the ports are listed again only when the kernel announces a
+    tty device being added or removed, elsewhere the list is polled.
+    get_ports doesn't touch the system, so it can be called whenever a
+    port needs to be chosen.
+
+    NB! Callbacks are called in the background thread.
+    """
+    def __init__(self, on_appeared=None, on_disappeared=None, poll_interval=1.0,
+                 list_ports=list_serial_ports):
+        self._on_appeared = on_appeared
+        self._on_disappeared = on_disappeared
+        self._poll_interval = poll_interval
+        self._list_ports = list_ports
+
+        self._ports = {}
+        self._lock = threading.Lock()
+        self._scanned = threading.Event()
+        self._stopped = threading.Event()
+        self._wakeup_read_fd = None
+        self._wakeup_write_fd = None
+        self._thread = None
+
+    def start(self):
+        assert self._thread is None
+        if (platform.system() == "Linux" and hasattr(socket, "AF_NETLINK")
+                and hasattr(select, "poll")):
+            self._wakeup_read_fd, self._wakeup_write_fd = os.pipe()
+            target = self._watch_uevents
+        else:
+            target = self._poll
+        self._thread = threading.Thread(target=target, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._stopped.is_set():
+            return
+        self._stopped.set()
+        if self._wakeup_write_fd is not None:
+            try:
+                os.write(self._wakeup_write_fd, b"x")
+            except OSError:
+                # watcher thread has already quit
+                pass
+            os.close(self._wakeup_write_fd)
+
+    def get_ports(self, timeout=5):
+        """Returns port infos (pyserial ListPortInfo-s) as of the latest change.
+
+        Right after start waits (at most timeout seconds) for the first scan.
+        """
+        self._scanned.wait(timeout)
+        with self._lock:
+            return list(self._ports.values())
+
+    def rescan(self):
+        current = {_get_port_key(info) : info for info in self._list_ports()}
+        with self._lock:
+            removed = [self._ports[key] for key in set(self._ports) - set(current)]
+            added = [current[key] for key in set(current) - set(self._ports)]
+            self._ports = current
+        self._scanned.set()
+
+        for info in removed:
+            if self._on_disappeared is not None:
+                self._on_disappeared(info)
+        for info in sorted(added, key=lambda info: info.device):
+            if self._on_appeared is not None:
+                self._on_appeared(info)
+
+    def _poll(self):
+        while not self._stopped.is_set():
+            self._safe_rescan()
+            self._stopped.wait(self._poll_interval)
+
+    def _watch_uevents(self):
+        try:
+            with socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM,
+                               _NETLINK_KOBJECT_UEVENT) as sock:
+                sock.bind((0, _KERNEL_EVENTS_GROUP))
+                poller = select.poll()
+                poller.register(sock.fileno(), select.POLLIN)
+                poller.register(self._wakeup_read_fd, select.POLLIN)
+                self._safe_rescan()
+
+                while not self._stopped.is_set():
+                    events = poller.poll()
+                    if not any(fd == sock.fileno() for fd, _ in events):
+                        continue
+                    # Plugging in a device produces a burst of events, one scan is enough
+                    relevant = False
+                    while True:
+                        try:
+                            message = sock.recv(8192, socket.MSG_DONTWAIT)
+                        except BlockingIOError:
+                            break
+                        except OSError as e:
+                            if e.errno != errno.ENOBUFS:
+                                raise
+                            # some events were dropped, can't know whether they mattered
+                            relevant = True
+                            continue
+                        relevant = relevant or _is_tty_event(message)
+                    if relevant:
+                        self._safe_rescan()
+        except OSError:
+            logging.exception("Can't listen to kernel's device events, falling back to polling")
+            self._poll()
+        finally:
+            os.close(self._wakeup_read_fd)
+
+    def _safe_rescan(self):
+        try:
+            self.rescan()
+        except Exception:
+            logging.exception("Problem when listing serial ports")
+            # don't keep get_ports waiting
+            self._scanned.set()
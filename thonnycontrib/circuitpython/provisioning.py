@@ -0,0 +1,282 @@
+"""Provisioning devices from their REPL to a tested project.
+
+Each device goes through the stages
+
+    bootloader -> flash -> remount -> sync -> smoke_test
+
+in its own thread, so a rack of devices is done in about the time of one:
+while one device is being flashed, another can already be syncing. The
+only serialized step is recognizing the bootloader volume of a device on
+systems where volumes can't be related to USB ports.
+
+Everything touching the system goes through an environment object
+(SystemEnvironment by default), so the pipeline can be run against
+simulated volumes and REPLs.
+"""
+import logging
+import os.path
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from thonnycontrib.circuitpython.firmware_info import read_firmware_banner, parse_banner,\
+    explain_identical
+from thonnycontrib.circuitpython.flashing import copy_firmware, Throttle
+from thonnycontrib.circuitpython.sync import ManifestStore, sync_device
+from thonnycontrib.circuitpython.volume_watcher import UF2_INFO_FILE_NAME
+
+STAGES = ["bootloader", "flash", "remount", "sync", "smoke_test"]
+
+STATUS_DONE = "done"
+STATUS_SKIPPED = "skipped"
+STATUS_FAILED = "failed"
+
+
+class StageSkipped(Exception):
+    """Raised within a stage for marking it skipped"""
+
+
+class SystemEnvironment:
+    """Access to real serial ports and volumes"""
+    def open_device(self, port):
+        from thonnycontrib.circuitpython.device import Device, SerialLink
+        device = Device(SerialLink.open(port))
+        device.connect()
+        return device
+
+    def list_bootloader_volumes(self):
+        from thonnycontrib.circuitpython.volumes import list_removable_volume_candidates
+        return [vol for vol in list_removable_volume_candidates()
+                if os.path.isfile(os.path.join(vol, UF2_INFO_FILE_NAME))]
+
+    def get_usb_location(self, port):
+        from thonnycontrib.circuitpython.volumes import get_usb_location
+        return get_usb_location(port)
+
+    def is_volume_at_usb_location(self, volume, location):
+        from thonnycontrib.circuitpython.volumes import is_mount_at_usb_location
+        return is_mount_at_usb_location(volume, location)
+
+    def find_port(self, device_id):
+        """Returns the port whose USB serial number is given device id or None"""
+        # CircuitPython uses the unique id of the MCU as serial number
+        from serial.tools.list_ports import comports
+        for info in comports():
+            if info.serial_number and info.serial_number.lower() == device_id.lower():
+                return info.device
+        return None
+
+    def find_mount(self, port, label, boot_out):
+        from thonnycontrib.circuitpython.volumes import find_device_mount, is_writable_dir
+        mount = find_device_mount(port, label, boot_out)
+        return mount if mount is not None and is_writable_dir(mount) else None
+
+
+class DeviceTimeline:
+    def __init__(self, port, start_time):
+        self.port = port
+        self.device_id = None
+        self.stages = []
+        self._start_time = start_time
+
+    @contextmanager
+    def stage(self, name):
+        record = {"stage" : name, "start" : self._elapsed(), "end" : None,
+                  "status" : None, "message" : None}
+        self.stages.append(record)
+        try:
+            yield record
+            record["status"] = STATUS_DONE
+        except StageSkipped as e:
+            record["status"] = STATUS_SKIPPED
+            record["message"] = str(e)
+        except Exception as e:
+            record["status"] = STATUS_FAILED
+            record["message"] = "%s: %s" % (type(e).__name__, e)
+            raise
+        finally:
+            record["end"] = self._elapsed()
+
+    def is_ok(self):
+        return (len(self.stages) == len(STAGES)
+                and all(record["status"] != STATUS_FAILED for record in self.stages))
+
+    def to_dict(self):
+        return {
+            "port" : self.port,
+            "device_id" : self.device_id,
+            "ok" : self.is_ok(),
+            "stages" : [dict(record, duration=round(record["end"] - record["start"], 3))
+                        for record in self.stages],
+        }
+
+    def _elapsed(self):
+        return round(time.time() - self._start_time, 3)
+
+
+class Provisioner:
+    """Brings devices connected to given serial ports to firmware + project state.
+
+    local_files is a dict from device path to local path (see sync.list_local_files),
+    smoke_test a script which must complete without errors.
+    """
+    def __init__(self, firmware, local_files, manifest_dir, smoke_test=None, force=False,
+                 max_bytes_per_second=None, bootloader_timeout=20, remount_timeout=30,
+                 smoke_test_timeout=30, poll_interval=0.2, environment=None):
+        self._firmware = firmware
+        self._target_banner = read_firmware_banner(firmware)
+        self._local_files = local_files
+        self._store = ManifestStore(manifest_dir)
+        self._smoke_test = smoke_test
+        self._force = force
+        self._throttle = Throttle(max_bytes_per_second) if max_bytes_per_second else None
+        self._bootloader_timeout = bootloader_timeout
+        self._remount_timeout = remount_timeout
+        self._smoke_test_timeout = smoke_test_timeout
+        self._poll_interval = poll_interval
+        self._env = environment or SystemEnvironment()
+
+        # Serializes bootloader entry when volumes can't be told apart by USB location
+        self._unlocated_bootloader_lock = threading.Lock()
+        self._claims_lock = threading.Lock()
+        self._claimed_volumes = set()
+
+    def run(self, ports, on_stage=None):
+        """Provisions the devices in parallel, returns list of DeviceTimeline-s.
+
+        on_stage gets called with port and stage record when a stage ends
+        (NB! in worker threads).
+        """
+        start_time = time.time()
+        timelines = [DeviceTimeline(port, start_time) for port in ports]
+        with ThreadPoolExecutor(max_workers=max(len(ports), 1)) as executor:
+            for timeline in timelines:
+                executor.submit(self._provision, timeline, on_stage)
+        return timelines
+
+    def _provision(self, timeline, on_stage):
+        port = timeline.port
+        device = None
+        try:
+            with self._stage(timeline, "bootloader", on_stage):
+                device = self._env.open_device(port)
+                timeline.device_id = device.get_device_id()
+                reason = explain_identical(parse_banner(device.banner or ""), self._target_banner)
+                if reason and not self._force:
+                    raise StageSkipped(reason)
+                # session ends with the restart
+                bootloader_device, device = device, None
+                volume = self._enter_bootloader(bootloader_device, port)
+
+            with self._stage(timeline, "flash", on_stage):
+                if device is not None:
+                    raise StageSkipped("firmware is up to date")
+                try:
+                    copy_firmware(self._firmware,
+                                  os.path.join(volume, os.path.basename(self._firmware)),
+                                  throttle=self._throttle)
+                finally:
+                    with self._claims_lock:
+                        self._claimed_volumes.discard(volume)
+
+            with self._stage(timeline, "remount", on_stage):
+                if device is not None:
+                    mount = self._env.find_mount(port, *device.get_mount_info())
+                    raise StageSkipped("device wasn't restarted")
+                device, port = self._reconnect(timeline.device_id, port)
+                mount = self._wait_for_mount(device, port)
+
+            with self._stage(timeline, "sync", on_stage) as record:
+                plan = sync_device(device, self._local_files, self._store, mount)
+                record["message"] = "uploaded %d, deleted %d, kept %d file(s)" % (
+                    len(plan.uploads), len(plan.deletions), len(plan.unchanged))
+
+            with self._stage(timeline, "smoke_test", on_stage):
+                if self._smoke_test is None:
+                    raise StageSkipped("no test given")
+                out, err = device.execute(self._smoke_test, timeout=self._smoke_test_timeout)
+                if err:
+                    raise RuntimeError(err.decode("utf-8", "replace").strip())
+
+            # Start the project
+            finishing_device, device = device, None
+            finishing_device.soft_reboot()
+        except Exception:
+            logging.info("Provisioning %s stopped", port, exc_info=True)
+        finally:
+            if device is not None:
+                try:
+                    device.close()
+                except Exception:
+                    logging.exception("Could not close %s", port)
+
+    def _stage(self, timeline, name, on_stage):
+        @contextmanager
+        def reporting_stage():
+            try:
+                with timeline.stage(name) as record:
+                    yield record
+            finally:
+                if on_stage is not None:
+                    on_stage(timeline.port, timeline.stages[-1])
+        return reporting_stage()
+
+    def _enter_bootloader(self, device, port):
+        """Restarts the device and returns its bootloader volume"""
+        location = self._env.get_usb_location(port)
+        if location is None:
+            # New volume which appears while holding the lock is ours
+            with self._unlocated_bootloader_lock:
+                known = set(self._env.list_bootloader_volumes())
+                device.enter_bootloader()
+                return self._claim_bootloader_volume(lambda vol: vol not in known)
+        else:
+            device.enter_bootloader()
+            return self._claim_bootloader_volume(
+                lambda vol: self._env.is_volume_at_usb_location(vol, location))
+
+    def _claim_bootloader_volume(self, is_candidate):
+        deadline = time.time() + self._bootloader_timeout
+        while True:
+            for vol in sorted(self._env.list_bootloader_volumes()):
+                with self._claims_lock:
+                    if vol not in self._claimed_volumes and is_candidate(vol):
+                        self._claimed_volumes.add(vol)
+                        return vol
+            if time.time() > deadline:
+                raise TimeoutError("Bootloader volume didn't appear in %d seconds"
+                                   % self._bootloader_timeout)
+            time.sleep(self._poll_interval)
+
+    def _reconnect(self, device_id, old_port):
+        """Waits until the device is back with new firmware, returns (device, port)"""
+        deadline = time.time() + self._remount_timeout
+        while True:
+            port = self._env.find_port(device_id) or old_port
+            try:
+                device = self._env.open_device(port)
+                if device.get_device_id() == device_id:
+                    return device, port
+                device.close()
+            except Exception:
+                # not enumerated or not ready yet
+                if time.time() > deadline:
+                    raise
+            if time.time() > deadline:
+                raise TimeoutError("Device didn't come back in %d seconds" % self._remount_timeout)
+            time.sleep(self._poll_interval)
+
+    def _wait_for_mount(self, device, port):
+        """Returns CIRCUITPY volume of the device or None for syncing via serial"""
+        label, boot_out = device.get_mount_info()
+        if label is None and self._env.get_usb_location(port) is None:
+            # Can't tell whether device's volume is missing or just not recognized
+            return None
+
+        deadline = time.time() + self._remount_timeout
+        while True:
+            mount = self._env.find_mount(port, label, boot_out)
+            if mount is not None or time.time() > deadline:
+                return mount
+            time.sleep(self._poll_interval)
@@ -0,0 +1,271 @@
+"""Rough static estimate of the heap a project needs on the device.
+
+Starting from the main script, imports are followed through the files which
+are going to be on the device (resolved like the device does: the root,
+then /lib). Modules of the firmware (known from the stubs) cost nothing here.
+
+Each module contributes
+  * resident memory: bytecode, names, strings and function objects, which stay
+    allocated while the program runs,
+  * transient memory: the parse tree built when compiling source on the device,
+    which is freed after the module is compiled. Modules uploaded as .mpy
+    don't need it.
+
+The peak is the sum of the resident parts plus the largest transient part.
+The coefficients are approximations for 32-bit ports and err on the safe side;
+the estimate is meant for warning before an upload, not for exact accounting.
+
+Analyses of files are cached by content hash, so checking a project after
+a change looks only at the changed files.
+"""
+import ast
+import json
+import logging
+import os.path
+import posixpath
+import re
+from collections import namedtuple
+
+from thonnycontrib.circuitpython.device import MAIN_SCRIPT_CANDIDATES
+from thonnycontrib.circuitpython.sync import hash_file
+
+CACHE_FILE_NAME = "ram_estimates.json"
+
+# Searched in this order, like sys.path on the device
+_SEARCH_DIRS = ["/", "/lib"]
+
+_MODULE_BYTES = 200
+_FUNCTION_BYTES = 48
+_BYTECODE_BYTES_PER_NODE = 3
+_PARSE_BYTES_PER_NODE = 24
+_QSTR_OVERHEAD = 5
+# Bytecode in RAM is a bit larger than in the .mpy file
+_MPY_RESIDENT_FACTOR = 1.2
+
+# Usable heap after boot, for boards which can't be asked
+_HEAP_BUDGETS = [
+    (r"^samd21", 20 * 1024),
+    (r"^samd51", 160 * 1024),
+    (r"^nrf52", 150 * 1024),
+    (r"^rp2040", 180 * 1024),
+    (r"^esp32", 100 * 1024),
+]
+
+# Free heap after collecting garbage is about what code.py gets. Measured at
+# the REPL, it is less by whatever the session holds (variables, imported
+# modules), so the warning can come a bit too early but not too late.
+MEM_FREE_SCRIPT = "import gc as __gc_\n__gc_.collect()\nprint(__gc_.mem_free())\ndel __gc_"
+
+# Python 3.8+ parses all literals to Constant
+_CONSTANT_TYPES = tuple(getattr(ast, name) for name in ["Constant", "Str", "Bytes"]
+                        if hasattr(ast, name))
+
+# transient is the parse peak when the module is compiled on the device
+# (None if not known, ie. the source is not available)
+ModuleEstimate = namedtuple("ModuleEstimate", [
+    "name", "path", "resident", "transient", "as_mpy"])
+
+ProjectEstimate = namedtuple("ProjectEstimate", [
+    "main_path", "modules", "missing", "resident", "peak"])
+
+
+def get_heap_budget(mcu):
+    """Returns usable heap in bytes for the MCU named in the banner or None"""
+    for pattern, budget in _HEAP_BUDGETS:
+        if re.search(pattern, mcu or "", re.IGNORECASE):
+            return budget
+    return None
+
+
+def parse_mem_free_output(out):
+    return int(out.decode("utf-8").strip())
+
+
+def analyze_source(source):
+    """Returns dict with the memory figures and imports of a module"""
+    tree = ast.parse(source)
+    node_count = 0
+    function_count = 0
+    string_bytes = 0
+    names = set()
+    imports = []
+    for node in ast.walk(tree):
+        node_count += 1
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.Lambda, ast.ClassDef)):
+            function_count += 1
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            names.add(node.name)
+        elif isinstance(node, ast.Name):
+            names.add(node.id)
+        elif isinstance(node, ast.Attribute):
+            names.add(node.attr)
+        elif isinstance(node, ast.arg):
+            names.add(node.arg)
+        elif isinstance(node, _CONSTANT_TYPES):
+            value = getattr(node, "value", getattr(node, "s", None))
+            if isinstance(value, str):
+                string_bytes += len(value.encode("utf-8"))
+            elif isinstance(value, bytes):
+                string_bytes += len(value)
+        elif isinstance(node, ast.Import):
+            imports.extend([0, alias.name, []] for alias in node.names)
+        elif isinstance(node, ast.ImportFrom):
+            imports.append([node.level, node.module or "",
+                            [alias.name for alias in node.names if alias.name != "*"]])
+
+    return {
+        "resident" : (_MODULE_BYTES
+                      + node_count * _BYTECODE_BYTES_PER_NODE
+                      + string_bytes
+                      + sum(len(name) + _QSTR_OVERHEAD for name in names)
+                      + function_count * _FUNCTION_BYTES),
+        "transient" : node_count * _PARSE_BYTES_PER_NODE,
+        "imports" : imports,
+    }
+
+
+class RamEstimateCache:
+    """Analyses of source files by content hash"""
+    def __init__(self, directory):
+        self._directory = directory
+        self._entries = None
+        self._dirty = False
+
+    def analyze_file(self, path):
+        entries = self._get_entries()
+        content_hash = hash_file(path)
+        if content_hash not in entries:
+            with open(path, encoding="utf-8", errors="replace") as fp:
+                entries[content_hash] = analyze_source(fp.read())
+            self._dirty = True
+        return entries[content_hash]
+
+    def save(self):
+        if not self._dirty:
+            return
+        os.makedirs(self._directory, exist_ok=True)
+        path = os.path.join(self._directory, CACHE_FILE_NAME)
+        with open(path + ".tmp", "w", encoding="utf-8") as fp:
+            json.dump(self._entries, fp)
+        os.replace(path + ".tmp", path)
+        self._dirty = False
+
+    def _get_entries(self):
+        if self._entries is None:
+            try:
+                with open(os.path.join(self._directory, CACHE_FILE_NAME), encoding="utf-8") as fp:
+                    self._entries = json.load(fp)
+            except (OSError, ValueError):
+                self._entries = {}
+        return self._entries
+
+
+def _find_module_file(files, module_name):
+    """Returns device path of the module's file (or package's __init__) or None"""
+    relative = module_name.replace(".", "/")
+    for search_dir in _SEARCH_DIRS:
+        base = posixpath.join(search_dir, relative)
+        for candidate in [base + ".py", base + ".mpy",
+                          base + "/__init__.py", base + "/__init__.mpy"]:
+            if candidate in files:
+                return candidate
+    return None
+
+
+def _get_package_name(device_path, module_name):
+    if posixpath.basename(device_path).startswith("__init__."):
+        return module_name
+    return module_name.rpartition(".")[0]
+
+
+def _resolve_import(level, module, names, current_package):
+    """Returns absolute names of the modules imported by a statement and
+    names which are modules only if such files exist (from package import x)"""
+    if level > 0:
+        parts = current_package.split(".") if current_package else []
+        if level > 1:
+            parts = parts[:-(level - 1)]
+        base = ".".join(parts + ([module] if module else []))
+    else:
+        base = module
+
+    imported = []
+    if base:
+        # importing a.b.c imports a, a.b and a.b.c
+        pieces = base.split(".")
+        imported.extend(".".join(pieces[:i]) for i in range(1, len(pieces) + 1))
+    possible = [(base + "." + name) if base else name for name in names]
+    return imported, possible
+
+
+def estimate_project(files, is_builtin, cache, compiled=()):
+    """Estimates the heap needed by the main script of a project.
+
+    files is a dict from device path to local path (see sync.list_local_files)
+    for the source files, is_builtin tells whether a module comes with the
+    firmware, compiled contains device paths of the .py files which are
+    uploaded as .mpy. Returns ProjectEstimate or None if there is no main script.
+    """
+    main_path = next(("/" + name for name in MAIN_SCRIPT_CANDIDATES if "/" + name in files), None)
+    if main_path is None:
+        return None
+
+    modules = []
+    missing = set()
+    seen_paths = set()
+    # (device path, module name)
+    pending = [(main_path, "__main__")]
+    while pending:
+        device_path, module_name = pending.pop()
+        if device_path in seen_paths:
+            continue
+        seen_paths.add(device_path)
+
+        local_path = files[device_path]
+        if device_path.endswith(".mpy"):
+            # Imports of compiled modules are not known
+            resident = int(os.path.getsize(local_path) * _MPY_RESIDENT_FACTOR)
+            modules.append(ModuleEstimate(module_name, device_path, resident, None, True))
+            continue
+
+        try:
+            analysis = cache.analyze_file(local_path)
+        except (SyntaxError, ValueError):
+            logging.info("Can't analyze %s", local_path, exc_info=True)
+            continue
+        modules.append(ModuleEstimate(module_name, device_path, analysis["resident"],
+                                      analysis["transient"], device_path in compiled))
+
+        package = "" if module_name == "__main__" else _get_package_name(device_path, module_name)
+        for level, module, names in analysis["imports"]:
+            imported, possible = _resolve_import(level, module, names, package)
+            for name in imported + possible:
+                path = _find_module_file(files, name)
+                if path is not None:
+                    pending.append((path, name))
+                elif (name in imported and level == 0 and "." not in name
+                      and not is_builtin(name)):
+                    missing.add(name)
+
+    cache.save()
+    resident = sum(module.resident for module in modules)
+    # Modules are compiled one at a time, parse trees don't pile up
+    transient = max([module.transient for module in modules
+                     if module.transient is not None and not module.as_mpy] or [0])
+    return ProjectEstimate(main_path, sorted(modules, key=lambda module: module.path),
+                           sorted(missing), resident, resident + transient)
+
+
+def format_estimate(estimate, budget):
+    """Returns a table of the modules and the totals for showing in the shell"""
+    lines = ["%-30s %9s %14s" % ("Module", "resident", "parse (source)")]
+    for module in estimate.modules:
+        lines.append("%-30s %9d %14s%s" % (
+            module.path, module.resident,
+            "-" if module.transient is None else module.transient,
+            " (.mpy)" if module.as_mpy else ""))
+    lines.append("Estimated peak: %d bytes" % estimate.peak
+                 + ("" if budget is None else " of about %d available" % budget))
+    if estimate.missing:
+        lines.append("Not found in the project: " + ", ".join(estimate.missing))
+    return "\n".join(lines)
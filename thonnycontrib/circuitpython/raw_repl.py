@@ -0,0 +1,85 @@
+"""Raw-paste mode of the raw REPL.
+
+Raw-paste mode (supported by newer firmware) compiles the code as it
+arrives and uses window-based flow control, so the code can be sent without
+artificial delays. Device must be at the raw prompt when entering it.
+
+All functions expect an object with the interface of Thonny's SerialHelper.
+"""
+import struct
+
+RAW_PASTE_COMMAND = b"\x05A\x01"
+RAW_PASTE_SUPPORTED = b"R\x01"
+RAW_PASTE_NOT_SUPPORTED = b"R\x00"
+RAW_PASTE_WINDOW_INCREMENT = b"\x01"
+EOT = b"\x04"
+# What old firmware responds to RAW_PASTE_COMMAND (\x01 re-enters raw mode)
+RAW_REPL_BANNER_END = b"w REPL; CTRL-B to exit\r\n>"
+# Device acknowledges the end of data only after compiling the code,
+# which takes a while for long scripts on slow boards (pyboard.py waits as long)
+ACK_TIMEOUT = 10
+
+
+def enter_raw_paste(serial, timeout=2):
+    """Returns window size if device entered raw-paste mode.
+
+    Otherwise returns None and device remains at the raw prompt.
+    """
+    # Control bytes don't need the pauses of typed code
+    serial.write(RAW_PASTE_COMMAND, delay=0)
+    response = bytes(serial.read(2, timeout))
+    if response == RAW_PASTE_SUPPORTED:
+        return struct.unpack("<H", bytes(serial.read(2, timeout)))[0]
+    elif response == RAW_PASTE_NOT_SUPPORTED:
+        return None
+    else:
+        # Unknown command got ignored and raw mode was re-entered
+        serial.read_until(RAW_REPL_BANNER_END, timeout)
+        return None
+
+
+def raw_paste_write(serial, data, window_size, timeout=2, ack_timeout=ACK_TIMEOUT):
+    """Sends data in raw-paste mode and waits until device has compiled it.
+
+    Afterwards the device responds as in raw mode after "OK".
+    """
+    window_remaining = window_size
+    i = 0
+    while i < len(data):
+        while window_remaining == 0 or not serial.incoming_is_empty():
+            control = bytes(serial.read(1, timeout))
+            if control == RAW_PASTE_WINDOW_INCREMENT:
+                window_remaining += window_size
+            elif control == EOT:
+                # Device wants to end the transfer (eg. because of an error)
+                serial.write(EOT, delay=0)
+                return
+            else:
+                raise RuntimeError("Unexpected response during raw paste: %r" % control)
+
+        block = data[i : i + window_remaining]
+        # Flow control makes delays unnecessary
+        serial.write(block, block_size=len(block), delay=0)
+        window_remaining -= len(block)
+        i += len(block)
+
+    serial.write(EOT, delay=0)
+    # Window increments may still arrive before the acknowledgement
+    ack = serial.read_until(EOT, ack_timeout)
+    if ack.strip(RAW_PASTE_WINDOW_INCREMENT) != EOT:
+        raise RuntimeError("Could not complete raw paste: %r" % ack)
+
+
+def probe_raw_paste(serial, timeout=2):
+    """Returns True if device supports raw-paste mode.
+
+    Device must be at the raw prompt and it will be there after the call.
+    """
+    window_size = enter_raw_paste(serial, timeout)
+    if window_size is None:
+        return False
+
+    # Execute empty program to get back to the raw prompt
+    raw_paste_write(serial, b"", window_size, timeout)
+    serial.read_until(EOT + EOT + b">", timeout)
+    return True
@@ -0,0 +1,206 @@
+"""Stubs for different firmware versions and ports as layers over the common ones.
+
+The packaged api_stubs directory is the base layer. Directories under
+api_stubs/layers add or replace modules for a range of versions or for a
+port, as described in api_stubs/layers.json:
+
+    {"layers": [
+        {"name": "circuitpython-7", "min_version": "7", "removes": ["gamepad"]},
+        {"name": "raspberrypi", "mcu": "^rp2040",
+         "members": {"sys": {"platform": "RP2040"}}},
+        ...
+    ]}
+
+Layers matching the banner of the connected firmware are stacked in the
+listed order, later ones overriding earlier ones module by module. A module
+is looked up only when it is needed, so adding layers doesn't make
+connecting or completing slower.
+
+When a layer differs from the ones below only in the values of some
+constants, it gives them in "members" instead of a copy of the module
+(and needs no directory). String values may refer to the fields of the
+banner, eg. "{version}". Modules with such overrides are written patched
+into a directory of their own, named after their content, so they get
+their own completion index and jedi sees the same values.
+"""
+import ast
+import hashlib
+import json
+import logging
+import os.path
+import re
+import tempfile
+
+from thonnycontrib.circuitpython.completion_index import CompletionIndex, INDEX_FILE_NAME,\
+    build_completion_index, is_index_outdated, parse_completion_context
+from thonnycontrib.circuitpython.firmware_library import version_key
+
+PACKAGED_STUBS_PATH = os.path.join(os.path.dirname(__file__), "api_stubs")
+LAYERS_FILE_NAME = "layers.json"
+LAYERS_DIR_NAME = "layers"
+DEFAULT_OVERRIDES_PATH = os.path.join(tempfile.gettempdir(), "circuitpython_stub_overrides")
+
+
+def _layer_matches(spec, banner):
+    if "min_version" in spec and (
+            version_key(banner["version"])[:3] < version_key(spec["min_version"])[:3]):
+        return False
+    if "max_version" in spec and (
+            version_key(banner["version"])[:3] > version_key(spec["max_version"])[:3]):
+        return False
+    if "mcu" in spec and not re.search(spec["mcu"], banner["mcu"], re.IGNORECASE):
+        return False
+    return True
+
+
+def _fill_banner_fields(value, banner):
+    return value.format(**banner) if isinstance(value, str) else value
+
+
+def apply_member_overrides(source, members):
+    """Returns the source of a stub module with given constants replaced
+    (or added). Stub constants are one-line assignments."""
+    lines = source.splitlines()
+    remaining = dict(members)
+    for node in ast.parse(source).body:
+        if (isinstance(node, ast.Assign) and len(node.targets) == 1
+                and isinstance(node.targets[0], ast.Name)
+                and node.targets[0].id in remaining):
+            name = node.targets[0].id
+            lines[node.lineno - 1] = "%s = %r" % (name, remaining.pop(name))
+    lines.extend("%s = %r" % item for item in sorted(remaining.items()))
+    return "\n".join(lines) + "\n"
+
+
+def select_layers(banner, root=PACKAGED_STUBS_PATH):
+    """Returns (directory, removed module names, member overrides) triples for given
+    firmware banner (see firmware_info.parse_banner), most specific first.
+
+    Directory is None for layers which only override members. Member overrides
+    map module names to dicts from constant name to value.
+    Without a banner only the base layer is used.
+    """
+    layers = [(root, set(), {})]
+    if banner is None:
+        return layers
+
+    try:
+        with open(os.path.join(root, LAYERS_FILE_NAME), encoding="utf-8") as fp:
+            specs = json.load(fp)["layers"]
+    except (OSError, ValueError, KeyError):
+        logging.exception("Could not read stub layers from %s", root)
+        return layers
+
+    for spec in specs:
+        if _layer_matches(spec, banner):
+            path = os.path.join(root, LAYERS_DIR_NAME, spec["name"])
+            members = {module_name : {name : _fill_banner_fields(value, banner)
+                                      for name, value in values.items()}
+                       for module_name, values in spec.get("members", {}).items()}
+            layers.append((path if os.path.isdir(path) else None,
+                           set(spec.get("removes", [])), members))
+    layers.reverse()
+    return layers
+
+
+class StubLayers:
+    """Resolves modules and completions through a stack of stub directories
+    (see select_layers).
+
+    Modules with member overrides are written to overrides_path.
+    """
+    def __init__(self, layers, overrides_path=DEFAULT_OVERRIDES_PATH):
+        self._layers = layers
+        self._overrides_path = overrides_path
+        self._module_dirs = {}
+        self._indexes = {}
+
+    def get_paths(self):
+        """Directories for jedi's sys_path, most specific first"""
+        overridden = {module_name for _, _, members in self._layers for module_name in members}
+        patched_dirs = [self.find_module_dir(module_name) for module_name in sorted(overridden)]
+        return ([path for path in patched_dirs if path is not None]
+                + [path for path, _, _ in self._layers if path is not None])
+
+    def find_module_dir(self, module_name):
+        """Returns the directory providing the module or None"""
+        if module_name not in self._module_dirs:
+            result = None
+            # layers above the one providing the module may change its members
+            members = {}
+            for path, removed, layer_members in self._layers:
+                for name, value in layer_members.get(module_name, {}).items():
+                    members.setdefault(name, value)
+                if path is not None and os.path.isfile(os.path.join(path, module_name + ".py")):
+                    result = path
+                    break
+                if module_name in removed:
+                    break
+            if result is not None and members:
+                try:
+                    result = self._write_patched_module(module_name, result, members)
+                except OSError:
+                    logging.exception("Could not write stub of %s with overrides", module_name)
+            self._module_dirs[module_name] = result
+        return self._module_dirs[module_name]
+
+    def complete(self, text):
+        """Returns completions for the end of given line (text before the cursor)
+        as (name, kind, signature) triples and the prefix being completed,
+        or None if the stubs can't tell (eg. local names, aliases, variables).
+        """
+        context = parse_completion_context(text)
+        if context is None:
+            return None
+        parent, prefix = context
+
+        if parent == "":
+            result = {}
+            for path, _, _ in self._layers:
+                if path is None:
+                    continue
+                for entry in self._get_index(path).lookup("", prefix):
+                    if entry[0] not in result and self.find_module_dir(entry[0]) is not None:
+                        result[entry[0]] = entry
+            return sorted(result.values()), prefix
+
+        # Only known modules and their classes are answered here
+        path = self.find_module_dir(parent.split(".")[0])
+        if path is None:
+            return None
+        index = self._get_index(path)
+        if "." in parent and not index.lookup(parent):
+            # unknown attribute or one without members (eg. a constant)
+            return None
+        return index.lookup(parent, prefix), prefix
+
+    def close(self):
+        for index in self._indexes.values():
+            index.close()
+
+    def _write_patched_module(self, module_name, path, members):
+        """Returns the directory of the module with given members replaced"""
+        with open(os.path.join(path, module_name + ".py"), encoding="utf-8") as fp:
+            source = apply_member_overrides(fp.read(), members)
+
+        # Content addressed, so an existing directory is up to date
+        content_hash = hashlib.sha1(source.encode("utf-8")).hexdigest()
+        result = os.path.join(self._overrides_path, "%s-%s" % (module_name, content_hash[:16]))
+        target = os.path.join(result, module_name + ".py")
+        if not os.path.isfile(target):
+            os.makedirs(result, exist_ok=True)
+            with open(target + ".tmp", "w", encoding="utf-8") as fp:
+                fp.write(source)
+            os.replace(target + ".tmp", target)
+        return result
+
+    def _get_index(self, path):
+        if path not in self._indexes:
+            try:
+                # Installed package may be read-only, then older index is still good
+                if is_index_outdated(path) and os.access(path, os.W_OK):
+                    build_completion_index(path)
+            except (OSError, SyntaxError):
+                logging.exception("Could not build completion index for %s", path)
+            self._indexes[path] = CompletionIndex(os.path.join(path, INDEX_FILE_NAME))
+        return self._indexes[path]
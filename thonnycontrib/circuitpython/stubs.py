@@ -0,0 +1,155 @@
+"""Completion stubs generated from the modules of the connected device.
+
+The packaged api_stubs describe one old firmware on one board. Walking the
+modules of the actual device (in one script, one line of output per module)
+gives the names which are really there, and the result is stored per board
+and firmware version, so the walk is done only once after each update.
+
+Stubs have the same form as the packaged ones: functions without parameters,
+classes expanded one level and constants with their values.
+"""
+import ast
+import os.path
+import re
+import shutil
+import tempfile
+from textwrap import dedent
+
+from thonnycontrib.circuitpython.completion_index import build_completion_index
+
+# Marks a complete set of stubs in the cache
+COMPLETE_MARKER_FILE_NAME = ".complete"
+
+# Importing and describing all modules takes several seconds on slow boards
+INTROSPECTION_TIMEOUT = 60
+
+# Importing these has side effects or doesn't make sense for completion
+_SKIPPED_MODULES = {"main", "code", "boot", "webrepl", "_webrepl", "upysh"}
+
+# Longer constants (eg. docstrings) are not worth showing
+_MAX_CONSTANT_REPR_LENGTH = 60
+
+_INTROSPECTION_SCRIPT_TEMPLATE = dedent("""
+    def __stubs_(names):
+        import gc
+        def describe(obj, expand_classes):
+            result = []
+            for name in dir(obj):
+                if name.startswith("__"):
+                    continue
+                try:
+                    val = getattr(obj, name)
+                except Exception:
+                    result.append((name, "other", None, None))
+                    continue
+                if isinstance(val, type):
+                    result.append((name, "class", None,
+                                   describe(val, False) if expand_classes else None))
+                elif type(val) in (int, float, str, bool):
+                    rep = repr(val)
+                    result.append((name, "constant", rep if len(rep) <= %d else None, None))
+                elif callable(val):
+                    result.append((name, "function", None, None))
+                else:
+                    result.append((name, "other", None, None))
+            return result
+        for name in names:
+            try:
+                module = __import__(name)
+            except Exception:
+                continue
+            print(repr((name, describe(module, True))))
+            del module
+            gc.collect()
+    __stubs_(%%r)
+    del __stubs_
+""" % _MAX_CONSTANT_REPR_LENGTH).strip()
+
+
+def select_stub_modules(module_names):
+    """Leaves out names which can't or shouldn't be imported for introspection"""
+    return sorted(name for name in set(module_names)
+                  if not name.startswith("_") and "." not in name
+                  and name not in _SKIPPED_MODULES)
+
+
+def create_introspection_script(module_names):
+    return _INTROSPECTION_SCRIPT_TEMPLATE % (list(module_names),)
+
+
+def parse_introspection_output(out):
+    """Returns dict from module name to list of (name, kind, value, members)"""
+    result = {}
+    for line in out.decode("utf-8", "replace").splitlines():
+        if line.strip():
+            module_name, records = ast.literal_eval(line)
+            result[module_name] = records
+    return result
+
+
+def _render_records(records, indent, lines):
+    for name, kind, value, members in sorted(records, key=lambda record: record[0]):
+        if kind == "function":
+            lines.append(indent + "def " + name + "():")
+            lines.append(indent + "    pass")
+            lines.append("")
+        elif kind == "class" and members is not None:
+            lines.append("")
+            lines.append(indent + "class " + name + ":")
+            lines.append(indent + "    ''")
+            _render_records(members, indent + "    ", lines)
+        elif kind == "constant" and value is not None:
+            lines.append(indent + name + " = " + value)
+        else:
+            # keep only the name
+            lines.append(indent + name + " = None")
+
+
+def render_module_stub(records):
+    lines = []
+    _render_records(records, "", lines)
+    return "\n".join(lines) + "\n"
+
+
+def _to_dir_name(text):
+    return re.sub(r"[^A-Za-z0-9_.+-]+", "_", text).strip("_").lower() or "unknown"
+
+
+class StubCache:
+    """Generated stubs under directory/<board>/<firmware version>/"""
+    def __init__(self, directory):
+        self._directory = directory
+
+    def get_path(self, board_name, version):
+        """Returns the directory of complete stubs or None"""
+        path = self._get_target_path(board_name, version)
+        if os.path.isfile(os.path.join(path, COMPLETE_MARKER_FILE_NAME)):
+            return path
+        return None
+
+    def store(self, board_name, version, modules):
+        """Writes stub files for modules (see parse_introspection_output),
+        returns the directory"""
+        target = self._get_target_path(board_name, version)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        # Completion shouldn't see a half-written set of stubs
+        temp_dir = tempfile.mkdtemp(dir=os.path.dirname(target))
+        try:
+            for module_name, records in modules.items():
+                with open(os.path.join(temp_dir, module_name + ".py"), "w",
+                          encoding="utf-8", newline="\n") as fp:
+                    fp.write(render_module_stub(records))
+            build_completion_index(temp_dir)
+            with open(os.path.join(temp_dir, COMPLETE_MARKER_FILE_NAME), "w") as fp:
+                fp.write("")
+
+            if os.path.exists(target):
+                shutil.rmtree(target)
+            os.rename(temp_dir, target)
+        finally:
+            if os.path.exists(temp_dir):
+                shutil.rmtree(temp_dir)
+        return target
+
+    def _get_target_path(self, board_name, version):
+        return os.path.join(self._directory, _to_dir_name(board_name), _to_dir_name(version))
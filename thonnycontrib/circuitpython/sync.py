@@ -0,0 +1,329 @@
+"""Delta synchronization of a local project folder to a CircuitPython device.
+
+For every device (identified by microcontroller.cpu.uid) a manifest of
+content hashes of the uploaded files is kept on the host. Only files whose
+hash differs from the manifest get uploaded and only files which were
+uploaded earlier (ie. present in the manifest) get deleted.
+"""
+import hashlib
+import json
+import logging
+import os.path
+import posixpath
+from collections import namedtuple
+from textwrap import dedent
+
+from thonnycontrib.circuitpython.fs_index import normalize_device_path, DeviceFileIndex,\
+    walk_mount
+
+# Prints hex representation of the unique id of the MCU
+DEVICE_ID_SCRIPT = dedent("""
+    import microcontroller as __mc_
+    print("".join("%02x" % b for b in __mc_.cpu.uid))
+    del __mc_
+""").strip()
+
+# Keep the device from restarting code.py after each written file.
+# Prints whether autoreload was enabled before.
+DISABLE_AUTORELOAD_SCRIPT = dedent("""
+    import supervisor as __sv_
+    try:
+        print(__sv_.runtime.autoreload)
+        __sv_.runtime.autoreload = False
+    except AttributeError:
+        # older firmware can't tell, autoreload is enabled by default
+        print(True)
+        __sv_.disable_autoreload()
+    del __sv_
+""").strip()
+
+ENABLE_AUTORELOAD_SCRIPT = dedent("""
+    import supervisor as __sv_
+    try:
+        __sv_.runtime.autoreload = True
+    except AttributeError:
+        __sv_.enable_autoreload()
+    del __sv_
+""").strip()
+
+SyncPlan = namedtuple("SyncPlan", ["uploads", "deletions", "unchanged"])
+
+
+def disable_autoreload(execute):
+    """Returns True if autoreload was enabled.
+
+    execute runs given script and returns (out, err) bytes.
+    """
+    out, err = execute(DISABLE_AUTORELOAD_SCRIPT)
+    if err:
+        raise RuntimeError("Could not disable autoreload: %s" % err.decode("utf-8", "replace"))
+    return out.decode("utf-8").strip() == "True"
+
+
+def restore_autoreload(execute, was_enabled):
+    """Enables autoreload if it was enabled before disable_autoreload"""
+    if not was_enabled:
+        return
+    out, err = execute(ENABLE_AUTORELOAD_SCRIPT)
+    if out or err:
+        raise RuntimeError("Could not enable autoreload: %r, %r" % (out, err))
+
+
+def hash_file(path):
+    h = hashlib.sha1()
+    with open(path, "rb") as fp:
+        while True:
+            block = fp.read(64*1024)
+            if not block:
+                break
+            h.update(block)
+    return h.hexdigest()
+
+
+def is_excluded(name):
+    return name.startswith(".") or name == "__pycache__" or name.endswith((".pyc", ".pyo"))
+
+
+def list_local_files(local_root):
+    """Returns dict from device path to local path"""
+    result = {}
+    for dirpath, dirnames, filenames in os.walk(local_root):
+        dirnames[:] = sorted(name for name in dirnames if not is_excluded(name))
+        rel_dir = os.path.relpath(dirpath, local_root)
+        for name in filenames:
+            if not is_excluded(name):
+                result[normalize_device_path(os.path.join(rel_dir, name))] = os.path.join(dirpath, name)
+    return result
+
+
+def build_manifest(local_files):
+    """Returns dict from device path to (hash, size)"""
+    return {device_path : (hash_file(local_path), os.path.getsize(local_path))
+            for device_path, local_path in local_files.items()}
+
+
+def plan_sync(local_manifest, device_manifest, device_index=None):
+    """Compares local files to the ones uploaded earlier.
+
+    If device_index (DeviceFileIndex) is given, then manifest entries
+    are trusted only if file with same size is present on the device.
+    """
+    uploads = []
+    unchanged = []
+    for path in sorted(local_manifest):
+        hash_, size = local_manifest[path]
+        known = device_manifest.get(path)
+        if known is None or tuple(known) != (hash_, size):
+            uploads.append(path)
+        elif device_index is not None and device_index.is_filled():
+            info = device_index.get(path)
+            if info is None or info.is_dir or info.size != size:
+                # changed behind our back
+                uploads.append(path)
+            else:
+                unchanged.append(path)
+        else:
+            unchanged.append(path)
+
+    deletions = sorted(path for path in device_manifest if path not in local_manifest)
+    return SyncPlan(uploads, deletions, unchanged)
+
+
+class ManifestStore:
+    """Keeps one JSON manifest per device in given directory"""
+    def __init__(self, directory):
+        self._directory = directory
+
+    def load(self, device_id):
+        path = self._get_path(device_id)
+        if not os.path.exists(path):
+            return {}
+        try:
+            with open(path, encoding="utf-8") as fp:
+                return {key : tuple(value) for key, value in json.load(fp).items()}
+        except ValueError:
+            # corrupted manifest means full upload
+            return {}
+
+    def save(self, device_id, manifest):
+        os.makedirs(self._directory, exist_ok=True)
+        path = self._get_path(device_id)
+        with open(path + ".tmp", "w", encoding="utf-8") as fp:
+            json.dump(manifest, fp, indent=1, sort_keys=True)
+        os.replace(path + ".tmp", path)
+
+    def forget(self, device_id):
+        path = self._get_path(device_id)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def _get_path(self, device_id):
+        assert device_id and all(c.isalnum() for c in device_id), "Bad device id %r" % device_id
+        return os.path.join(self._directory, device_id + ".json")
+
+
+def _fsync_dir(path):
+    try:
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+    except OSError:
+        # some file systems don't support it for directories
+        logging.info("Could not sync directory %s", path, exc_info=True)
+
+
+class MountSyncTarget:
+    """Writes to the device's file system mounted at given directory.
+
+    Changes are forced to the device only by flush.
+    """
+    def __init__(self, mount):
+        self._mount = mount
+        self._unflushed = []
+
+    def upload_file(self, source, target):
+        target = self._to_host_path(target)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(source, "rb") as src, open(target, "wb") as dst:
+            dst.write(src.read())
+        self._unflushed.append(target)
+
+    def remove_file(self, target):
+        target = self._to_host_path(target)
+        if os.path.exists(target):
+            os.remove(target)
+            self._unflushed.append(target)
+
+    def flush(self):
+        # Force writes to the device to avoid data corruption
+        # when user resets or plugs out the device. Only the touched files
+        # and directories, os.sync would flush all file systems of the host.
+        mount = os.path.normpath(self._mount)
+        dirs = set()
+        for path in self._unflushed:
+            if os.path.isfile(path):
+                with open(path, "r+b") as fp:
+                    os.fsync(fp.fileno())
+            # entries of new, removed and created parent directories
+            path = os.path.dirname(path)
+            while path not in dirs and len(path) >= len(mount):
+                dirs.add(path)
+                path = os.path.dirname(path)
+
+        if os.name == "posix":
+            # Windows can't open directories, but its FAT driver writes them on file close
+            for path in sorted(dirs):
+                _fsync_dir(path)
+        self._unflushed = []
+
+    def _to_host_path(self, device_path):
+        return os.path.join(self._mount, *device_path.strip("/").split("/"))
+
+
+class SerialSyncTarget:
+    """Writes to the device via raw REPL.
+
+    execute runs given script and returns (out, err) bytes,
+    upload transfers a local file to given device path.
+    """
+    def __init__(self, execute, upload):
+        self._execute = execute
+        self._upload = upload
+        self._known_dirs = {"/"}
+
+    def upload_file(self, source, target):
+        self._ensure_dir(posixpath.dirname(target))
+        self._upload(source, target)
+
+    def remove_file(self, target):
+        self._run(dedent("""
+            import os as __os_
+            try:
+                __os_.remove(%r)
+            except OSError:
+                pass
+            del __os_
+        """ % target).strip())
+
+    def _ensure_dir(self, path):
+        if path in self._known_dirs:
+            return
+        self._ensure_dir(posixpath.dirname(path))
+        self._run(dedent("""
+            import os as __os_
+            try:
+                __os_.mkdir(%r)
+            except OSError:
+                pass
+            del __os_
+        """ % path).strip())
+        self._known_dirs.add(path)
+
+    def flush(self):
+        # each command completes only after the device has done its job
+        pass
+
+    def _run(self, script):
+        out, err = self._execute(script)
+        if out or err:
+            raise RuntimeError("Unexpected response from device: %r, %r" % (out, err))
+
+
+def apply_sync_plan(plan, local_files, local_manifest, device_manifest, target,
+                    on_progress=None):
+    """Executes the plan and updates device_manifest in place.
+
+    device_manifest reflects the completed operations even if an
+    exception interrupts the process.
+    """
+    for path in plan.uploads:
+        if on_progress is not None:
+            on_progress("upload", path)
+        target.upload_file(local_files[path], path)
+        device_manifest[path] = local_manifest[path]
+
+    for path in plan.deletions:
+        if on_progress is not None:
+            on_progress("delete", path)
+        target.remove_file(path)
+        del device_manifest[path]
+
+
+def sync_device(device, local_files, store, mount=None):
+    """Brings the files of a device.Device up to date with local_files.
+
+    Files are written to mount if given, otherwise via serial.
+    Returns the executed SyncPlan.
+    """
+    device_id = device.get_device_id()
+    local_manifest = build_manifest(local_files)
+    device_manifest = store.load(device_id)
+    index = DeviceFileIndex()
+    index.fill(walk_mount(mount) if mount else device.list_files())
+    plan = plan_sync(local_manifest, device_manifest, index)
+    if not plan.uploads and not plan.deletions:
+        return plan
+
+    if mount:
+        target = MountSyncTarget(mount)
+    else:
+        target = SerialSyncTarget(device.execute, device.upload)
+
+    was_enabled = disable_autoreload(device.execute)
+    try:
+        apply_sync_plan(plan, local_files, local_manifest, device_manifest, target)
+        target.flush()
+    except BaseException:
+        # The original error is more important than this one
+        try:
+            restore_autoreload(device.execute, was_enabled)
+        except Exception:
+            logging.exception("Could not restore autoreload")
+        raise
+    finally:
+        store.save(device_id, device_manifest)
+    restore_autoreload(device.execute, was_enabled)
+
+    return plan
@@ -0,0 +1,270 @@
+"""Parsing UF2 firmware images and checking them against the bootloader.
+
+https://github.com/microsoft/uf2
+"""
+import hashlib
+import os.path
+import struct
+from collections import namedtuple
+
+BLOCK_SIZE = 512
+MAGIC_START0 = 0x0A324655
+MAGIC_START1 = 0x9E5D5157
+MAGIC_END = 0x0AB16F30
+
+FLAG_NOT_MAIN_FLASH = 0x00000001
+FLAG_FILE_CONTAINER = 0x00001000
+FLAG_FAMILY_ID_PRESENT = 0x00002000
+
+MAX_PAYLOAD_SIZE = 476
+
+# magicStart0, magicStart1, flags, targetAddr, payloadSize, blockNo, numBlocks, familyID/fileSize
+_HEADER = struct.Struct("<8I")
+_MAGIC_END_OFFSET = BLOCK_SIZE - 4
+_MAGIC_END = struct.Struct("<I")
+
+# Blocks are read in batches for speed
+_READ_SIZE = BLOCK_SIZE * 128
+
+Uf2Info = namedtuple("Uf2Info", ["num_blocks", "family_ids", "min_address", "max_address",
+                                 "payload_size"])
+
+# Family ID -> prefixes of Board-ID in INFO_UF2.TXT for the chips of this family
+FAMILY_BOARD_ID_PREFIXES = {
+    0x68ed2b88 : ("SAMD21",),
+    0x1851780a : ("SAML21",),
+    0x55114460 : ("SAMD51", "SAME51", "SAME53", "SAME54"),
+    0xada52840 : ("NRF52840",),
+    0x621e937a : ("NRF52833",),
+    0xe48bff56 : ("RPI-RP2", "RP2040"),
+    0xe48bff59 : ("RP2350",),
+    0xe48bff5a : ("RP2350",),
+    0xe48bff5b : ("RP2350",),
+    0xbfdd4eee : ("ESP32S2", "ESP32-S2"),
+    0xc47e5767 : ("ESP32S3", "ESP32-S3"),
+    0x57755a57 : ("STM32F4",),
+    0x00ff6919 : ("STM32L4",),
+    0x4fb2d5bd : ("MIMXRT10",),
+}
+
+# Board-ID prefix -> (lowest, highest + 1) application address.
+# Used when the image doesn't specify family (older SAMD images)
+BOARD_ID_ADDRESS_RANGES = {
+    "SAMD21" : (0x2000, 0x40000),
+    "SAMD51" : (0x4000, 0x200000),
+    "NRF52840" : (0x1000, 0x100000),
+    "RPI-RP2" : (0x10000000, 0x11000000),
+}
+
+
+class Uf2Error(ValueError):
+    pass
+
+
+def parse_uf2(path):
+    """Validates the structure of the UF2 file and collects information about it.
+
+    Reads the file in batches without copying the blocks.
+    """
+    size = os.path.getsize(path)
+    if size == 0 or size % BLOCK_SIZE != 0:
+        raise Uf2Error("File size (%d) is not a multiple of %d" % (size, BLOCK_SIZE))
+
+    buf = bytearray(_READ_SIZE)
+    view = memoryview(buf)
+    family_ids = set()
+    min_address = None
+    max_address = None
+    payload_size = 0
+    num_main_blocks = 0
+    expected_block_no = 0
+    expected_num_blocks = None
+    file_block_index = 0
+
+    with open(path, "rb") as fp:
+        while True:
+            count = fp.readinto(buf)
+            if not count:
+                break
+            if count % BLOCK_SIZE != 0:
+                raise Uf2Error("File changed while reading")
+
+            for offset in range(0, count, BLOCK_SIZE):
+                (magic0, magic1, flags, address, block_payload_size,
+                 block_no, num_blocks, family_or_size) = _HEADER.unpack_from(view, offset)
+                magic_end = _MAGIC_END.unpack_from(view, offset + _MAGIC_END_OFFSET)[0]
+
+                if magic0 != MAGIC_START0 or magic1 != MAGIC_START1 or magic_end != MAGIC_END:
+                    raise Uf2Error("Block %d has wrong magic numbers" % file_block_index)
+
+                if block_payload_size > MAX_PAYLOAD_SIZE:
+                    raise Uf2Error("Block %d has invalid payload size %d"
+                                   % (file_block_index, block_payload_size))
+
+                # numbering may restart when several images are concatenated
+                if expected_num_blocks is None or expected_block_no == expected_num_blocks:
+                    expected_block_no = 0
+                    expected_num_blocks = num_blocks
+
+                if block_no != expected_block_no or num_blocks != expected_num_blocks:
+                    raise Uf2Error("Block %d is numbered %d/%d, expected %d/%d"
+                                   % (file_block_index, block_no, num_blocks,
+                                      expected_block_no, expected_num_blocks))
+                expected_block_no += 1
+                file_block_index += 1
+
+                if flags & (FLAG_NOT_MAIN_FLASH | FLAG_FILE_CONTAINER):
+                    continue
+
+                num_main_blocks += 1
+                payload_size += block_payload_size
+                if flags & FLAG_FAMILY_ID_PRESENT:
+                    family_ids.add(family_or_size)
+                if min_address is None or address < min_address:
+                    min_address = address
+                if max_address is None or address + block_payload_size > max_address:
+                    max_address = address + block_payload_size
+
+    if expected_block_no != expected_num_blocks:
+        raise Uf2Error("File is truncated, it has %d of %d blocks"
+                       % (expected_block_no, expected_num_blocks))
+
+    if num_main_blocks == 0:
+        raise Uf2Error("File doesn't contain any data for the main flash")
+
+    return Uf2Info(num_main_blocks, family_ids, min_address, max_address, payload_size)
+
+
+def read_bootloader_info(volume):
+    """Returns the fields of INFO_UF2.TXT as dict (eg. "Model", "Board-ID")"""
+    result = {}
+    with open(os.path.join(volume, "INFO_UF2.TXT"), encoding="utf-8", errors="replace") as fp:
+        for line in fp:
+            if ":" in line:
+                key, value = line.split(":", 1)
+                result[key.strip()] = value.strip()
+    return result
+
+
+def _find_prefix(board_id, prefixes):
+    board_id = board_id.upper()
+    for prefix in prefixes:
+        if board_id.startswith(prefix):
+            return prefix
+    return None
+
+
+def check_compatibility(uf2_info, bootloader_info):
+    """Raises Uf2Error if the image is known to be meant for another chip.
+
+    If there is not enough information for deciding, then the image is accepted.
+    """
+    board_id = bootloader_info.get("Board-ID", "")
+    model = bootloader_info.get("Model", board_id or "this device")
+
+    known_families = {family_id for family_id in uf2_info.family_ids
+                      if family_id in FAMILY_BOARD_ID_PREFIXES}
+    all_prefixes = [prefix for prefixes in FAMILY_BOARD_ID_PREFIXES.values()
+                    for prefix in prefixes]
+    if known_families and _find_prefix(board_id, all_prefixes) is not None:
+        for family_id in known_families:
+            if _find_prefix(board_id, FAMILY_BOARD_ID_PREFIXES[family_id]) is not None:
+                break
+        else:
+            targets = sorted(FAMILY_BOARD_ID_PREFIXES[family_id][0] for family_id in known_families)
+            raise Uf2Error("Firmware is meant for %s, but %s has %s"
+                           % (" / ".join(targets), model, board_id))
+
+    range_prefix = _find_prefix(board_id, BOARD_ID_ADDRESS_RANGES)
+    if range_prefix is not None:
+        low, high = BOARD_ID_ADDRESS_RANGES[range_prefix]
+        if uf2_info.min_address < low or uf2_info.max_address > high:
+            raise Uf2Error("Firmware targets addresses 0x%x..0x%x, "
+                           "but %s (%s) accepts only 0x%x..0x%x"
+                           % (uf2_info.min_address, uf2_info.max_address, model, board_id,
+                              low, high))
+
+
+def iter_main_blocks(path):
+    """Yields (target address, payload) of the blocks meant for the main flash"""
+    buf = bytearray(_READ_SIZE)
+    view = memoryview(buf)
+    with open(path, "rb") as fp:
+        while True:
+            count = fp.readinto(buf)
+            if count < BLOCK_SIZE:
+                return
+
+            for offset in range(0, count - count % BLOCK_SIZE, BLOCK_SIZE):
+                flags, address, payload_size = struct.unpack_from("<3I", view, offset + 8)
+                if flags & (FLAG_NOT_MAIN_FLASH | FLAG_FILE_CONTAINER):
+                    continue
+                payload_size = min(payload_size, MAX_PAYLOAD_SIZE)
+                yield address, bytes(view[offset + 32 : offset + 32 + payload_size])
+
+
+def find_mismatches(source_path, current_path):
+    """Compares the payload of the image with the flash content read back from
+    the bootloader (CURRENT.UF2).
+
+    Only hashes of the source blocks are kept in memory and the read-back is
+    streamed in one pass (and stopped after the last address of the source),
+    so block sizes of the files don't need to match. Returns list of
+    (address, size) of the source blocks which differ or are missing.
+    """
+    expected = sorted((address, len(payload), hashlib.sha1(payload).digest())
+                      for address, payload in iter_main_blocks(source_path))
+    if not expected:
+        return []
+    end_address = max(address + size for address, size, _ in expected)
+
+    mismatches = []
+    # hashers for source blocks which have been partly covered by the read-back
+    hashers = {}
+    next_index = 0
+    prev_address = -1
+
+    for address, payload in iter_main_blocks(current_path):
+        if address < prev_address:
+            raise Uf2Error("Blocks of %s are not in address order" % current_path)
+        prev_address = address
+        payload_end = address + len(payload)
+
+        # source blocks ending before this payload can't get any more data
+        while next_index < len(expected) and expected[next_index][0] < payload_end:
+            hashers[next_index] = (hashlib.sha1(), 0)
+            next_index += 1
+
+        for i in sorted(hashers):
+            block_address, block_size, digest = expected[i]
+            hasher, covered = hashers[i]
+            start = max(block_address + covered, address)
+            end = min(block_address + block_size, payload_end)
+            if start > block_address + covered:
+                # gap in the read-back
+                mismatches.append((block_address, block_size))
+                del hashers[i]
+                continue
+            if end > start:
+                hasher.update(payload[start - address : end - address])
+                covered += end - start
+                hashers[i] = (hasher, covered)
+            if covered == block_size:
+                if hasher.digest() != digest:
+                    mismatches.append((block_address, block_size))
+                del hashers[i]
+
+        if payload_end >= end_address and not hashers and next_index == len(expected):
+            break
+
+    # blocks not (fully) present in the read-back
+    mismatches.extend((expected[i][0], expected[i][1]) for i in hashers)
+    mismatches.extend((address, size) for address, size, _ in expected[next_index:])
+    return sorted(mismatches)
+
+
+def format_mismatches(mismatches, max_count=5):
+    shown = ", ".join("0x%x (%d bytes)" % item for item in mismatches[:max_count])
+    if len(mismatches) > max_count:
+        shown += " and %d more" % (len(mismatches) - max_count)
+    return "%d block(s) differ after flashing: %s" % (len(mismatches), shown)
@@ -0,0 +1,131 @@
+"""Background detection of appearing and disappearing bootloader volumes"""
+import logging
+import os.path
+import platform
+import select
+import threading
+import time
+
+from thonnycontrib.circuitpython.volumes import list_removable_volume_candidates
+
+UF2_INFO_FILE_NAME = "INFO_UF2.TXT"
+
+
+class VolumeWatcher:
+    """Reports volumes containing the marker file via callbacks.
+
+    On Linux it sleeps until the kernel reports a change in the mount table,
+    elsewhere it polls the (cheap) list of removable volumes at low rate.
+    Marker file is checked only once for each newly mounted volume.
+
+    NB! Callbacks are called in the background thread.
+    """
+    def __init__(self, on_appeared, on_disappeared, marker_file_name=UF2_INFO_FILE_NAME,
+                 poll_interval=1.0, list_candidates=list_removable_volume_candidates):
+        self._on_appeared = on_appeared
+        self._on_disappeared = on_disappeared
+        self._marker_file_name = marker_file_name
+        self._poll_interval = poll_interval
+        self._list_candidates = list_candidates
+
+        self._mounted = set()
+        self._matching = set()
+        self._stopped = threading.Event()
+        self._wakeup_read_fd = None
+        self._wakeup_write_fd = None
+        self._thread = None
+
+    def start(self):
+        assert self._thread is None
+        if platform.system() == "Linux" and hasattr(select, "poll"):
+            self._wakeup_read_fd, self._wakeup_write_fd = os.pipe()
+            target = self._watch_mount_table
+        else:
+            target = self._poll
+        self._thread = threading.Thread(target=target, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._stopped.is_set():
+            return
+        self._stopped.set()
+        if self._wakeup_write_fd is not None:
+            try:
+                os.write(self._wakeup_write_fd, b"x")
+            except OSError:
+                # watcher thread has already quit
+                pass
+            os.close(self._wakeup_write_fd)
+
+    def get_volumes(self):
+        return set(self._matching)
+
+    def rescan(self):
+        candidates = set(self._list_candidates())
+
+        for vol in self._mounted - candidates:
+            if vol in self._matching:
+                self._matching.remove(vol)
+                self._on_disappeared(vol)
+
+        for vol in sorted(candidates - self._mounted):
+            if os.path.exists(os.path.join(vol, self._marker_file_name)):
+                self._matching.add(vol)
+                self._on_appeared(vol)
+
+        self._mounted = candidates
+
+    def _poll(self):
+        while not self._stopped.is_set():
+            self._safe_rescan()
+            self._stopped.wait(self._poll_interval)
+
+    def _watch_mount_table(self):
+        try:
+            with open("/proc/self/mounts", "rb") as fp:
+                poller = select.poll()
+                # Mount table signals changes with POLLPRI/POLLERR
+                poller.register(fp.fileno(), select.POLLPRI | select.POLLERR)
+                poller.register(self._wakeup_read_fd, select.POLLIN)
+                self._safe_rescan()
+
+                while not self._stopped.is_set():
+                    events = poller.poll()
+                    if any(fd == fp.fileno() for fd, _ in events):
+                        fp.seek(0)
+                        fp.read()
+                        self._safe_rescan()
+        except OSError:
+            logging.exception("Can't watch mount table, falling back to polling")
+            self._poll()
+        finally:
+            os.close(self._wakeup_read_fd)
+
+    def _safe_rescan(self):
+        try:
+            self.rescan()
+        except Exception:
+            logging.exception("Problem when scanning volumes")
+
+
+class NewVolumeWait:
+    """Waiting for a volume which wasn't there at the start (eg. the bootloader
+    volume of a device which was asked to restart).
+
+    get_volumes returns the current volumes (eg. VolumeWatcher.get_volumes).
+    check doesn't block, it's meant to be called periodically from the
+    owner's loop (eg. Tk's after-callback).
+    """
+    def __init__(self, get_volumes, timeout):
+        self._get_volumes = get_volumes
+        self.known_volumes = set(get_volumes())
+        self.timeout = timeout
+        self._deadline = time.time() + timeout
+
+    def check(self):
+        """Returns the set of new volumes (empty if there are none yet).
+        Raises TimeoutError if none appeared in time."""
+        new_volumes = set(self._get_volumes()) - self.known_volumes
+        if not new_volumes and time.time() > self._deadline:
+            raise TimeoutError("No new volume in %s seconds" % self.timeout)
+        return new_volumes
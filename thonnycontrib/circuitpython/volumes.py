@@ -0,0 +1,226 @@
+"""Helpers for relating mounted volumes to USB serial ports"""
+import os.path
+import platform
+import re
+
+from thonnycontrib.circuitpython.boards import DEFAULT_MOUNT_LABEL
+from thonnycontrib.circuitpython.firmware_info import BOOT_OUT_FILE_NAME
+
+
+def _unescape_mount_field(s):
+    # /proc/mounts escapes space, tab, newline and backslash as octal
+    return (s.replace("\\040", " ").replace("\\011", "\t")
+            .replace("\\012", "\n").replace("\\134", "\\"))
+
+
+def read_linux_mount_entries():
+    """Returns list of (source device, mount point, file system type) triples"""
+    result = []
+    with open("/proc/self/mounts", encoding="utf-8") as fp:
+        for line in fp:
+            parts = line.split()
+            if len(parts) >= 3:
+                result.append((_unescape_mount_field(parts[0]),
+                               _unescape_mount_field(parts[1]),
+                               parts[2]))
+    return result
+
+
+def read_linux_mounts():
+    """Returns list of (source device, mount point) pairs"""
+    return [(source, mount_point) for source, mount_point, _ in read_linux_mount_entries()]
+
+
+# USB mass storage of microcontrollers uses FAT
+_REMOVABLE_FS_TYPES = {"vfat", "msdos", "fat", "exfat", "fuseblk"}
+
+
+def list_removable_volume_candidates():
+    """Lists mount points which may belong to a USB drive of a microcontroller.
+
+    Unlike thonny.misc_utils.list_volumes, this doesn't launch processes
+    and leaves out pseudo, network and system file systems where possible.
+    """
+    system = platform.system()
+    if system == "Linux":
+        return [mount_point for _, mount_point, fs_type in read_linux_mount_entries()
+                if fs_type in _REMOVABLE_FS_TYPES]
+    elif system == "Darwin":
+        try:
+            return [os.path.join("/Volumes", name) for name in os.listdir("/Volumes")]
+        except OSError:
+            return []
+    elif system == "Windows":
+        import ctypes
+        DRIVE_REMOVABLE = 2
+        drive_mask = ctypes.windll.kernel32.GetLogicalDrives()  # @UndefinedVariable
+        result = []
+        # A: is usually a floppy which may hang when accessed
+        for i, letter in enumerate("BCDEFGHIJKLMNOPQRSTUVWXYZ", start=1):
+            path = "%s:\\" % letter
+            # Drive type is known without touching the (network) drive
+            if (drive_mask & (1 << i)
+                and ctypes.windll.kernel32.GetDriveTypeW(path) == DRIVE_REMOVABLE):  # @UndefinedVariable
+                result.append(path)
+        return result
+    else:
+        return []
+
+
+_SYSFS_DIR = "/sys"
+
+
+def _get_usb_device_sysfs_path(port):
+    tty_name = os.path.basename(os.path.realpath(port))
+    interface_path = os.path.realpath(os.path.join(_SYSFS_DIR, "class", "tty", tty_name, "device"))
+    if not os.path.exists(interface_path):
+        return None
+    # tty device belongs to an interface of the USB device
+    return os.path.dirname(interface_path)
+
+
+def _get_block_device_sysfs_path(source):
+    if not source.startswith("/dev/"):
+        return None
+    block_name = os.path.basename(os.path.realpath(source))
+    path = os.path.join(_SYSFS_DIR, "class", "block", block_name)
+    if not os.path.exists(path):
+        return None
+    return os.path.realpath(path)
+
+
+def find_mounts_of_port(port, mounts=None):
+    """Returns mount points backed by the same USB device as given serial port.
+
+    Returns None if this can't be determined on current platform.
+    """
+    if platform.system() != "Linux":
+        return None
+
+    usb_path = _get_usb_device_sysfs_path(port)
+    if usb_path is None:
+        return None
+
+    if mounts is None:
+        mounts = read_linux_mounts()
+
+    result = []
+    for source, mount_point in mounts:
+        block_path = _get_block_device_sysfs_path(source)
+        if block_path is not None and block_path.startswith(usb_path + "/"):
+            result.append(mount_point)
+    return result
+
+
+def get_usb_location(port):
+    """Returns sysfs path of the USB device of given serial port or None.
+
+    The path reflects the physical USB port, so it stays the same when the
+    device restarts in another mode (eg. bootloader).
+    """
+    if platform.system() != "Linux":
+        return None
+    return _get_usb_device_sysfs_path(port)
+
+
+def is_mount_at_usb_location(mount_point, location, mounts=None):
+    if mounts is None:
+        mounts = read_linux_mounts()
+
+    for source, candidate in mounts:
+        if candidate == mount_point:
+            block_path = _get_block_device_sysfs_path(source)
+            return block_path is not None and block_path.startswith(location + "/")
+    return False
+
+
+def _get_windows_volume_label(path):
+    import ctypes
+    buf = ctypes.create_unicode_buffer(261)
+    if not ctypes.windll.kernel32.GetVolumeInformationW(  # @UndefinedVariable
+            path, buf, len(buf), None, None, None, None, 0):
+        return None
+    return buf.value
+
+
+def find_volumes_by_label(label, candidates=None):
+    """Returns removable volumes which may have given label"""
+    if candidates is None:
+        candidates = list_removable_volume_candidates()
+
+    if platform.system() == "Windows":
+        return [vol for vol in candidates
+                if (_get_windows_volume_label(vol) or "").upper() == label.upper()]
+
+    # Mount point is named after the label, automounters add a number
+    # when several volumes have the same label (CIRCUITPY1 on Linux,
+    # "CIRCUITPY 1" on macOS)
+    regex = re.compile(re.escape(label) + r"( ?\d+)?$")
+    return [vol for vol in candidates if regex.match(os.path.basename(vol.rstrip("/")))]
+
+
+def _normalize_boot_out(text):
+    return text.replace("\r\n", "\n")
+
+
+def _read_boot_out_text(volume):
+    try:
+        with open(os.path.join(volume, BOOT_OUT_FILE_NAME), "rb") as fp:
+            return _normalize_boot_out(fp.read().decode("utf-8", "replace"))
+    except OSError:
+        return None
+
+
+def find_device_mount(port, label, boot_out, candidates=None, mount_label=DEFAULT_MOUNT_LABEL):
+    """Returns the mount point of the device at given serial port or None
+    if it can't be told.
+
+    label and boot_out (content of boot_out.txt or None) are read from the
+    device via serial. Firmwares older than 3.0 can't tell the label, then
+    mount_label of the board (see boards.Board) is assumed. Recent firmwares
+    write unique id of the MCU into boot_out.txt, so it tells apart volumes
+    of several identical boards.
+    """
+    volumes = find_volumes_by_label(label or mount_label, candidates)
+    if len(volumes) > 1:
+        port_mounts = find_mounts_of_port(port)
+        if port_mounts is not None:
+            volumes = [vol for vol in volumes if vol in port_mounts]
+
+    if boot_out is not None:
+        # Also checks a single candidate, the device itself may have its drive disabled
+        boot_out = _normalize_boot_out(boot_out)
+        volumes = [vol for vol in volumes if _read_boot_out_text(vol) == boot_out]
+
+    return volumes[0] if len(volumes) == 1 else None
+
+
+class MountPairings:
+    """Remembers mount points of devices by their USB serial number.
+
+    A remembered mount is used only while it still shows the boot_out.txt
+    of its device.
+    """
+    def __init__(self):
+        self._entries = {}
+
+    def get(self, serial_number):
+        entry = self._entries.get(serial_number)
+        if entry is None:
+            return None
+
+        mount, boot_out = entry
+        if os.path.isdir(mount) and (boot_out is None
+                                     or _read_boot_out_text(mount) == boot_out):
+            return mount
+
+        del self._entries[serial_number]
+        return None
+
+    def put(self, serial_number, mount, boot_out):
+        self._entries[serial_number] = (
+            mount, None if boot_out is None else _normalize_boot_out(boot_out))
+
+
+def is_writable_dir(path):
+    return os.path.isdir(path) and os.access(path, os.W_OK)